@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Load test and latency benchmark for the Claude Execution Server
+Starts the Flask or asyncio server with fake-claude.py in place of claude
+(or targets a running server with --url), drives /execute, streaming
+/execute and /execute-async at a given concurrency, and reports latency
+percentiles, throughput and the server's memory use. Only needs the
+standard library on the client side.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_CLAUDE = os.path.join(SCRIPT_DIR, 'fake-claude.py')
+SERVERS = {
+    'fixed': os.path.join(SCRIPT_DIR, 'claude-execution-server-fixed.py'),
+    'async': os.path.join(SCRIPT_DIR, 'claude-execution-server-async.py')
+}
+MODES = ('execute', 'stream', 'async')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir):
+    """Start a server that runs fake-claude.py as the current user; returns (process, url)"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        CLAUDE_BIN=FAKE_CLAUDE,
+        CLAUDE_RUN_AS='',
+        CLAUDE_SERVER_HOST='127.0.0.1',
+        CLAUDE_SERVER_PORT=str(port),
+        CLAUDE_MAX_WORKERS=str(args.workers),
+        CLAUDE_JOB_DB=os.path.join(workdir, 'jobs.db'),
+        CLAUDE_OUTPUT_DIR=os.path.join(workdir, 'job-output'),
+        CLAUDE_CACHE_TTL='0',
+        FAKE_CLAUDE_STARTUP=str(args.startup)
+    )
+    if args.runner_pool is not None:
+        env['CLAUDE_RUNNER_POOL'] = str(args.runner_pool)
+
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, SERVERS[args.server]], env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}, see {log.name}")
+        try:
+            with urllib.request.urlopen(f'{url}/health', timeout=1):
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Server did not answer /health within 30s, see {log.name}")
+
+
+def read_rss(pid):
+    """Resident set size of a process in bytes, or None if unavailable"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler(threading.Thread):
+    """Samples a process's RSS in the background and keeps the peak"""
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = read_rss(self.pid)
+            if rss:
+                self.peak = max(self.peak, rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def post(url, body, timeout):
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'}
+    )
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def run_execute(base_url, prompt, args):
+    """Blocking /execute; returns (ok, first output time, output lines)"""
+    with post(f'{base_url}/execute', {'prompt': prompt, 'cache': False}, args.timeout) as response:
+        result = json.loads(response.read())
+    lines = (result.get('output') or '').count('\n')
+    return result.get('status') == 'completed' and result.get('return_code') == 0, None, lines
+
+
+def run_stream(base_url, prompt, args):
+    """Streaming /execute, reading NDJSON events as they arrive"""
+    started = time.monotonic()
+    first_output = None
+    lines = 0
+    ok = False
+    body = {'prompt': prompt, 'stream': True, 'cache': False}
+    with post(f'{base_url}/execute', body, args.timeout) as response:
+        for raw in response:
+            event = json.loads(raw)
+            if event['status'] == 'running':
+                if first_output is None:
+                    first_output = time.monotonic() - started
+                lines += event.get('type') == 'stdout'
+            elif event['status'] not in ('queued', 'heartbeat'):
+                ok = event['status'] == 'completed'
+    return ok, first_output, lines
+
+
+def run_async(base_url, prompt, args):
+    """/execute-async, then poll /job/<id> until the job finishes"""
+    with post(f'{base_url}/execute-async', {'prompt': prompt, 'cache': False}, args.timeout) as response:
+        job_id = json.loads(response.read())['job_id']
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        with urllib.request.urlopen(f'{base_url}/job/{job_id}', timeout=args.timeout) as response:
+            job = json.loads(response.read())
+        if job['status'] not in ('queued', 'running'):
+            lines = (job.get('output') or '').count('\n')
+            return job['status'] == 'completed' and job.get('return_code') == 0, None, lines
+        time.sleep(args.poll)
+    return False, None, 0
+
+
+RUNNERS = {'execute': run_execute, 'stream': run_stream, 'async': run_async}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def run_mode(mode, base_url, args, server_pid):
+    """Send args.requests requests with args.concurrency in flight; returns a summary dict"""
+    workload = f'lines={args.lines} bytes={args.line_bytes} rate={args.rate} duration={args.duration}'
+    latencies = []
+    first_outputs = []
+    errors = []
+    output_lines = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal output_lines
+        prompt = f'bench {mode} {i} {time.time()} {workload}'
+        started = time.monotonic()
+        try:
+            ok, first_output, lines = RUNNERS[mode](base_url, prompt, args)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.monotonic() - started
+        with lock:
+            if not ok:
+                errors.append('job did not complete')
+                return
+            latencies.append(elapsed)
+            output_lines += lines
+            if first_output is not None:
+                first_outputs.append(first_output)
+
+    sampler = RssSampler(server_pid) if server_pid else None
+    rss_before = read_rss(server_pid) if server_pid else None
+    if sampler:
+        sampler.start()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    wall = time.monotonic() - started
+    rss_peak = sampler.stop() if sampler else None
+
+    return {
+        'mode': mode,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'completed': len(latencies),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:5],
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'lines_per_second': round(output_lines / wall, 1) if wall else None,
+        'latency': {
+            name: round(value, 4) if value is not None else None
+            for name, value in (
+                ('p50', percentile(latencies, 50)),
+                ('p95', percentile(latencies, 95)),
+                ('p99', percentile(latencies, 99)),
+                ('max', max(latencies) if latencies else None)
+            )
+        },
+        'first_output_p50': round(percentile(first_outputs, 50), 4) if first_outputs else None,
+        'server_rss_before': rss_before,
+        'server_rss_peak': rss_peak
+    }
+
+
+def print_report(results):
+    def ms(value):
+        return f'{value * 1000:.0f}' if value is not None else '-'
+
+    def mb(value):
+        return f'{value / 1048576:.1f}' if value else '-'
+
+    print(f"\n{'mode':8} {'ok':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'req/s':>8} {'lines/s':>9} {'1st out':>8} {'RSS MB':>12}")
+    for r in results:
+        latency = r['latency']
+        print(f"{r['mode']:8} {r['completed']:>6} {r['errors']:>4} {ms(latency['p50']):>8} "
+              f"{ms(latency['p95']):>8} {ms(latency['p99']):>8} {ms(latency['max']):>8} "
+              f"{r['throughput_rps'] or 0:>8} {r['lines_per_second'] or 0:>9} "
+              f"{ms(r['first_output_p50']):>8} "
+              f"{mb(r['server_rss_before']) + '→' + mb(r['server_rss_peak']):>12}")
+        for error in r['error_samples']:
+            print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Claude Execution Server with a fake claude binary",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s                                     # Flask server, all modes, 50 requests at 10 in flight
+  %(prog)s --server async -c 100 -n 500        # asyncio server under heavier load
+  %(prog)s --mode stream --lines 5000 --rate 0 # Streaming throughput
+  %(prog)s --url http://127.0.0.1:5555 --pid 1234  # Running server (must use fake-claude.py)
+        """
+    )
+    parser.add_argument('--server', choices=sorted(SERVERS), default='fixed',
+                        help='Server to start (default: fixed)')
+    parser.add_argument('--url', help='Benchmark an already running server instead')
+    parser.add_argument('--pid', type=int, help='Server pid for RSS sampling with --url')
+    parser.add_argument('--mode', choices=MODES, nargs='+', default=list(MODES),
+                        help='Request types to run, one after another (default: all)')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help='Requests in flight at once (default: 10)')
+    parser.add_argument('-n', '--requests', type=int, default=50,
+                        help='Requests per mode (default: 50)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='CLAUDE_MAX_WORKERS of the started server (default: 4)')
+    parser.add_argument('--runner-pool', type=int,
+                        help='CLAUDE_RUNNER_POOL of the started server (default: the server default)')
+    parser.add_argument('--lines', type=int, default=20, help='Output lines per job (default: 20)')
+    parser.add_argument('--line-bytes', type=int, default=80, help='Bytes per output line (default: 80)')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Output lines per second per job, 0 = unthrottled (default: 0)')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='Spread each job\'s output over this many seconds (overrides --rate)')
+    parser.add_argument('--startup', type=float, default=0,
+                        help='Fake claude start-up delay in seconds (default: 0)')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='Per-request timeout in seconds (default: 300)')
+    parser.add_argument('--poll', type=float, default=0.05,
+                        help='Async job polling interval in seconds (default: 0.05)')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    server = None
+    workdir = tempfile.TemporaryDirectory(prefix='claude-bench-')
+    try:
+        if args.url:
+            base_url, server_pid = args.url.rstrip('/'), args.pid
+        else:
+            server, base_url = start_server(args, workdir.name)
+            server_pid = server.pid
+
+        print("=" * 60)
+        print(f"Claude Execution Server benchmark: {args.url or args.server} "
+              f"({args.requests} requests/mode, concurrency {args.concurrency})")
+        print(f"Fake claude: {args.lines} lines x {args.line_bytes} bytes, "
+              f"rate {args.rate or 'unthrottled'}, duration {args.duration or '-'}, "
+              f"startup {args.startup}s")
+        print("=" * 60)
+
+        results = []
+        for mode in args.mode:
+            print(f"Running {mode}...")
+            results.append(run_mode(mode, base_url, args, server_pid))
+        print_report(results)
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'args': vars(args), 'results': results}, f, indent=2)
+            print(f"\nResults written to {args.json}")
+        return 0 if all(r['errors'] == 0 for r in results) else 1
+    finally:
+        if server:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        workdir.cleanup()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
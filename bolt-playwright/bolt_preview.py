@@ -0,0 +1,51 @@
+"""
+bolt.new preview readiness
+Shared by the generator scripts: waits for the generated site's preview to
+replace bolt.new's placeholder before the project is exported.
+"""
+
+import os
+import time
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+# Preview readiness: the placeholder bolt.new shows until the generated site
+# is running, how long it may take to appear, and the overall deadline (seconds)
+PREVIEW_PLACEHOLDER = 'div:has-text("Your preview will appear here")'
+PREVIEW_APPEAR_TIMEOUT = 15
+PREVIEW_TIMEOUT = int(os.environ.get('BOLT_PREVIEW_TIMEOUT', 1800))
+
+
+def wait_for_preview(page, timeout=PREVIEW_TIMEOUT, on_progress=None, progress_interval=10):
+    """
+    Wait until the bolt.new preview replaces its "Your preview will appear
+    here" placeholder. Playwright watches the DOM for the placeholder to
+    detach, so this returns as soon as the preview mounts.
+
+    Args:
+        timeout: Seconds to wait before raising PlaywrightTimeoutError
+        on_progress: Called with the seconds waited every progress_interval seconds
+
+    Returns:
+        float: Seconds waited
+    """
+    started = time.time()
+    deadline = started + timeout
+    placeholder = page.locator(PREVIEW_PLACEHOLDER).first
+
+    # The placeholder shows up once bolt.new opens the project; if it never
+    # does, fall through to the detach check
+    try:
+        placeholder.wait_for(state='attached', timeout=min(PREVIEW_APPEAR_TIMEOUT, timeout) * 1000)
+    except PlaywrightTimeoutError:
+        pass
+
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise PlaywrightTimeoutError(f"Preview not ready after {timeout} seconds")
+        try:
+            placeholder.wait_for(state='detached', timeout=min(progress_interval, remaining) * 1000)
+            return time.time() - started
+        except PlaywrightTimeoutError:
+            if on_progress:
+                on_progress(time.time() - started)
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Browser pool daemon
+Keeps a warm Chromium running with the logged-in bolt.new profile and leases
+pages in it to the bolt-playwright scripts, so a job doesn't pay for a
+browser launch. Jobs ask for a lease over a small local HTTP API and drive
+their page through the browser's CDP endpoint.
+
+Run the daemon:  python3 browser_pool.py
+Use it:          lease = open_lease(playwright); lease.page ...; lease.close()
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import secrets
+import logging
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+logger = logging.getLogger('browser_pool')
+
+# Where the daemon listens and where clients find it ('off' disables the pool)
+POOL_HOST = os.environ.get('BROWSER_POOL_HOST', '127.0.0.1')
+POOL_PORT = int(os.environ.get('BROWSER_POOL_PORT', 5556))
+POOL_URL = os.environ.get('BROWSER_POOL_URL', f'http://127.0.0.1:{POOL_PORT}')
+
+# Chromium's CDP endpoint; only bound to localhost
+CDP_PORT = int(os.environ.get('BROWSER_POOL_CDP_PORT', 9222))
+
+# The logged-in profile (see login-bolt-vnc.py)
+PROFILE_DIR = Path(os.environ.get(
+    'BROWSER_POOL_PROFILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chromium-profile-linux')
+))
+HEADLESS = os.environ.get('BROWSER_POOL_HEADLESS', '1') != '0'
+
+# Pages leased at once; a lease not renewed or released within the TTL is reclaimed
+MAX_LEASES = int(os.environ.get('BROWSER_POOL_MAX_LEASES', 4))
+LEASE_TTL = int(os.environ.get('BROWSER_POOL_LEASE_TTL', 1800))
+
+# Health check interval, and leases served before an idle browser is restarted
+CHECK_INTERVAL = int(os.environ.get('BROWSER_POOL_CHECK_INTERVAL', 30))
+RECYCLE_AFTER = int(os.environ.get('BROWSER_POOL_RECYCLE_AFTER', 50))
+
+# How long a client waits for a free page before giving up
+LEASE_WAIT = int(os.environ.get('BROWSER_POOL_WAIT', 600))
+
+# Same flags as the generator scripts' own launches
+BROWSER_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-blink-features=AutomationControlled',
+    '--disable-background-timer-throttling',
+    '--disable-renderer-backgrounding',
+    '--disable-features=TranslateUI',
+]
+
+
+class PoolFull(Exception):
+    """Every page is leased"""
+
+
+class PoolUnavailable(Exception):
+    """
+    The daemon is running but gave no page. It holds the profile, so the
+    caller must not launch its own browser on it.
+    """
+
+
+class BrowserPool:
+    """
+    One persistent Chromium context with a page per lease. All methods run
+    on the thread that owns the Playwright connection.
+    """
+
+    def __init__(self, playwright, profile_dir=PROFILE_DIR, cdp_port=CDP_PORT, headless=HEADLESS,
+                 max_leases=MAX_LEASES, lease_ttl=LEASE_TTL, recycle_after=RECYCLE_AFTER):
+        self.playwright = playwright
+        self.profile_dir = Path(profile_dir)
+        self.cdp_port = cdp_port
+        self.headless = headless
+        self.max_leases = max_leases
+        self.lease_ttl = lease_ttl
+        self.recycle_after = recycle_after
+        self.context = None
+        self.keeper = None  # Blank page that is never leased
+        self.leases = {}  # Lease id -> {'page', 'owner', 'started', 'expires'}
+        self.served = 0  # Leases since the browser was launched
+        self.launches = 0
+        self.reclaimed = 0
+        self.started = time.time()
+        self.launched = None
+
+    @property
+    def cdp_url(self):
+        return f'http://127.0.0.1:{self.cdp_port}'
+
+    def launch(self):
+        """Start Chromium with the profile, replacing a running one"""
+        self.shutdown()
+        started = time.time()
+        self.context = self.playwright.chromium.launch_persistent_context(
+            user_data_dir=str(self.profile_dir),
+            headless=self.headless,
+            args=BROWSER_ARGS + [
+                f'--remote-debugging-port={self.cdp_port}',
+                '--remote-debugging-address=127.0.0.1',
+            ],
+            ignore_https_errors=True,
+            timeout=60000,
+            accept_downloads=True,
+            viewport={'width': 1920, 'height': 1080}
+        )
+        self.keeper = self.context.pages[0] if self.context.pages else self.context.new_page()
+        self.served = 0
+        self.launches += 1
+        self.launched = time.time()
+        logger.info(f"Chromium started in {time.time() - started:.1f}s with {self.profile_dir}, CDP on {self.cdp_url}")
+
+    def shutdown(self):
+        """Close the browser and drop every lease"""
+        if self.leases:
+            logger.warning(f"Dropping {len(self.leases)} active lease(s)")
+        self.leases.clear()
+        if self.context:
+            try:
+                self.context.close()
+            except Exception as e:
+                logger.warning(f"Error closing Chromium: {str(e)}")
+        self.context = None
+        self.keeper = None
+
+    def lease(self, owner=''):
+        """Open a page for a job; the client finds it by its about:blank#<lease> URL"""
+        if len(self.leases) >= self.max_leases:
+            raise PoolFull(f'All {self.max_leases} pages are leased')
+        if not self.alive():
+            self.launch()
+        lease_id = secrets.token_hex(8)
+        page = self.context.new_page()
+        page.goto(f'about:blank#{lease_id}')
+        now = time.time()
+        self.leases[lease_id] = {'page': page, 'owner': owner, 'started': now, 'expires': now + self.lease_ttl}
+        self.served += 1
+        logger.info(f"Lease {lease_id} opened for {owner or 'unknown'} ({len(self.leases)}/{self.max_leases})")
+        return {'lease': lease_id, 'cdp': self.cdp_url, 'url': page.url, 'ttl': self.lease_ttl}
+
+    def renew(self, lease_id):
+        lease = self.leases.get(lease_id)
+        if not lease:
+            raise KeyError(lease_id)
+        lease['expires'] = time.time() + self.lease_ttl
+        return {'lease': lease_id, 'ttl': self.lease_ttl}
+
+    def release(self, lease_id, reason='released'):
+        """Close a lease's page; popups it opened are closed by the next idle check"""
+        lease = self.leases.pop(lease_id, None)
+        if not lease:
+            raise KeyError(lease_id)
+        try:
+            lease['page'].close()
+        except Exception:
+            pass
+        logger.info(f"Lease {lease_id} {reason} after {time.time() - lease['started']:.0f}s")
+        return {'lease': lease_id, 'status': reason}
+
+    def alive(self):
+        """True if the browser answers"""
+        if not self.context or not self.keeper:
+            return False
+        try:
+            return self.keeper.evaluate('1') == 1
+        except Exception:
+            return False
+
+    def check(self):
+        """Reclaim expired leases and restart a dead or well-used idle browser"""
+        now = time.time()
+        for lease_id, lease in list(self.leases.items()):
+            if lease['expires'] < now:
+                self.reclaimed += 1
+                self.release(lease_id, reason='expired')
+
+        if not self.alive():
+            logger.warning("Chromium is not responding, restarting it")
+            self.launch()
+            return
+        if self.leases:
+            return
+        if self.served >= self.recycle_after:
+            logger.info(f"Restarting Chromium after {self.served} leases")
+            self.launch()
+            return
+        # Nothing is leased: close pages jobs left behind (popups, crashed clients)
+        for page in self.context.pages:
+            if page is not self.keeper:
+                try:
+                    page.close()
+                except Exception:
+                    pass
+
+    def status(self):
+        now = time.time()
+        return {
+            'status': 'ok' if self.context else 'stopped',
+            'cdp': self.cdp_url,
+            'profile': str(self.profile_dir),
+            'max_leases': self.max_leases,
+            'leases': [
+                {'lease': lease_id, 'owner': lease['owner'], 'age': round(now - lease['started']),
+                 'expires_in': round(lease['expires'] - now)}
+                for lease_id, lease in self.leases.items()
+            ],
+            'served': self.served,
+            'launches': self.launches,
+            'reclaimed': self.reclaimed,
+            'browser_uptime': round(now - self.launched) if self.launched else None,
+            'uptime': round(now - self.started)
+        }
+
+
+class PoolRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /lease {"owner": ...}, POST /lease/<id>/renew, DELETE /lease/<id>,
+    GET /health. Calls are handed to the Playwright thread through a queue.
+    """
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.call('status')
+        else:
+            self.reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['lease']:
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return self.reply(400, {'error': 'Invalid JSON'})
+            self.call('lease', str(body.get('owner', ''))[:100])
+        elif len(parts) == 3 and parts[0] == 'lease' and parts[2] == 'renew':
+            self.call('renew', parts[1])
+        else:
+            self.reply(404, {'error': 'Not found'})
+
+    def do_DELETE(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'lease':
+            self.call('release', parts[1])
+        else:
+            self.reply(404, {'error': 'Not found'})
+
+    def call(self, method, *args):
+        replies = queue.Queue(maxsize=1)
+        self.server.calls.put((method, args, replies))
+        try:
+            status, body = replies.get(timeout=120)
+        except queue.Empty:
+            status, body = 504, {'error': 'Browser pool is busy'}
+        self.reply(status, body)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host=POOL_HOST, port=POOL_PORT):
+    """Run the daemon: HTTP on a thread, Playwright and health checks on this one"""
+    from playwright.sync_api import sync_playwright
+
+    server = ThreadingHTTPServer((host, port), PoolRequestHandler)
+    server.daemon_threads = True
+    server.calls = queue.Queue()
+
+    with sync_playwright() as p:
+        pool = BrowserPool(p)
+        pool.launch()
+        threading.Thread(target=server.serve_forever, name='pool-http', daemon=True).start()
+        logger.info(f"Browser pool listening on http://{host}:{port} ({pool.max_leases} pages)")
+
+        next_check = time.time() + CHECK_INTERVAL
+        try:
+            while True:
+                try:
+                    method, args, replies = server.calls.get(timeout=max(next_check - time.time(), 0.1))
+                except queue.Empty:
+                    pool.check()
+                    next_check = time.time() + CHECK_INTERVAL
+                    continue
+                try:
+                    replies.put((200, getattr(pool, method)(*args)))
+                except PoolFull as e:
+                    replies.put((503, {'error': str(e), 'retry_after': 5}))
+                except KeyError:
+                    replies.put((404, {'error': 'Unknown lease'}))
+                except Exception as e:
+                    logger.error(f"Browser pool {method} failed: {str(e)}")
+                    replies.put((500, {'error': str(e)}))
+        except KeyboardInterrupt:
+            logger.info("Shutting down browser pool")
+        finally:
+            server.shutdown()
+            pool.shutdown()
+
+
+# Client side
+
+def pool_request(method, path, body=None, pool_url=POOL_URL, timeout=10):
+    """Call the daemon; returns (status, JSON body)"""
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(
+        pool_url.rstrip('/') + path, data=data, method=method,
+        headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b'{}')
+        except ValueError:
+            return e.code, {}
+
+
+class PoolLease:
+    """A leased page, driven over CDP; close() releases it back to the pool"""
+
+    def __init__(self, playwright, info, pool_url=POOL_URL):
+        self.id = info['lease']
+        self.pool_url = pool_url
+        self.closed = threading.Event()
+        self.browser = None
+        try:
+            self.browser = playwright.chromium.connect_over_cdp(info['cdp'])
+        except Exception:
+            # Hand the page back now rather than when the TTL reclaims it
+            self.close()
+            raise
+        self.context = self.browser.contexts[0]
+        self.page = None
+        deadline = time.time() + 10
+        while not self.page and time.time() < deadline:
+            self.page = next((page for page in self.context.pages if page.url == info['url']), None)
+            if not self.page:
+                time.sleep(0.1)
+        if not self.page:
+            self.close()
+            raise RuntimeError(f"Leased page {info['url']} not found over CDP")
+        # Keep the lease while the job runs; a crashed job stops renewing
+        threading.Thread(target=self._renew, args=(max(info['ttl'] // 3, 1),), daemon=True).start()
+
+    def _renew(self, interval):
+        while not self.closed.wait(interval):
+            try:
+                pool_request('POST', f'/lease/{self.id}/renew', pool_url=self.pool_url)
+            except OSError:
+                pass
+
+    def close(self):
+        """Release the page and disconnect; the pool's browser keeps running"""
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        try:
+            pool_request('DELETE', f'/lease/{self.id}', pool_url=self.pool_url)
+        except OSError:
+            pass
+        if self.browser:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+
+
+def open_lease(playwright, owner='', wait=LEASE_WAIT, pool_url=POOL_URL):
+    """
+    Lease a warm page from the pool, waiting up to wait seconds for one to
+    free up. Returns None if the pool is off or not running, so callers can
+    launch their own browser instead; raises PoolUnavailable if it is
+    running but no page could be leased.
+    """
+    if not pool_url or pool_url == 'off':
+        return None
+    deadline = time.time() + wait
+    announced = False
+    while True:
+        try:
+            status, info = pool_request('POST', '/lease', {'owner': owner}, pool_url=pool_url, timeout=120)
+        except urllib.error.URLError as e:
+            if isinstance(e.reason, ConnectionRefusedError):
+                return None
+            raise PoolUnavailable(f"Browser pool at {pool_url} is not answering: {e.reason}")
+        except OSError as e:
+            raise PoolUnavailable(f"Browser pool at {pool_url} is not answering: {str(e)}")
+        if status == 200:
+            return PoolLease(playwright, info, pool_url)
+        if status != 503:
+            raise PoolUnavailable(f"Browser pool could not lease a page ({status}: {info.get('error')})")
+        if time.time() >= deadline:
+            raise PoolUnavailable(f"No pooled browser page came free within {wait} seconds")
+        if not announced:
+            logger.info("All pooled browser pages are busy, waiting for one...")
+            announced = True
+        time.sleep(min(info.get('retry_after', 5), max(deadline - time.time(), 0.1)))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if len(sys.argv) > 1 and sys.argv[1] == 'status':
+        print(json.dumps(pool_request('GET', '/health')[1], indent=2))
+    else:
+        serve()
@@ -0,0 +1,1199 @@
+#!/usr/bin/env python3
+"""
+Claude Execution Server (asyncio)
+aiohttp variant of the execution server. Each job has a single reader per
+subprocess that fans its output out to any number of NDJSON, Server-Sent
+Events and WebSocket subscribers, so idle stream clients cost no threads.
+"""
+
+import os
+import math
+import json
+import logging
+import time
+import asyncio
+import itertools
+import shlex
+import socket
+import uuid
+from collections import OrderedDict, deque
+from aiohttp import web
+from claude_jobs import (
+    JobStore, OutputStore, ResultCache, OrphanReaper, RunnerPool, AgentHeartbeat,
+    ClientPolicy, FairShare, ResourceMonitor, job_metrics, prompt_key, run_as,
+    terminate_process_tree
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Worker pool and job store configuration (shared with the Flask server)
+MAX_WORKERS = int(os.environ.get('CLAUDE_MAX_WORKERS', 2))
+JOB_DB = os.environ.get(
+    'CLAUDE_JOB_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db')
+)
+JOB_RETENTION = int(os.environ.get('CLAUDE_JOB_RETENTION', 3600))
+
+# Finished jobs are also evicted oldest-first beyond these limits
+JOB_MAX_COUNT = int(os.environ.get('CLAUDE_JOB_MAX_COUNT', 10000))
+JOB_MAX_BYTES = int(os.environ.get('CLAUDE_JOB_MAX_BYTES', 1024 ** 3))
+CLEANUP_INTERVAL = 60
+STREAM_TIMEOUT = int(os.environ.get('CLAUDE_STREAM_TIMEOUT', 1800))
+
+# Per-job output logs (resumable via /job/<id>/output)
+OUTPUT_DIR = os.environ.get(
+    'CLAUDE_OUTPUT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'job-output')
+)
+OUTPUT_TAIL_BYTES = int(os.environ.get('CLAUDE_OUTPUT_TAIL_BYTES', 262144))
+
+# Job results larger than this are stored next to the logs instead of in SQLite
+OUTPUT_INLINE_BYTES = int(os.environ.get('CLAUDE_OUTPUT_INLINE_BYTES', 65536))
+
+# Result cache for identical prompts (n8n retries, duplicate triggers)
+CACHE_TTL = int(os.environ.get('CLAUDE_CACHE_TTL', 3600))
+CACHE_SIZE = int(os.environ.get('CLAUDE_CACHE_SIZE', 256))
+
+# Client classes (fair-share weight, per-client rate limit) and their API keys;
+# without the file every client gets CLAUDE_RATE_LIMIT requests per minute (0 = unlimited)
+CLIENTS_FILE = os.environ.get(
+    'CLAUDE_CLIENTS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'clients.json')
+)
+RATE_LIMIT = float(os.environ.get('CLAUDE_RATE_LIMIT', 0))
+RATE_BURST = int(os.environ.get('CLAUDE_RATE_BURST', 10))
+
+# Seconds between samples of each running job's CPU time and memory
+USAGE_INTERVAL = float(os.environ.get('CLAUDE_USAGE_INTERVAL', 1))
+
+# Seconds between SIGTERM and SIGKILL when a job is cancelled
+KILL_GRACE = int(os.environ.get('CLAUDE_KILL_GRACE', 10))
+
+# claude binary and the user it runs as; an empty CLAUDE_RUN_AS runs it as
+# the server's own user (bench-claude-server.py does this with fake-claude.py)
+CLAUDE_BIN = os.environ.get('CLAUDE_BIN', 'claude')
+CLAUDE_RUN_AS = os.environ.get('CLAUDE_RUN_AS', 'clauderunner')
+
+# claude reads the prompt from stdin, so it never passes through a shell or argv
+CLAUDE_COMMAND = run_as(
+    CLAUDE_RUN_AS, f'{shlex.quote(CLAUDE_BIN)} --dangerously-skip-permissions --print'
+)
+
+# Request bodies carry the prompt - allow prompts well beyond aiohttp's 1 MB default
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+# Pre-spawned clauderunner workers that skip the su login on every job (0 disables)
+RUNNER_POOL_SIZE = int(os.environ.get('CLAUDE_RUNNER_POOL', MAX_WORKERS))
+RUNNER_SCRIPT = os.environ.get(
+    'CLAUDE_RUNNER_SCRIPT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'claude-runner-worker.py')
+)
+RUNNER_COMMAND = run_as(
+    CLAUDE_RUN_AS, f'exec python3 -u {shlex.quote(RUNNER_SCRIPT)} {shlex.quote(CLAUDE_BIN)}'
+)
+
+# Run as a worker agent of a dispatching Flask server (see claude-execution-server-fixed.py)
+DISPATCHER_URL = os.environ.get('CLAUDE_DISPATCHER_URL')
+AGENT_NAME = os.environ.get('CLAUDE_AGENT_NAME')
+AGENT_URL = os.environ.get('CLAUDE_AGENT_URL')
+AGENT_TOKEN = os.environ.get('CLAUDE_AGENT_TOKEN')
+AGENT_HEARTBEAT = int(os.environ.get('CLAUDE_AGENT_HEARTBEAT', 10))
+
+# Events kept in memory per job for live subscribers
+EVENT_TAIL = 1000
+
+# Streaming: heartbeat after this many quiet seconds, coalesce events that
+# arrive within the frame interval into one write, and hold a job's output
+# while a subscriber is more than STREAM_MAX_LAG bytes behind (0 disables)
+STREAM_HEARTBEAT = int(os.environ.get('CLAUDE_STREAM_HEARTBEAT', 15))
+STREAM_FRAME_INTERVAL = int(os.environ.get('CLAUDE_STREAM_FRAME_MS', 100)) / 1000
+STREAM_FRAME_BYTES = 65536
+STREAM_MAX_LAG = int(os.environ.get('CLAUDE_STREAM_MAX_LAG', 1024 * 1024))
+
+# Seconds a lagging subscriber may hold a job before it catches up from disk instead
+STREAM_STALL_TIMEOUT = 60
+
+
+class Subscriber:
+    """One follower of a job: its event queue and how many bytes it has not taken yet"""
+
+    def __init__(self, start):
+        self.queue = asyncio.Queue()
+        self.next_seq = start
+        self.pending = 0
+        self.spilled = False  # Dropped from the queue - catches up from the output log
+
+
+class Job:
+    """A Claude run whose output is broadcast to every subscriber"""
+
+    def __init__(self, job_id, prompt, priority=0, timeout=None, persist=False, share='default'):
+        self.job_id = job_id
+        self.prompt = prompt
+        self.key = prompt_key(prompt)
+        self.priority = priority
+        self.share = share  # Client class for fair queuing
+        self.vstart = 0.0
+        self.timeout = timeout or STREAM_TIMEOUT
+        self.persist = persist
+        self.status = 'queued'
+        self.created = time.time()
+        self.output = None  # JobOutput log, attached on submit and dropped when retired
+        self.outputs = None  # OutputStore the log is reopened from after that
+        self.count = 0
+        self.recent = deque(maxlen=EVENT_TAIL)  # Older events are only on disk
+        self.subscribers = set()
+        self.progress = asyncio.Event()  # Set whenever a subscriber takes events
+        self.last_event = time.monotonic()
+        self.started = None  # Monotonic start time, for event timestamps
+        self.done = asyncio.Event()
+        self.result = None
+        self.process = None
+        self.cancelled = False
+        self.retired = False  # The result's output was dropped; it is only in the log
+
+    def publish(self, event):
+        """Record an event and hand it to all current subscribers"""
+        event['seq'] = self.count
+        self.count += 1
+        self.recent.append(event)
+        line = json.dumps(event) + '\n'
+        self.output.append(line)
+        self.last_event = time.monotonic()
+        for subscriber in self.subscribers:
+            if not subscriber.spilled:
+                subscriber.queue.put_nowait((event, len(line)))
+                subscriber.pending += len(line)
+
+    def finish(self, result):
+        self.result = result
+        self.status = result['status']
+        self.done.set()
+        for subscriber in self.subscribers:
+            subscriber.queue.put_nowait(None)
+
+    def backlog(self, start):
+        """Return the events from seq start up to now"""
+        if start >= self.count:
+            return []
+        if self.recent and self.recent[0]['seq'] <= start:
+            return [event for event in self.recent if event['seq'] >= start]
+        # Replay from the on-disk log for subscribers that are far behind
+        # and for finished jobs, whose events are only kept on disk
+        output = self.log()
+        if output is None:
+            return []
+        events = (json.loads(line) for line in output.iter_lines())
+        return [event for event in events if start <= event['seq'] < self.count]
+
+    def log(self):
+        """The job's output log, reopened from disk once the job is retired"""
+        return self.output or self.outputs.open(self.job_id)
+
+    def final_result(self):
+        """The result, with a retired job's output read back from its log"""
+        if not self.retired:
+            return self.result
+        lines = [event['output'] for event in self.backlog(0) if event.get('type') == 'stdout']
+        return dict(self.result, output='\n'.join(lines) + '\n' if lines else '')
+
+    async def wait_for_subscribers(self):
+        """
+        Hold the producer while a subscriber is more than STREAM_MAX_LAG bytes
+        behind. One still behind after STREAM_STALL_TIMEOUT is spilled: it
+        stops being queued events and catches up from the output log.
+        """
+        if not STREAM_MAX_LAG:
+            return
+        deadline = None
+        while True:
+            lagging = [s for s in self.subscribers if not s.spilled and s.pending > STREAM_MAX_LAG]
+            if not lagging:
+                return
+            now = time.monotonic()
+            deadline = deadline or now + STREAM_STALL_TIMEOUT
+            if now >= deadline:
+                logger.warning(f"Job {self.job_id}: {len(lagging)} stalled subscribers moved to the output log")
+                for subscriber in lagging:
+                    subscriber.spilled = True
+                return
+            self.progress.clear()
+            try:
+                await asyncio.wait_for(self.progress.wait(), deadline - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def subscribe(self, start=0, interval=0, limit=STREAM_FRAME_BYTES):
+        """
+        Yield lists of events from seq start onwards until the job finishes.
+        Events arriving within interval seconds of each other come as one
+        frame of at most limit bytes.
+        """
+        subscriber = Subscriber(start)
+        backlog = self.backlog(start)
+        finished = self.done.is_set()
+        self.subscribers.add(subscriber)
+        try:
+            for frame in self._frames(subscriber, backlog, limit):
+                yield frame
+            if finished:
+                return
+            while True:
+                if subscriber.spilled and subscriber.queue.empty():
+                    # Everything it missed is on disk; rejoin the queue after reading it
+                    subscriber.spilled = False
+                    subscriber.pending = 0
+                    for frame in self._frames(subscriber, self.backlog(subscriber.next_seq), limit):
+                        yield frame
+                    continue
+                if subscriber.queue.empty():
+                    item = await subscriber.queue.get()
+                    if item is not None and interval:
+                        await asyncio.sleep(interval)  # Let the rest of the frame arrive
+                else:
+                    item = subscriber.queue.get_nowait()
+                frame, size = [], 0
+                while item is not None:
+                    event, length = item
+                    subscriber.pending -= length
+                    if event['seq'] >= subscriber.next_seq:
+                        frame.append(event)
+                        size += length
+                        subscriber.next_seq = event['seq'] + 1
+                    if size >= limit or subscriber.queue.empty():
+                        break
+                    item = subscriber.queue.get_nowait()
+                self.progress.set()
+                if frame:
+                    yield frame
+                if item is None:
+                    # Events published while it was spilled are only on disk
+                    for frame in self._frames(subscriber, self.backlog(subscriber.next_seq), limit):
+                        yield frame
+                    return
+        finally:
+            self.subscribers.discard(subscriber)
+            self.progress.set()
+
+    @staticmethod
+    def _frames(subscriber, events, limit):
+        """Split replayed events into frames of at most limit bytes"""
+        frame, size = [], 0
+        for event in events:
+            frame.append(event)
+            size += len(json.dumps(event)) + 1
+            subscriber.next_seq = event['seq'] + 1
+            if size >= limit:
+                yield frame
+                frame, size = [], 0
+        if frame:
+            yield frame
+
+    async def wait_for_output(self, offset, timeout):
+        """Wait until the output log grows beyond offset or the job finishes"""
+        subscriber = Subscriber(self.count)
+        self.subscribers.add(subscriber)
+        try:
+            if not self.done.is_set() and self.output.size <= offset:
+                await asyncio.wait_for(subscriber.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+
+    def snapshot(self):
+        job = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'priority': self.priority,
+            'prompt': self.prompt[:100],
+            'created': self.created,
+            'events': self.count
+        }
+        if self.result:
+            job.update(self.final_result())
+        return job
+
+
+class PooledRun:
+    """asyncio view of a claude process handed out by a runner worker"""
+
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    async def start(self):
+        """Attach the waiting claude's pipes to the event loop"""
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, self.process.stdin
+        )
+        self.stdin = asyncio.StreamWriter(transport, protocol, None, loop)
+        self.stdout = await self._reader(loop, self.process.stdout)
+        self.stderr = await self._reader(loop, self.process.stderr)
+
+    async def wait(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self.process.wait)
+
+    async def _reader(self, loop, pipe):
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return reader
+
+
+class AsyncClaudeExecutor:
+    """Runs jobs on a bounded pool of asyncio workers"""
+
+    def __init__(self, store, outputs, max_workers=2, clients=None):
+        self.store = store
+        self.outputs = outputs
+        self.clients = clients or ClientPolicy()
+        self.fair = FairShare()
+        self.cache = ResultCache(CACHE_SIZE, CACHE_TTL)
+        self.metrics = job_metrics()
+        self.runners = RunnerPool(RUNNER_COMMAND, RUNNER_POOL_SIZE)
+        self.resources = ResourceMonitor(USAGE_INTERVAL)
+        self.metrics.gauge('claude_queue_depth', 'Jobs waiting for a worker', lambda: len(self.queued))
+        self.metrics.gauge('claude_running_jobs', 'Jobs currently running', lambda: self.running)
+        self.metrics.gauge('claude_max_workers', 'Size of the worker pool', lambda: self.max_workers)
+        self.metrics.gauge('claude_runner_workers_idle', 'Pre-spawned runner workers ready for a job',
+                           lambda: self.runners.stats()['idle'])
+        self.inflight = {}  # Prompt key -> job computing it
+        self.max_workers = max_workers
+        self.jobs = {}
+        self.finished = OrderedDict()  # job_id -> (finished, output bytes), oldest first
+        self.finished_bytes = 0
+        self.queue = asyncio.PriorityQueue()
+        self.queued = {}
+        self.counter = itertools.count()
+        self.running = 0
+        self.avg_duration = None
+        self.workers = []
+        self.ticker = None
+
+    async def start(self):
+        """Restore persisted queued jobs and start the worker tasks"""
+        interrupted = self.store.fail_interrupted()
+        if interrupted:
+            logger.warning(f"Marked {interrupted} interrupted jobs as failed")
+
+        restored = self.store.pending()
+        for job_id, prompt, priority, created in restored:
+            job = Job(job_id, prompt, priority, persist=True)
+            job.created = created
+            self._enqueue(job)
+        if restored:
+            logger.info(f"Restored {len(restored)} queued jobs from {self.store.db_path}")
+
+        self.runners.start()
+        self.workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.max_workers)
+        ]
+        self.ticker = asyncio.create_task(self._heartbeat())
+        logger.info(f"Started worker pool with {self.max_workers} workers")
+
+    async def stop(self):
+        tasks = self.workers + [self.ticker]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _heartbeat(self):
+        """
+        Publish a heartbeat for running jobs, and the queue position for
+        followed queued jobs, after STREAM_HEARTBEAT quiet seconds so proxies
+        and clients can tell a silent job from a dead connection.
+        """
+        while True:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                if job.done.is_set() or now - job.last_event < STREAM_HEARTBEAT:
+                    continue
+                if job.status == 'running':
+                    job.publish({
+                        'job_id': job.job_id, 'status': 'heartbeat', 'ts': round(now - job.started, 3)
+                    })
+                elif job.subscribers:
+                    event = {'job_id': job.job_id, 'status': 'queued'}
+                    event.update(self.queue_info(job.job_id))
+                    job.publish(event)
+
+    def submit(self, job):
+        """Queue a job; persistent jobs are written to the job store first"""
+        if job.persist:
+            self.store.add(job.job_id, job.prompt, job.priority)
+        self._enqueue(job)
+        self.inflight.setdefault(job.key, job)
+        return job
+
+    def submit_prompt(self, prompt, priority=0, timeout=None, persist=False, use_cache=True,
+                      share='default'):
+        """
+        Queue a prompt unless it can be served from the cache or a running job.
+        Returns (job, source) with source 'new', 'cached' or 'attached'.
+        """
+        job = Job(str(uuid.uuid4()), prompt, priority, timeout, persist, share)
+        if not use_cache:
+            # A forced fresh run doesn't attach to an identical one either
+            return self.submit(job), 'new'
+
+        cached = self.cache.get(job.key)
+        if cached:
+            self._complete_from_cache(job, cached)
+            return job, 'cached'
+
+        running = self.inflight.get(job.key)
+        if running and not running.done.is_set():
+            self.cache.attached += 1
+            return running, 'attached'
+
+        return self.submit(job), 'new'
+
+    def _complete_from_cache(self, job, cached):
+        """Finish a job immediately by replaying a cached result"""
+        job.output = self.outputs.create(job.job_id)
+        job.outputs = self.outputs
+        self.jobs[job.job_id] = job
+        for line in (cached.get('output') or '').splitlines():
+            job.publish({'job_id': job.job_id, 'status': 'running', 'output': line, 'type': 'stdout'})
+        job.publish({'job_id': job.job_id, 'status': 'completed', 'return_code': cached.get('return_code')})
+        self.outputs.finish(job.job_id)
+        result = dict(cached, job_id=job.job_id, cached=True)
+        job.finish(result)
+
+        if job.persist:
+            self.store.add(job.job_id, job.prompt, job.priority, status='completed')
+            stored = {k: v for k, v in result.items() if k != 'job_id'}
+            self.store.update(job.job_id, started=time.time(), finished=time.time(), **stored)
+        self._retire(job)
+
+    def queue_info(self, job_id):
+        """Return queue position, depth and estimated wait for a queued job"""
+        keys = sorted(self.queued)
+        info = {'queue_depth': len(keys), 'running_jobs': self.running}
+        position = next((i for i, key in enumerate(keys) if self.queued[key] == job_id), None)
+        if position is not None:
+            info['queue_position'] = position + 1
+            if self.avg_duration is not None:
+                info['eta_seconds'] = round(
+                    (position + self.running) / self.max_workers * self.avg_duration
+                    + self.avg_duration, 1
+                )
+        return info
+
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'queue_depth': len(self.queued),
+            'queued_by_class': self._queued_by_class(),
+            'running_jobs': self.running,
+            'avg_duration': round(self.avg_duration, 1) if self.avg_duration else None,
+            'subscribers': sum(len(job.subscribers) for job in self.jobs.values()),
+            'runners': self.runners.stats(),
+            'finished_jobs': len(self.finished),
+            'finished_bytes': self.finished_bytes,
+            'outputs': self.outputs.stats(),
+            'clients': self.clients.stats(),
+            'cache': self.cache.stats()
+        }
+
+    def _queued_by_class(self):
+        counts = {}
+        for job_id in self.queued.values():
+            share = self.jobs[job_id].share
+            counts[share] = counts.get(share, 0) + 1
+        return counts
+
+    async def cancel(self, job, grace=KILL_GRACE):
+        """
+        Stop a job: a queued job is finished without running and a running
+        process tree is terminated. Returns the signalled pids, or None if
+        the job had no running process.
+        """
+        job.cancelled = True
+        for key, job_id in list(self.queued.items()):
+            if job_id == job.job_id:
+                del self.queued[key]
+                self._finish_cancelled(job)
+        if job.process is None:
+            return None
+        logger.info(f"Cancelling job {job.job_id} (pid {job.process.pid})")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, terminate_process_tree, job.process.pid, grace)
+
+    def tracked_pids(self):
+        """Pids the orphan reaper must leave alone: running jobs and runner workers"""
+        pids = [job.process.pid for job in list(self.jobs.values()) if job.process]
+        return pids + self.runners.pids()
+
+    def _finish_cancelled(self, job):
+        result = {'job_id': job.job_id, 'status': 'cancelled', 'error': 'Cancelled by request'}
+        job.publish(dict(result))
+        self.outputs.finish(job.job_id)
+        job.finish(result)
+        if self.inflight.get(job.key) is job:
+            del self.inflight[job.key]
+        if job.persist:
+            self.store.update(job.job_id, status='cancelled', error=result['error'], finished=time.time())
+        self._retire(job)
+
+    def prune(self):
+        """Drop the oldest finished jobs beyond the age, count and byte limits"""
+        cutoff = time.time() - JOB_RETENTION
+        while self.finished:
+            job_id, (finished, size) = next(iter(self.finished.items()))
+            if (finished >= cutoff and len(self.finished) <= JOB_MAX_COUNT
+                    and self.finished_bytes <= JOB_MAX_BYTES):
+                break
+            self.finished.popitem(last=False)
+            self.finished_bytes -= size
+            self.jobs.pop(job_id, None)
+
+    def _retire(self, job):
+        """Keep a finished job for late subscribers until prune() evicts it"""
+        if job.job_id in self.finished:
+            return
+        # Its events and output are on disk now; late readers get them from there
+        job.recent.clear()
+        job.output = None
+        if job.result and 'output' in job.result:
+            job.result = {k: v for k, v in job.result.items() if k != 'output'}
+            job.retired = True
+        size = len(json.dumps(job.result or {}))
+        self.finished[job.job_id] = (time.time(), size)
+        self.finished_bytes += size
+        self.prune()
+
+    def _enqueue(self, job):
+        # Higher priority first, then fair-share order, then submission order
+        job.vstart, finish = self.fair.tag(job.share, self.clients.weight(job.share))
+        key = (-job.priority, finish, next(self.counter))
+        job.output = self.outputs.create(job.job_id)
+        job.outputs = self.outputs
+        self.jobs[job.job_id] = job
+        self.queued[key] = job.job_id
+        self.queue.put_nowait((key, job))
+
+    async def _worker(self):
+        while True:
+            key, job = await self.queue.get()
+            self.queued.pop(key, None)
+            if job.cancelled:
+                continue
+            self.fair.started(job.vstart)
+            self.running += 1
+            started = time.time()
+            self.metrics.observe('claude_job_queue_wait_seconds', started - job.created)
+            try:
+                await self.run(job)
+            except Exception as e:
+                logger.error(f"Worker failed on job {job.job_id}: {str(e)}")
+                if not job.done.is_set():
+                    self.outputs.finish(job.job_id)
+                    job.finish({'job_id': job.job_id, 'status': 'error', 'error': str(e)})
+                if job.persist:
+                    self.store.update(job.job_id, status='error', error=str(e), finished=time.time())
+            finally:
+                self.running -= 1
+                if self.inflight.get(job.key) is job:
+                    del self.inflight[job.key]
+                self.cache.release(job.key, job.job_id, job.result)
+                duration = time.time() - started
+                if self.avg_duration is None:
+                    self.avg_duration = duration
+                else:
+                    self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+                self._retire(job)
+
+    async def run(self, job):
+        """Run the job's subprocess and publish its output"""
+        logger.info(f"Executing command for job {job.job_id}: {job.prompt[:100]}...")
+
+        job.status = 'running'
+        if job.persist:
+            self.store.update(job.job_id, status='running', started=time.time())
+
+        started = job.started = time.monotonic()
+        process = await self._spawn(job)
+        self.metrics.observe(
+            'claude_spawn_seconds', time.monotonic() - started,
+            pooled=str(isinstance(process, PooledRun)).lower()
+        )
+        job.process = process
+        self.resources.watch(job.job_id, process.pid)
+        if job.cancelled:
+            # Cancelled while the process was being spawned
+            await self._kill_process_tree(process)
+
+        output = {'stdout': [], 'stderr': deque(maxlen=200)}
+        first_output = True
+        timed_out = False
+        read_bytes = 0
+
+        async def pump(reader, stream):
+            nonlocal first_output, read_bytes
+            buffer = b''
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                if first_output:
+                    self.metrics.observe('claude_first_output_seconds', time.monotonic() - started)
+                    first_output = False
+                self.metrics.inc('claude_output_bytes_total', len(data), stream=stream)
+                read_bytes += len(data)
+                *lines, buffer = (buffer + data).split(b'\n')
+                for line in lines:
+                    emit(stream, line)
+                # A slow stream client holds the pipe rather than growing its queue
+                await job.wait_for_subscribers()
+            if buffer:
+                emit(stream, buffer)
+
+        def emit(stream, raw):
+            line = raw.decode('utf-8', errors='replace').rstrip('\r')
+            output[stream].append(line)
+            job.publish({
+                'job_id': job.job_id,
+                'status': 'running',
+                'output': line,
+                'type': stream,
+                'ts': round(time.monotonic() - started, 3)
+            })
+
+        async def exited():
+            await asyncio.gather(
+                self._write_prompt(process, job.prompt),
+                pump(process.stdout, 'stdout'),
+                pump(process.stderr, 'stderr')
+            )
+            # The pipes close as the tree exits - sample before the child watcher reaps it
+            self.resources.sample(job.job_id)
+            await process.wait()
+
+        try:
+            await asyncio.wait_for(exited(), job.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Command timed out for job {job.job_id} after {job.timeout}s")
+            timed_out = True
+            await self._kill_process_tree(process)
+            result = {
+                'job_id': job.job_id,
+                'status': 'error',
+                'error': f'Command execution timed out after {job.timeout} seconds'
+            }
+        except asyncio.CancelledError:
+            await self._kill_process_tree(process)
+            raise
+        else:
+            stderr = '\n'.join(output['stderr'])
+            result = {
+                'job_id': job.job_id,
+                'status': 'completed',
+                'output': '\n'.join(output['stdout']) + '\n' if output['stdout'] else '',
+                'error': stderr if stderr else None,
+                'return_code': process.returncode
+            }
+        finally:
+            job.process = None
+            if isinstance(process, PooledRun):
+                self.runners.release(process.process)
+            usage = self.resources.finish(job.job_id) or {}
+            usage['wall_seconds'] = round(time.monotonic() - started, 3)
+            usage['output_bytes'] = read_bytes
+        if job.cancelled:
+            result = {'job_id': job.job_id, 'status': 'cancelled', 'error': 'Cancelled by request'}
+        result['usage'] = usage
+
+        # Closing stream event matches the Flask server's NDJSON format
+        if result['status'] == 'completed' and result['return_code'] != 0:
+            final = {
+                'job_id': job.job_id,
+                'status': 'error',
+                'error': result['error'],
+                'return_code': result['return_code']
+            }
+        elif result['status'] == 'completed':
+            final = {'job_id': job.job_id, 'status': 'completed', 'return_code': 0}
+        else:
+            final = dict(result)
+        final['usage'] = usage
+        final['ts'] = round(time.monotonic() - started, 3)
+        self.metrics.observe(
+            'claude_job_duration_seconds', time.monotonic() - started,
+            status='timeout' if timed_out else final['status']
+        )
+        if process.returncode is not None:
+            self.metrics.inc('claude_job_exit_codes_total', code=process.returncode)
+        if 'cpu_seconds' in usage:
+            self.metrics.observe('claude_job_cpu_seconds', usage['cpu_seconds'])
+            self.metrics.observe('claude_job_peak_rss_bytes', usage['peak_rss_bytes'])
+        job.publish(final)
+        self.outputs.finish(job.job_id)
+        job.finish(result)
+
+        if job.persist:
+            stored = {k: v for k, v in result.items() if k != 'job_id'}
+            self.store.update(job.job_id, finished=time.time(), **stored)
+
+    async def _spawn(self, job):
+        """Start the job on a pre-spawned runner worker, else via su"""
+        pooled = await asyncio.get_running_loop().run_in_executor(None, self.runners.acquire)
+        if pooled is not None:
+            process = PooledRun(pooled)
+            await process.start()
+            return process
+
+        # Own process group so a timeout can take down the whole tree
+        return await asyncio.create_subprocess_exec(
+            *CLAUDE_COMMAND,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
+        )
+
+    async def _write_prompt(self, process, prompt):
+        """Stream the prompt to claude's stdin, respecting pipe back-pressure"""
+        data = prompt.encode('utf-8')
+        try:
+            for start in range(0, len(data), 65536):
+                process.stdin.write(data[start:start + 65536])
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # claude exited without reading - its output says why
+        finally:
+            process.stdin.close()
+
+    async def _kill_process_tree(self, process, grace=KILL_GRACE):
+        """
+        Terminate the job's whole process tree like cancel() does - su puts
+        claude in a session of its own, out of reach of a group kill - and
+        reap it
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, terminate_process_tree, process.pid, grace)
+        await process.wait()
+
+
+routes = web.RouteTableDef()
+
+
+async def read_job_request(request):
+    """Parse and validate the JSON body of an execute request"""
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        data = None
+    if not data or 'prompt' not in data:
+        raise web.HTTPBadRequest(
+            text=json.dumps({'error': 'Missing prompt in request body'}),
+            content_type='application/json'
+        )
+    try:
+        priority = int(data.get('priority', 0))
+        timeout = int(data['timeout']) if data.get('timeout') is not None else None
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(
+            text=json.dumps({'error': 'priority and timeout must be integers'}),
+            content_type='application/json'
+        )
+    return data, priority, timeout
+
+
+def admit_request(request):
+    """
+    Identify the client and take a rate-limit token. Returns (client, class);
+    raises 429 with Retry-After when the client is over its limit.
+    """
+    executor = request.app['executor']
+    client, share = executor.clients.identify(
+        request.headers.get('X-API-Key'), request.headers.get('X-Client-ID'), request.remote
+    )
+    if AGENT_TOKEN and request.headers.get('X-Agent-Token') == AGENT_TOKEN:
+        return client, share  # Dispatched by our dispatcher, which already limited the client
+    retry_after = executor.clients.admit(client, share)
+    if retry_after:
+        executor.metrics.inc('claude_rate_limited_total', client_class=share)
+        seconds = math.ceil(retry_after)
+        raise web.HTTPTooManyRequests(
+            text=json.dumps({'error': 'Rate limit exceeded', 'client': client, 'retry_after': seconds}),
+            content_type='application/json',
+            headers={'Retry-After': str(seconds)}
+        )
+    return client, share
+
+
+def retry_after_headers(info):
+    """Tell pollers of a queued job when it is worth asking again"""
+    if info.get('eta_seconds'):
+        return {'Retry-After': str(math.ceil(info['eta_seconds']))}
+    return None
+
+
+def find_job(request):
+    return request.app['executor'].jobs.get(request.match_info['job_id'])
+
+
+@routes.get('/health')
+async def health_check(request):
+    """Health check endpoint"""
+    return web.json_response({'status': 'healthy', 'service': 'claude-execution-server-async'})
+
+
+@routes.post('/execute')
+async def execute(request):
+    """Execute a Claude command with the given prompt"""
+    data, priority, timeout = await read_job_request(request)
+    _client, share = admit_request(request)
+    executor = request.app['executor']
+    # Identical prompts share cached results and running jobs
+    job, source = executor.submit_prompt(
+        data['prompt'], priority, timeout, use_cache=data.get('cache', True), share=share
+    )
+
+    if not data.get('stream', False):
+        await job.done.wait()
+        if source == 'attached':
+            return web.json_response(dict(job.final_result(), deduplicated=True))
+        return web.json_response(job.final_result())
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/x-ndjson',
+        'X-Job-ID': job.job_id,
+        'X-Cache': {'new': 'MISS', 'cached': 'HIT', 'attached': 'ATTACHED'}[source],
+        'Cache-Control': 'no-cache'
+    })
+    await response.prepare(request)
+    async for frame in job.subscribe(interval=STREAM_FRAME_INTERVAL):
+        await response.write(''.join(json.dumps(event) + '\n' for event in frame).encode())
+    await response.write_eof()
+    return response
+
+
+@routes.post('/execute-async')
+async def execute_async(request):
+    """Execute a Claude command asynchronously"""
+    data, priority, timeout = await read_job_request(request)
+    client, share = admit_request(request)
+    executor = request.app['executor']
+    job, source = executor.submit_prompt(
+        data['prompt'], priority, timeout, persist=True, use_cache=data.get('cache', True),
+        share=share
+    )
+
+    messages = {
+        'new': 'Job queued for execution',
+        'cached': 'Result served from cache',
+        'attached': 'Attached to running job'
+    }
+    response = {
+        'job_id': job.job_id,
+        'status': job.status,
+        'priority': job.priority,
+        'client': client,
+        'message': messages[source],
+        'cached': source == 'cached',
+        'deduplicated': source == 'attached',
+        'events': f'/job/{job.job_id}/events',
+        'websocket': f'/job/{job.job_id}/ws'
+    }
+    response.update(executor.queue_info(job.job_id))
+    return web.json_response(response, headers=retry_after_headers(response))
+
+
+@routes.get('/job/{job_id}')
+async def get_job_status(request):
+    """Get the status of a job"""
+    job_id = request.match_info['job_id']
+    executor = request.app['executor']
+    job = executor.store.get(job_id)
+    live = find_job(request)
+    if job is None and live is None:
+        return web.json_response({'error': 'Job not found'}, status=404)
+    if job is None:
+        job = live.snapshot()
+
+    if job['status'] == 'queued':
+        job.update(executor.queue_info(job_id))
+        return web.json_response(job, headers=retry_after_headers(job))
+    return web.json_response(job)
+
+
+@routes.delete('/job/{job_id}')
+async def cancel_job(request):
+    """Cancel a queued or running job, terminating only its own process tree"""
+    job_id = request.match_info['job_id']
+    try:
+        grace = int(request.query.get('grace', KILL_GRACE))
+    except ValueError:
+        return web.json_response({'error': 'grace must be an integer'}, status=400)
+
+    job = find_job(request)
+    if job is None:
+        stored = request.app['executor'].store.get(job_id)
+        if stored is None:
+            return web.json_response({'error': 'Job not found'}, status=404)
+        return web.json_response({'error': f"Job already {stored['status']}", 'job_id': job_id}, status=409)
+    if job.done.is_set():
+        return web.json_response({'error': f'Job already {job.status}', 'job_id': job_id}, status=409)
+
+    terminated = await request.app['executor'].cancel(job, grace)
+    return web.json_response({
+        'job_id': job_id,
+        'status': 'cancelled',
+        'was_running': terminated is not None,
+        'terminated_pids': terminated or []
+    })
+
+
+@routes.get('/job/{job_id}/events')
+async def job_events(request):
+    """Follow a job's output as Server-Sent Events"""
+    job = find_job(request)
+    if job is None:
+        stored = request.app['executor'].store.get(request.match_info['job_id'])
+        if stored is None:
+            return web.json_response({'error': 'Job not found'}, status=404)
+        # Finished before this process started - send the final record only
+        return web.Response(
+            text=f"event: result\ndata: {json.dumps(stored)}\n\n",
+            content_type='text/event-stream'
+        )
+
+    # EventSource reconnects send the last seq they saw
+    try:
+        start = max(int(request.headers.get('Last-Event-ID', -1)) + 1, 0)
+    except ValueError:
+        return web.json_response({'error': 'Last-Event-ID must be an integer'}, status=400)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    async for frame in job.subscribe(start, interval=STREAM_FRAME_INTERVAL):
+        await response.write(''.join(
+            f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n" for event in frame
+        ).encode())
+    await response.write(f"event: result\ndata: {json.dumps(job.final_result())}\n\n".encode())
+    await response.write_eof()
+    return response
+
+
+@routes.get('/job/{job_id}/ws')
+async def job_websocket(request):
+    """Follow a job's output over a WebSocket"""
+    job = find_job(request)
+    if job is None:
+        return web.json_response({'error': 'Job not found'}, status=404)
+
+    try:
+        start = max(int(request.query.get('offset', 0)), 0)
+    except ValueError:
+        return web.json_response({'error': 'offset must be an integer'}, status=400)
+
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    async for frame in job.subscribe(start, interval=STREAM_FRAME_INTERVAL):
+        if ws.closed:
+            break
+        for event in frame:
+            await ws.send_json(event)
+    if not ws.closed:
+        await ws.send_json({'type': 'result', **job.final_result()})
+        await ws.close()
+    return ws
+
+
+@routes.get('/job/{job_id}/output')
+async def get_job_output(request):
+    """
+    Read a job's NDJSON output from a byte offset.
+    With follow=1 the output is streamed until the job finishes; the offset
+    to resume from is the number of bytes already received.
+    """
+    job_id = request.match_info['job_id']
+    live = find_job(request)
+    output = live.log() if live else request.app['executor'].outputs.open(job_id)
+    if output is None:
+        return web.json_response({'error': 'Job output not found'}, status=404)
+
+    try:
+        offset = max(int(request.query.get('offset', 0)), 0)
+        limit = max(int(request.query.get('limit', 65536)), 1)
+    except ValueError:
+        return web.json_response({'error': 'offset and limit must be integers'}, status=400)
+
+    if request.query.get('follow', '').lower() in ('1', 'true', 'yes'):
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/x-ndjson',
+            'X-Job-ID': job_id,
+            'Cache-Control': 'no-cache'
+        })
+        await response.prepare(request)
+        position = offset
+        while True:
+            data, position = output.read(position, limit)
+            if data:
+                await response.write(data)
+                continue
+            if output.closed:
+                break
+            await live.wait_for_output(position, timeout=15)
+        await response.write_eof()
+        return response
+
+    data, next_offset = output.read(offset, limit)
+    return web.json_response({
+        'job_id': job_id,
+        'offset': offset,
+        'next_offset': next_offset,
+        'size': output.size,
+        'complete': output.closed and next_offset >= output.size,
+        'events': [json.loads(line) for line in data.splitlines() if line.strip()]
+    })
+
+
+@routes.get('/jobs')
+async def list_jobs(request):
+    """List all jobs"""
+    executor = request.app['executor']
+    stored = {job['job_id']: job for job in executor.store.list()}
+    for job_id, job in executor.jobs.items():
+        stored.setdefault(job_id, job.snapshot())
+    return web.json_response({
+        'jobs': [
+            {
+                'job_id': job_id,
+                'status': job_info.get('status'),
+                'priority': job_info.get('priority'),
+                'created': job_info.get('created'),
+                'prompt': job_info.get('prompt')
+            }
+            for job_id, job_info in stored.items()
+        ],
+        'pool': executor.stats()
+    })
+
+
+@routes.get('/jobs/usage')
+async def jobs_usage(request):
+    """CPU time and memory totals over stored jobs, and the most expensive ones"""
+    executor = request.app['executor']
+    try:
+        top = min(max(int(request.query.get('top', 10)), 1), 100)
+    except ValueError:
+        raise web.HTTPBadRequest(
+            text=json.dumps({'error': 'top must be an integer'}), content_type='application/json'
+        )
+    summary = await asyncio.get_running_loop().run_in_executor(
+        None, executor.store.usage_summary, top
+    )
+    summary['monitor'] = executor.resources.stats()
+    return web.json_response(summary)
+
+
+@routes.get('/metrics')
+async def get_metrics(request):
+    """Expose queue, latency and output metrics in the Prometheus text format"""
+    body = request.app['executor'].metrics.render()
+    return web.Response(text=body, content_type='text/plain', charset='utf-8')
+
+
+@routes.get('/test')
+async def test_endpoint(request):
+    """Test endpoint with a simple prompt"""
+    test_prompt = "Print only: Hello from Claude Execution Server"
+    job = request.app['executor'].submit(Job(str(uuid.uuid4()), test_prompt))
+    await job.done.wait()
+    return web.json_response({
+        'test': True,
+        'prompt': test_prompt,
+        'result': job.final_result()
+    })
+
+
+async def cleanup_jobs(app):
+    """Evict old jobs from memory, the job store and the output logs"""
+    executor = app['executor']
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(CLEANUP_INTERVAL)
+        executor.prune()
+        try:
+            expired = await loop.run_in_executor(
+                None, executor.store.prune, JOB_RETENTION, JOB_MAX_COUNT, JOB_MAX_BYTES
+            )
+            expired_outputs = await loop.run_in_executor(
+                None, executor.outputs.prune, JOB_RETENTION, JOB_MAX_COUNT, JOB_MAX_BYTES
+            )
+        except Exception as e:
+            logger.error(f"Job cleanup failed: {str(e)}")
+            continue
+        if expired or expired_outputs:
+            logger.info(f"Cleaned up {expired} expired jobs and {expired_outputs} output logs")
+
+
+async def on_startup(app):
+    app['executor'] = AsyncClaudeExecutor(
+        JobStore(JOB_DB, OUTPUT_DIR, OUTPUT_INLINE_BYTES),
+        OutputStore(OUTPUT_DIR, OUTPUT_TAIL_BYTES),
+        max_workers=MAX_WORKERS,
+        clients=ClientPolicy.load(CLIENTS_FILE, RATE_LIMIT, RATE_BURST)
+    )
+    await app['executor'].start()
+    OrphanReaper(app['executor'].tracked_pids, grace=KILL_GRACE).start()
+    if DISPATCHER_URL:
+        port = int(os.environ.get('CLAUDE_SERVER_PORT', 5555))
+        executor = app['executor']
+        AgentHeartbeat(
+            DISPATCHER_URL,
+            AGENT_NAME or f'{socket.gethostname()}:{port}',
+            AGENT_URL or f'http://127.0.0.1:{port}',
+            MAX_WORKERS,
+            lambda: {
+                'running_jobs': executor.running,
+                'queue_depth': len(executor.queued),
+                'runners_idle': executor.runners.stats()['idle']
+            },
+            token=AGENT_TOKEN,
+            interval=AGENT_HEARTBEAT
+        ).start()
+    app['cleanup'] = asyncio.create_task(cleanup_jobs(app))
+
+
+async def on_cleanup(app):
+    app['cleanup'].cancel()
+    await app['executor'].stop()
+
+
+def create_app():
+    app = web.Application(client_max_size=MAX_REQUEST_SIZE)
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    # Configuration
+    port = int(os.environ.get('CLAUDE_SERVER_PORT', 5555))
+    host = os.environ.get('CLAUDE_SERVER_HOST', '0.0.0.0')
+
+    logger.info(f"Starting Claude Execution Server (asyncio) on {host}:{port}")
+    web.run_app(create_app(), host=host, port=port, print=None)
@@ -5,16 +5,26 @@ A Flask server that executes Claude commands as clauderunner user
 """
 
 import os
+import math
 import subprocess
 import json
 import logging
 import time
+import selectors
+import threading
 from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from threading import Thread
-from queue import Queue
 import uuid
-import tempfile
+import shlex
+import socket
+import urllib.request
+from collections import deque
+from claude_jobs import (
+    JobStore, JobScheduler, OutputStore, ResultCache, OrphanReaper, RunnerPool,
+    PooledProcess, AgentRegistry, AgentHeartbeat, ClientPolicy, ResourceMonitor, job_metrics,
+    prompt_key, run_as, terminate_process_tree, wait_exited
+)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -26,127 +36,794 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Store running jobs
-jobs = {}
+# Worker pool and job store configuration
+MAX_WORKERS = int(os.environ.get('CLAUDE_MAX_WORKERS', 2))
+JOB_DB = os.environ.get(
+    'CLAUDE_JOB_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db')
+)
+JOB_RETENTION = int(os.environ.get('CLAUDE_JOB_RETENTION', 3600))
+
+# Finished jobs are also evicted oldest-first beyond these limits
+JOB_MAX_COUNT = int(os.environ.get('CLAUDE_JOB_MAX_COUNT', 10000))
+JOB_MAX_BYTES = int(os.environ.get('CLAUDE_JOB_MAX_BYTES', 1024 ** 3))
+CLEANUP_INTERVAL = 60
+
+# Wall-clock limit for streaming and async jobs, and for non-streaming
+# /execute requests, when the request sets no timeout (seconds)
+STREAM_TIMEOUT = int(os.environ.get('CLAUDE_STREAM_TIMEOUT', 1800))
+COMMAND_TIMEOUT = 300
+
+# Streamed output: heartbeat after this many quiet seconds, lines arriving
+# within the frame interval go out as one write, and a live client may fall
+# this many bytes behind before the job stops reading claude's output
+STREAM_HEARTBEAT = int(os.environ.get('CLAUDE_STREAM_HEARTBEAT', 15))
+STREAM_FRAME_INTERVAL = int(os.environ.get('CLAUDE_STREAM_FRAME_MS', 100)) / 1000
+STREAM_FRAME_BYTES = 65536
+STREAM_MAX_LAG = int(os.environ.get('CLAUDE_STREAM_MAX_LAG', 1024 * 1024))
+
+# Per-job output logs (resumable via /job/<id>/output)
+OUTPUT_DIR = os.environ.get(
+    'CLAUDE_OUTPUT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'job-output')
+)
+OUTPUT_TAIL_BYTES = int(os.environ.get('CLAUDE_OUTPUT_TAIL_BYTES', 262144))
+
+# Job results larger than this are stored next to the logs instead of in SQLite
+OUTPUT_INLINE_BYTES = int(os.environ.get('CLAUDE_OUTPUT_INLINE_BYTES', 65536))
+
+# Result cache for identical prompts (n8n retries, duplicate triggers)
+CACHE_TTL = int(os.environ.get('CLAUDE_CACHE_TTL', 3600))
+CACHE_SIZE = int(os.environ.get('CLAUDE_CACHE_SIZE', 256))
+
+# Longest a request waits on an identical prompt's running job (queue time included)
+DEDUP_WAIT = int(os.environ.get('CLAUDE_DEDUP_WAIT', 2 * STREAM_TIMEOUT))
+
+# Client classes (fair-share weight, per-client rate limit) and their API keys;
+# without the file every client gets CLAUDE_RATE_LIMIT requests per minute (0 = unlimited)
+CLIENTS_FILE = os.environ.get(
+    'CLAUDE_CLIENTS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'clients.json')
+)
+RATE_LIMIT = float(os.environ.get('CLAUDE_RATE_LIMIT', 0))
+RATE_BURST = int(os.environ.get('CLAUDE_RATE_BURST', 10))
+
+# Seconds between samples of each running job's CPU time and memory
+USAGE_INTERVAL = float(os.environ.get('CLAUDE_USAGE_INTERVAL', 1))
+
+# Seconds between SIGTERM and SIGKILL when a job's process tree is stopped
+KILL_GRACE = int(os.environ.get('CLAUDE_KILL_GRACE', 10))
+
+# claude binary and the user it runs as; an empty CLAUDE_RUN_AS runs it as
+# the server's own user (bench-claude-server.py does this with fake-claude.py)
+CLAUDE_BIN = os.environ.get('CLAUDE_BIN', 'claude')
+CLAUDE_RUN_AS = os.environ.get('CLAUDE_RUN_AS', 'clauderunner')
+
+# claude reads the prompt from stdin, so it never passes through a shell or argv
+CLAUDE_COMMAND = run_as(
+    CLAUDE_RUN_AS, f'{shlex.quote(CLAUDE_BIN)} --dangerously-skip-permissions --print'
+)
+
+# Multi-host: worker agents register with a dispatcher, which sends each job
+# to the least-loaded agent (or this host) and relays its output stream.
+# A server started with CLAUDE_DISPATCHER_URL runs as an agent of that dispatcher;
+# only one started with CLAUDE_DISPATCHER=1 and a CLAUDE_AGENT_TOKEN accepts agents.
+DISPATCHER = os.environ.get('CLAUDE_DISPATCHER', '0') == '1'
+DISPATCHER_URL = os.environ.get('CLAUDE_DISPATCHER_URL')
+DISPATCH_LOCAL = os.environ.get('CLAUDE_DISPATCH_LOCAL', '1') != '0'
+AGENT_NAME = os.environ.get('CLAUDE_AGENT_NAME')
+AGENT_URL = os.environ.get('CLAUDE_AGENT_URL')
+AGENT_TOKEN = os.environ.get('CLAUDE_AGENT_TOKEN')
+AGENT_HEARTBEAT = int(os.environ.get('CLAUDE_AGENT_HEARTBEAT', 10))
+
+# Agents send a heartbeat event at least every STREAM_HEARTBEAT seconds
+AGENT_READ_TIMEOUT = 4 * STREAM_HEARTBEAT
+
+# Jobs run on this host at once (a pure dispatcher runs none itself)
+LOCAL_WORKERS = MAX_WORKERS if DISPATCH_LOCAL or not DISPATCHER or DISPATCHER_URL else 0
+
+# Pre-spawned clauderunner workers that skip the su login on every job (0 disables)
+RUNNER_POOL_SIZE = int(os.environ.get('CLAUDE_RUNNER_POOL', LOCAL_WORKERS))
+RUNNER_SCRIPT = os.environ.get(
+    'CLAUDE_RUNNER_SCRIPT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'claude-runner-worker.py')
+)
+RUNNER_COMMAND = run_as(
+    CLAUDE_RUN_AS, f'exec python3 -u {shlex.quote(RUNNER_SCRIPT)} {shlex.quote(CLAUDE_BIN)}'
+)
 
 class ClaudeExecutor:
     def __init__(self):
-        self.jobs = {}
+        self.processes = {}  # job_id -> Popen of the running su/claude process
+        self.remote = {}  # job_id -> (agent, agent's job_id) for dispatched jobs
+        self.cancelled = set()
+        self.lock = threading.Lock()
 
-    def execute_command_stream(self, prompt, job_id=None):
-        """Execute claude command with streaming output"""
+    def _spawn(self, prompt, job_id):
+        """
+        Start a job's process, preferably on a pre-spawned runner worker, else
+        via su in its own session. Either way claude reads the prompt from
+        stdin. Returns None if the job was cancelled.
+        """
+        with self.lock:
+            if job_id in self.cancelled:
+                return None
+        # Spawning can take a while; don't hold up cancel() and the other jobs
+        spawn_started = time.monotonic()
+        process = runners.acquire()
+        if process is None:
+            process = subprocess.Popen(
+                CLAUDE_COMMAND,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.PIPE,
+                start_new_session=True
+            )
+        metrics.observe(
+            'claude_spawn_seconds', time.monotonic() - spawn_started,
+            pooled=str(isinstance(process, PooledProcess)).lower()
+        )
+        with self.lock:
+            cancelled = job_id in self.cancelled
+            if not cancelled:
+                self.processes[job_id] = process
+        if cancelled:
+            # cancel() ran while the process was starting and found nothing to stop
+            terminate_process_tree(process.pid, KILL_GRACE)
+            process.wait()
+            if isinstance(process, PooledProcess):
+                runners.release(process)
+            return None
+        resources.watch(job_id, process.pid)
+        return process
+
+    def _release(self, job_id):
+        with self.lock:
+            process = self.processes.pop(job_id, None)
+            self.cancelled.discard(job_id)
+        if isinstance(process, PooledProcess):
+            runners.release(process)
+
+    def is_cancelled(self, job_id):
+        with self.lock:
+            return job_id in self.cancelled
+
+    def cancel(self, job_id, grace=None):
+        """
+        Stop a job: it will not start if it is still queued, and a running
+        process tree is terminated. Returns the signalled pids, or None if
+        the job had no running process.
+        """
+        grace = KILL_GRACE if grace is None else grace
+        with self.lock:
+            self.cancelled.add(job_id)
+            process = self.processes.get(job_id)
+            remote = self.remote.get(job_id)
+        if remote:
+            return self._cancel_remote(*remote, grace)
+        if process is None:
+            return None
+        logger.info(f"Cancelling job {job_id} (pid {process.pid})")
+        return terminate_process_tree(process.pid, grace)
+
+    def forget(self, job_id):
+        """Drop the cancel marker of a job that will never reach a worker"""
+        with self.lock:
+            self.cancelled.discard(job_id)
+
+    def tracked_pids(self):
+        """Pids the orphan reaper must leave alone: running jobs and runner workers"""
+        with self.lock:
+            pids = [process.pid for process in self.processes.values()]
+        return pids + runners.pids()
+
+    def execute_command_stream(self, prompt, job_id=None, timeout=None):
+        """
+        Execute claude command with streaming output from stdout and stderr,
+        on this host or - as a dispatcher - on the least-loaded worker agent
+        """
         if not job_id:
             job_id = str(uuid.uuid4())
+        if timeout is None:
+            timeout = STREAM_TIMEOUT
+        if agents is None:
+            yield from self._stream_local(prompt, job_id, timeout)
+            return
 
-        # Build the command
-        command = [
-            'su', '-', 'clauderunner', '-c',
-            f'claude --dangerously-skip-permissions --print "{prompt}"'
-        ]
+        while not self.is_cancelled(job_id):
+            try:
+                agent = agents.acquire()
+            except RuntimeError as e:
+                yield json.dumps({'job_id': job_id, 'status': 'error', 'error': str(e)}) + '\n'
+                return
+            metrics.inc('claude_jobs_dispatched_total', agent=agent.name if agent else 'local')
+            failed = False
+            try:
+                if agent is None:
+                    yield from self._stream_local(prompt, job_id, timeout)
+                else:
+                    yield from self._stream_remote(agent, prompt, job_id, timeout)
+                return
+            except ConnectionError as e:
+                # Nothing was streamed yet - try the next agent
+                logger.warning(str(e))
+                failed = True
+            finally:
+                agents.release(agent, failed)
+        self.forget(job_id)
+        yield json.dumps({'job_id': job_id, 'status': 'cancelled'}) + '\n'
 
+    def _stream_remote(self, agent, prompt, job_id, timeout):
+        """
+        Run a job on a worker agent and relay its NDJSON stream under our job_id.
+        Raises ConnectionError if the agent can't start it.
+        """
+        logger.info(f"Dispatching job {job_id} to agent {agent.name}: {prompt[:100]}...")
+        body = json.dumps({'prompt': prompt, 'stream': True, 'timeout': timeout, 'cache': False})
+        headers = {'Content-Type': 'application/json'}
+        if AGENT_TOKEN:
+            headers['X-Agent-Token'] = AGENT_TOKEN  # Already rate limited here
+        request = urllib.request.Request(agent.url + '/execute', data=body.encode(), headers=headers)
+        try:
+            response = urllib.request.urlopen(request, timeout=AGENT_READ_TIMEOUT)
+        except OSError as e:
+            raise ConnectionError(f"Agent {agent.name} could not run job {job_id}: {str(e)}")
+
+        remote_id = response.headers.get('X-Job-ID')
+        with self.lock:
+            self.remote[job_id] = (agent, remote_id)
+            cancelled = job_id in self.cancelled
+        finished = False
+        try:
+            if cancelled:
+                self._cancel_remote(agent, remote_id, KILL_GRACE)
+            for line in response:
+                event = json.loads(line)
+                event['job_id'] = job_id
+                event.pop('seq', None)  # asyncio agents number their events
+                finished = event['status'] not in ('queued', 'running', 'heartbeat')
+                yield json.dumps(event) + '\n'
+        except (OSError, ValueError) as e:
+            logger.error(f"Lost agent {agent.name} while running job {job_id}: {str(e)}")
+            if not finished:
+                yield json.dumps({
+                    'job_id': job_id,
+                    'status': 'error',
+                    'error': f'Lost connection to agent {agent.name}: {str(e)}'
+                }) + '\n'
+        finally:
+            response.close()
+            with self.lock:
+                self.remote.pop(job_id, None)
+                self.cancelled.discard(job_id)
+            if not finished:
+                # Client went away or the stream broke - don't leave the job running there
+                self._cancel_remote(agent, remote_id, KILL_GRACE)
+
+    def _cancel_remote(self, agent, remote_id, grace):
+        """Cancel a dispatched job on its agent; returns the pids it terminated"""
+        if not remote_id:
+            return []
+        logger.info(f"Cancelling job {remote_id} on agent {agent.name}")
+        request = urllib.request.Request(
+            f'{agent.url}/job/{remote_id}?grace={grace}', method='DELETE'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=grace + 10) as response:
+                return json.loads(response.read()).get('terminated_pids', [])
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not cancel job {remote_id} on agent {agent.name}: {str(e)}")
+            return []
+
+    def _stream_local(self, prompt, job_id, timeout):
+        """Run a job's claude process on this host and stream its output"""
         logger.info(f"Executing streaming command for job {job_id}: {prompt[:100]}...")
 
+        process = None
+        status = 'aborted'  # Stays set if the consumer stops reading early
+        started = time.monotonic()
+        read = {'bytes': 0}
+        usage = None
         try:
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdin=subprocess.DEVNULL,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
+            # Own process group so a timeout or cancel can take down the whole tree
+            process = self._spawn(prompt, job_id)
+            if process is None:
+                yield json.dumps({'job_id': job_id, 'status': 'cancelled'}) + '\n'
+                return
+
+            stderr_tail = deque(maxlen=200)
+            timed_out = False
+            first_output = True
 
-            # Stream output line by line
-            for line in iter(process.stdout.readline, ''):
-                if line:
+            # Feed the prompt and drain both pipes as they become ready so
+            # no pipe can fill up and block either side
+            for stream, line, ts in self._pump_output(process, prompt, started + timeout, read):
+                if stream is None:
+                    timed_out = True
+                    break
+                if stream == 'heartbeat':
+                    # Keeps proxies from cutting the stream while claude is quiet
                     yield json.dumps({
                         'job_id': job_id,
-                        'status': 'running',
-                        'output': line.rstrip(),
-                        'type': 'stdout'
+                        'status': 'heartbeat',
+                        'ts': round(ts - started, 3)
                     }) + '\n'
+                    continue
+                if stream == 'stderr':
+                    stderr_tail.append(line)
+                if first_output:
+                    metrics.observe('claude_first_output_seconds', ts - started)
+                    first_output = False
+                yield json.dumps({
+                    'job_id': job_id,
+                    'status': 'running',
+                    'output': line,
+                    'type': stream,
+                    'ts': round(ts - started, 3)  # Seconds since start (monotonic clock)
+                }) + '\n'
 
-            process.wait()
+            if timed_out:
+                logger.error(f"Command timed out for job {job_id} after {timeout}s")
+                status = 'timeout'
+                self._terminate(process)
+                usage = self._usage(job_id, process, started, read)
+                yield json.dumps({
+                    'job_id': job_id,
+                    'status': 'error',
+                    'error': f'Command execution timed out after {timeout} seconds',
+                    'usage': usage,
+                    'ts': round(time.monotonic() - started, 3)
+                }) + '\n'
+                return
 
-            # Get any error output
-            stderr = process.stderr.read()
+            usage = self._usage(job_id, process, started, read)
+            process.wait()
 
-            if process.returncode != 0:
+            if self.is_cancelled(job_id):
+                status = 'cancelled'
+                yield json.dumps({
+                    'job_id': job_id,
+                    'status': 'cancelled',
+                    'return_code': process.returncode,
+                    'usage': usage,
+                    'ts': round(time.monotonic() - started, 3)
+                }) + '\n'
+            elif process.returncode != 0:
+                status = 'error'
                 yield json.dumps({
                     'job_id': job_id,
                     'status': 'error',
-                    'error': stderr,
-                    'return_code': process.returncode
+                    'error': '\n'.join(stderr_tail),
+                    'return_code': process.returncode,
+                    'usage': usage,
+                    'ts': round(time.monotonic() - started, 3)
                 }) + '\n'
             else:
+                status = 'completed'
                 yield json.dumps({
                     'job_id': job_id,
                     'status': 'completed',
-                    'return_code': 0
+                    'return_code': 0,
+                    'usage': usage,
+                    'ts': round(time.monotonic() - started, 3)
                 }) + '\n'
 
-        except subprocess.TimeoutExpired:
-            logger.error(f"Command timed out for job {job_id}")
-            yield json.dumps({
-                'job_id': job_id,
-                'status': 'error',
-                'error': 'Command execution timed out'
-            }) + '\n'
         except Exception as e:
             logger.error(f"Error executing command for job {job_id}: {str(e)}")
+            status = 'error'
             yield json.dumps({
                 'job_id': job_id,
                 'status': 'error',
                 'error': str(e)
             }) + '\n'
+        finally:
+            # Client disconnected or we bailed out early - don't leave the tree running
+            if process and process.poll() is None:
+                self._terminate(process)
+            if process:
+                for pipe in (process.stdin, process.stdout, process.stderr):
+                    self._close(pipe)
+                if usage is None:
+                    usage = self._usage(job_id, process, started, read)
+                self._record(process, started, status, usage)
+            self._release(job_id)
+
+    def _pump_output(self, process, prompt, deadline, read):
+        """
+        Write the prompt to stdin and yield (stream, line, monotonic_ts) from
+        stdout and stderr as lines arrive, counting the bytes in read. Yields ('heartbeat', None, ts)
+        after STREAM_HEARTBEAT quiet seconds and (None, None, ts) once if
+        the deadline passes before both output pipes close.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(process.stdout, selectors.EVENT_READ, 'stdout')
+        selector.register(process.stderr, selectors.EVENT_READ, 'stderr')
+        buffers = {'stdout': b'', 'stderr': b''}
+        reading = len(buffers)
+
+        # The prompt goes out in pipe-sized chunks whenever claude can take more
+        pending = memoryview(prompt.encode('utf-8'))
+        os.set_blocking(process.stdin.fileno(), False)
+        selector.register(process.stdin, selectors.EVENT_WRITE, 'stdin')
+        last_event = time.monotonic()
+
+        try:
+            while reading:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield None, None, time.monotonic()
+                    return
 
-    def execute_command(self, prompt, job_id=None):
+                now = time.monotonic()
+                if now - last_event >= STREAM_HEARTBEAT:
+                    last_event = now
+                    yield 'heartbeat', None, now
+
+                for key, _ in selector.select(timeout=min(remaining, 1.0)):
+                    stream = key.data
+                    if stream == 'stdin':
+                        pending = self._write_prompt(key.fd, pending)
+                        if not pending:
+                            selector.unregister(key.fileobj)
+                            self._close(process.stdin)
+                        continue
+
+                    data = os.read(key.fd, 65536)
+                    now = last_event = time.monotonic()
+                    metrics.inc('claude_output_bytes_total', len(data), stream=stream)
+                    read['bytes'] += len(data)
+
+                    if not data:
+                        # EOF - flush a trailing line without newline
+                        selector.unregister(key.fileobj)
+                        reading -= 1
+                        if buffers[stream]:
+                            yield stream, self._decode(buffers[stream]), now
+                            buffers[stream] = b''
+                        continue
+
+                    *lines, buffers[stream] = (buffers[stream] + data).split(b'\n')
+                    for line in lines:
+                        yield stream, self._decode(line), now
+        finally:
+            selector.close()
+
+    def _write_prompt(self, fd, pending):
+        """Write as much of the prompt as the pipe accepts; returns what is left"""
+        try:
+            written = os.write(fd, pending[:65536])
+        except BlockingIOError:
+            return pending
+        except BrokenPipeError:
+            return pending[:0]  # claude exited without reading - its output says why
+        return pending[written:]
+
+    def _close(self, pipe):
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+    def _decode(self, line):
+        return line.decode('utf-8', errors='replace').rstrip('\r')
+
+    def _usage(self, job_id, process, started, read):
+        """
+        Stop sampling a job's process tree and return its resource usage.
+        A su process is only reaped after the last sample, so the CPU time
+        of everything it waited for is included.
+        """
+        if not isinstance(process, PooledProcess):
+            wait_exited(process.pid)
+        usage = resources.finish(job_id) or {}
+        usage['wall_seconds'] = round(time.monotonic() - started, 3)
+        usage['output_bytes'] = read['bytes']
+        return usage
+
+    def _record(self, process, started, status, usage):
+        """Record duration, exit code and resource usage of a finished job process"""
+        metrics.observe('claude_job_duration_seconds', time.monotonic() - started, status=status)
+        if process.returncode is not None:
+            metrics.inc('claude_job_exit_codes_total', code=process.returncode)
+        if 'cpu_seconds' in usage:
+            metrics.observe('claude_job_cpu_seconds', usage['cpu_seconds'])
+            metrics.observe('claude_job_peak_rss_bytes', usage['peak_rss_bytes'])
+
+    def _terminate(self, process):
+        """Terminate a job's whole process tree and reap the process"""
+        terminate_process_tree(process.pid, KILL_GRACE)
+        process.wait()
+
+    def execute_command(self, prompt, job_id=None, timeout=COMMAND_TIMEOUT):
         """Execute claude command and return complete result"""
         if not job_id:
             job_id = str(uuid.uuid4())
 
-        # Build the command
-        command = [
-            'su', '-', 'clauderunner', '-c',
-            f'claude --dangerously-skip-permissions --print "{prompt}"'
-        ]
+        stdout = []
+        stderr = []
+        result = {'job_id': job_id, 'status': 'error', 'error': 'Job produced no result'}
+        for chunk in self.execute_command_stream(prompt, job_id, timeout):
+            event = json.loads(chunk)
+            if event['status'] in ('heartbeat', 'queued'):
+                continue
+            if event['status'] == 'running':
+                (stdout if event['type'] == 'stdout' else stderr).append(event['output'])
+            elif event['status'] == 'cancelled' or 'return_code' in event:
+                result = {
+                    'job_id': job_id,
+                    'status': 'cancelled' if event['status'] == 'cancelled' else 'completed',
+                    'output': '\n'.join(stdout) + '\n' if stdout else '',
+                    'error': '\n'.join(stderr) if stderr else None,
+                    'return_code': event.get('return_code')
+                }
+            else:
+                result = {'job_id': job_id, 'status': 'error', 'error': event.get('error')}
+            if event.get('usage'):
+                result['usage'] = event['usage']
+        return result
+
+metrics = job_metrics()
+runners = RunnerPool(RUNNER_COMMAND, RUNNER_POOL_SIZE)
+resources = ResourceMonitor(USAGE_INTERVAL)
+executor = ClaudeExecutor()
+
+# Store async jobs and run every Claude command through the bounded pool
+store = JobStore(JOB_DB, OUTPUT_DIR, OUTPUT_INLINE_BYTES)
+outputs = OutputStore(OUTPUT_DIR, OUTPUT_TAIL_BYTES, STREAM_MAX_LAG)
+
+def run_logged_job(prompt, job_id, timeout=None, on_chunk=None):
+    """
+    Run a command through the streaming engine, writing every chunk to the
+    job's output log. Returns a result dict shaped like execute_command().
+    """
+    output = outputs.create(job_id)
+    stdout = []
+    stderr = deque(maxlen=200)
+    result = {'job_id': job_id, 'status': 'error', 'error': 'Job produced no result'}
+    try:
+        for chunk in executor.execute_command_stream(prompt, job_id, timeout):
+            output.append(chunk)
+            if on_chunk:
+                on_chunk(chunk)
+            event = json.loads(chunk)
+            if event['status'] in ('heartbeat', 'queued'):
+                continue
+            if event['status'] == 'running':
+                (stdout if event['type'] == 'stdout' else stderr).append(event['output'])
+            elif event['status'] != 'cancelled' and 'return_code' in event:
+                result = {
+                    'job_id': job_id,
+                    'status': 'completed',
+                    'output': '\n'.join(stdout) + '\n' if stdout else '',
+                    'error': '\n'.join(stderr) if stderr else None,
+                    'return_code': event['return_code']
+                }
+            else:
+                result = {'job_id': job_id, 'status': event['status'], 'error': event.get('error')}
+            if event.get('usage'):
+                result['usage'] = event['usage']
+    finally:
+        outputs.finish(job_id)
+    return result
+
+cache = ResultCache(CACHE_SIZE, CACHE_TTL)
+
+# Per-request timeouts of queued async jobs; restored jobs use the default
+job_timeouts = {}
+
+def run_async_job(prompt, job_id):
+    """Run a persisted job and hand its result to jobs waiting on the same prompt"""
+    result = None
+    try:
+        result = run_logged_job(prompt, job_id, job_timeouts.pop(job_id, None))
+        return result
+    finally:
+        cache.release(prompt_key(prompt), job_id, result)
+
+clients = ClientPolicy.load(CLIENTS_FILE, RATE_LIMIT, RATE_BURST)
+scheduler = JobScheduler(
+    store, run_async_job, max_workers=LOCAL_WORKERS, metrics=metrics, weights=clients.weight
+)
+
+# Registered worker agents; the pool grows with their capacity
+agents = AgentRegistry(
+    LOCAL_WORKERS, ttl=3 * AGENT_HEARTBEAT, on_resize=scheduler.resize
+) if DISPATCHER and not DISPATCHER_URL else None
+metrics.gauge('claude_queue_depth', 'Jobs waiting for a worker',
+              lambda: scheduler.stats()['queue_depth'])
+metrics.gauge('claude_running_jobs', 'Jobs currently running',
+              lambda: scheduler.stats()['running_jobs'])
+metrics.gauge('claude_max_workers', 'Size of the worker pool',
+              lambda: scheduler.stats()['max_workers'])
+metrics.gauge('claude_runner_workers_idle', 'Pre-spawned runner workers ready for a job',
+              lambda: runners.stats()['idle'])
 
-        logger.info(f"Executing command for job {job_id}: {prompt[:100]}...")
+def lookup_prompt(prompt, job_id, use_cache=True):
+    """
+    Check the result cache and in-flight jobs before starting a new run.
+    Returns (key, cached_result, flight, owner); when owner is True the
+    caller must run the job and release the key afterwards. Without
+    use_cache the request always gets a fresh run of its own.
+    """
+    key = prompt_key(prompt)
+    if not use_cache:
+        return key, None, None, True
+    cached = cache.get(key)
+    if cached:
+        return key, cached, None, False
+    flight, owner = cache.claim(key, job_id)
+    return key, None, flight, owner
 
+def run_in_pool(prompt, job_id, priority=0, cache_key=None, share='default', timeout=None):
+    """Run a command on the worker pool and block until it finishes"""
+    result = {}
+    done = threading.Event()
+
+    def task():
         try:
-            result = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                stdin=subprocess.DEVNULL,
-                timeout=300  # 5 minute timeout
-            )
+            result.update(executor.execute_command(prompt, job_id, timeout or COMMAND_TIMEOUT))
+        finally:
+            if cache_key:
+                cache.release(cache_key, job_id, result)
+            done.set()
 
-            return {
-                'job_id': job_id,
-                'status': 'completed',
-                'output': result.stdout,
-                'error': result.stderr if result.stderr else None,
-                'return_code': result.returncode
-            }
+    try:
+        scheduler.submit(job_id, prompt, priority, task=task, share=share)
+    except Exception:
+        if cache_key:
+            cache.release(cache_key, job_id, None)
+        raise
+    done.wait()
+    return result
 
-        except subprocess.TimeoutExpired:
-            logger.error(f"Command timed out for job {job_id}")
-            return {
-                'job_id': job_id,
-                'status': 'error',
-                'error': 'Command execution timed out after 5 minutes'
-            }
-        except Exception as e:
-            logger.error(f"Error executing command for job {job_id}: {str(e)}")
-            return {
-                'job_id': job_id,
-                'status': 'error',
-                'error': str(e)
-            }
+def stream_in_pool(prompt, job_id, priority=0, timeout=None, cache_key=None, share='default'):
+    """
+    Queue a command on the worker pool and stream its output log as it grows.
+    The client reads from the log, so one that falls behind holds the job
+    back (STREAM_MAX_LAG) instead of piling up output in memory.
+    """
+    output = outputs.create(job_id)
+    started = threading.Event()
 
-executor = ClaudeExecutor()
+    def task():
+        started.set()
+        result = None
+        try:
+            result = run_logged_job(prompt, job_id, timeout)
+        finally:
+            if cache_key:
+                cache.release(cache_key, job_id, result)
+
+    def report_queued():
+        # Nothing else is written while the job waits for a worker
+        if not started.is_set():
+            event = {'job_id': job_id, 'status': 'queued'}
+            event.update(scheduler.queue_info(job_id))
+            output.append(json.dumps(event) + '\n')
+
+    # Submitted before the response starts, so the cache claim is always released
+    try:
+        scheduler.submit(job_id, prompt, priority, task=task, share=share)
+    except Exception:
+        if cache_key:
+            cache.release(cache_key, job_id, None)
+        raise
+    # Client going away doesn't stop the job - it can resume from /job/<id>/output
+    return follow_output(output, on_idle=report_queued)
+
+def follow_output(output, offset=0, limit=STREAM_FRAME_BYTES, on_idle=None):
+    """
+    Yield a job's log from offset until it is closed. Lines that arrive
+    within STREAM_FRAME_INTERVAL of each other go out as one frame of at
+    most limit bytes; on_idle is called after STREAM_HEARTBEAT quiet seconds.
+    """
+    position = offset
+    reader = object()
+    try:
+        while True:
+            data, position = output.read(position, limit)
+            if data:
+                yield data
+                output.track(reader, position)
+                continue
+            if output.closed:
+                break
+            if output.wait(position, timeout=STREAM_HEARTBEAT):
+                if not output.closed:
+                    time.sleep(STREAM_FRAME_INTERVAL)
+            elif on_idle:
+                on_idle()
+    finally:
+        output.untrack(reader)
+
+def replay_job(job_id, result=None, flight=None):
+    """
+    Stream another job's output for a cached or deduplicated request:
+    from its output log when there is one, otherwise rebuilt from its result.
+    """
+    if flight:
+        # Wait for the running job to open its log (or finish without one)
+        deadline = time.time() + DEDUP_WAIT
+        while outputs.open(job_id) is None and not flight.done.wait(1):
+            if time.time() > deadline:
+                break
+        result = flight.result
+
+    output = outputs.open(job_id)
+    if output:
+        yield from follow_output(output)
+        return
+
+    result = result or {'status': 'error', 'error': 'Job produced no result'}
+    for line in (result.get('output') or '').splitlines():
+        yield json.dumps({'job_id': job_id, 'status': 'running', 'output': line, 'type': 'stdout'}) + '\n'
+    if result.get('status') == 'completed':
+        yield json.dumps({'job_id': job_id, 'status': 'completed', 'return_code': result.get('return_code')}) + '\n'
+    else:
+        yield json.dumps({'job_id': job_id, 'status': 'error', 'error': result.get('error')}) + '\n'
+
+def record_shared_result(job_id, prompt, priority, result=None, flight=None):
+    """Store an async job whose result comes from the cache or another run"""
+    store.add(job_id, prompt, priority, status='running' if flight else 'completed')
+    fields = {k: v for k, v in (result or {}).items() if k != 'job_id'}
+    if not flight:
+        store.update(job_id, started=time.time(), finished=time.time(), **fields)
+        return
+
+    def wait():
+        shared = flight.wait(DEDUP_WAIT) or {'status': 'error', 'error': 'Job produced no result in time'}
+        store.update(job_id, finished=time.time(), **{k: v for k, v in shared.items() if k != 'job_id'})
+
+    Thread(target=wait, daemon=True).start()
+
+def get_priority(data):
+    """Read the optional integer priority from a request body"""
+    try:
+        return int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        raise ValueError('priority must be an integer')
+
+def get_timeout(data):
+    """Read the optional per-job timeout (seconds) from a request body"""
+    if data.get('timeout') is None:
+        return None
+    try:
+        timeout = int(data['timeout'])
+    except (TypeError, ValueError):
+        raise ValueError('timeout must be an integer')
+    if timeout <= 0:
+        raise ValueError('timeout must be positive')
+    return timeout
+
+def identify_client():
+    """Return (client, class) for the current request"""
+    return clients.identify(
+        request.headers.get('X-API-Key'),
+        request.headers.get('X-Client-ID'),
+        request.remote_addr
+    )
+
+def admit_client(client, share):
+    """Take a rate-limit token; returns 0 or the seconds the client must wait"""
+    if AGENT_TOKEN and request.headers.get('X-Agent-Token') == AGENT_TOKEN:
+        return 0  # Dispatched by our dispatcher, which already limited the client
+    retry_after = clients.admit(client, share)
+    if retry_after:
+        metrics.inc('claude_rate_limited_total', client_class=share)
+    return retry_after
+
+def rate_limited(client, retry_after):
+    seconds = math.ceil(retry_after)
+    response = jsonify({'error': 'Rate limit exceeded', 'client': client, 'retry_after': seconds})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+def with_retry_after(response, seconds):
+    """Tell pollers of a queued job when it is worth asking again"""
+    if seconds:
+        response.headers['Retry-After'] = str(math.ceil(seconds))
+    return response
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -163,25 +840,57 @@ def execute():
 
         prompt = data['prompt']
         stream = data.get('stream', False)
+        priority = get_priority(data)
+        timeout = get_timeout(data)
+
+        client, share = identify_client()
+        retry_after = admit_client(client, share)
+        if retry_after:
+            return rate_limited(client, retry_after)
 
         # Generate job ID
         job_id = str(uuid.uuid4())
 
+        # Identical prompts share cached results and running jobs
+        key, cached, flight, owner = lookup_prompt(prompt, job_id, data.get('cache', True))
+
         if stream:
+            if cached:
+                source_id, body = cached['job_id'], replay_job(cached['job_id'], result=cached)
+            elif not owner:
+                source_id, body = flight.job_id, replay_job(flight.job_id, flight=flight)
+            else:
+                source_id, body = job_id, stream_in_pool(
+                    prompt, job_id, priority, timeout, key, share
+                )
+
             # Return streaming response
             return Response(
-                stream_with_context(executor.execute_command_stream(prompt, job_id)),
+                stream_with_context(body),
                 mimetype='application/x-ndjson',
                 headers={
-                    'X-Job-ID': job_id,
+                    'X-Job-ID': source_id,
+                    'X-Cache': 'HIT' if cached else ('ATTACHED' if not owner else 'MISS'),
                     'Cache-Control': 'no-cache'
                 }
             )
         else:
             # Return complete response
-            result = executor.execute_command(prompt, job_id)
+            if cached:
+                return jsonify(dict(cached, cached=True))
+            if not owner:
+                shared = flight.wait(DEDUP_WAIT)
+                if shared is None:
+                    return jsonify({
+                        'error': 'Timed out waiting for the identical running job',
+                        'job_id': flight.job_id
+                    }), 504
+                return jsonify(dict(shared, deduplicated=True))
+            result = run_in_pool(prompt, job_id, priority, key, share, timeout)
             return jsonify(result)
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error handling request: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -195,31 +904,60 @@ def execute_async():
             return jsonify({'error': 'Missing prompt in request body'}), 400
 
         prompt = data['prompt']
+        priority = get_priority(data)
+        timeout = get_timeout(data)
         job_id = str(uuid.uuid4())
 
-        # Store job status
-        jobs[job_id] = {
-            'status': 'queued',
-            'prompt': prompt[:100],  # Store truncated prompt for reference
-            'created': time.time()
-        }
+        client, share = identify_client()
+        retry_after = admit_client(client, share)
+        if retry_after:
+            return rate_limited(client, retry_after)
+
+        key, cached, flight, owner = lookup_prompt(prompt, job_id, data.get('cache', True))
 
-        # Execute in background
-        def run_job():
-            jobs[job_id]['status'] = 'running'
-            result = executor.execute_command(prompt, job_id)
-            jobs[job_id].update(result)
+        if cached:
+            record_shared_result(job_id, prompt, priority, result=cached)
+            return jsonify(dict(store.get(job_id), cached=True))
 
-        thread = Thread(target=run_job)
-        thread.daemon = True
-        thread.start()
+        if not owner:
+            # Same prompt is already queued or running - attach to it
+            if store.get(flight.job_id):
+                job_id = flight.job_id
+            else:
+                record_shared_result(job_id, prompt, priority, flight=flight)
+            response = {
+                'job_id': job_id,
+                'status': store.get(job_id)['status'],
+                'priority': priority,
+                'deduplicated': True,
+                'message': f'Attached to running job {flight.job_id}'
+            }
+            response.update(scheduler.queue_info(flight.job_id))
+            return jsonify(response)
 
-        return jsonify({
+        # Persist the job and hand it to the worker pool
+        if timeout:
+            job_timeouts[job_id] = timeout
+        try:
+            scheduler.submit(job_id, prompt, priority, share=share)
+        except Exception:
+            # Never queued: let the next identical prompt run it
+            job_timeouts.pop(job_id, None)
+            cache.release(key, job_id, None)
+            raise
+
+        response = {
             'job_id': job_id,
             'status': 'queued',
+            'priority': priority,
+            'client': client,
             'message': 'Job queued for execution'
-        })
+        }
+        response.update(scheduler.queue_info(job_id))
+        return with_retry_after(jsonify(response), response.get('eta_seconds'))
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error handling async request: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -227,10 +965,86 @@ def execute_async():
 @app.route('/job/<job_id>', methods=['GET'])
 def get_job_status(job_id):
     """Get the status of an async job"""
-    if job_id not in jobs:
+    job = store.get(job_id)
+    if not job:
         return jsonify({'error': 'Job not found'}), 404
 
-    return jsonify(jobs[job_id])
+    if job['status'] == 'queued':
+        job.update(scheduler.queue_info(job_id))
+        return with_retry_after(jsonify(job), job.get('eta_seconds'))
+
+    return jsonify(job)
+
+@app.route('/job/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job, terminating only its own process tree"""
+    try:
+        grace = int(request.args.get('grace', KILL_GRACE))
+    except ValueError:
+        return jsonify({'error': 'grace must be an integer'}), 400
+
+    job = store.get(job_id)
+    if job and job['status'] not in ('queued', 'running'):
+        return jsonify({'error': f"Job already {job['status']}", 'job_id': job_id}), 409
+
+    terminated = executor.cancel(job_id, grace)
+    dequeued = scheduler.cancel(job_id)
+
+    if terminated is None and not dequeued and not job:
+        executor.forget(job_id)
+        return jsonify({'error': 'Job not found'}), 404
+    if job and (dequeued or terminated is None and not scheduler.is_running(job_id)):
+        # Taken off the queue, or a record attached to another job's run:
+        # no worker will see the marker, so nothing else would clear it
+        executor.forget(job_id)
+        job_timeouts.pop(job_id, None)
+
+    if job:
+        store.update(job_id, status='cancelled', finished=time.time(), error='Cancelled by request')
+
+    return jsonify({
+        'job_id': job_id,
+        'status': 'cancelled',
+        'was_running': terminated is not None,
+        'terminated_pids': terminated or []
+    })
+
+@app.route('/job/<job_id>/output', methods=['GET'])
+def get_job_output(job_id):
+    """
+    Read a job's NDJSON output from a byte offset.
+    With follow=1 the output is streamed until the job finishes; the offset
+    to resume from is the number of bytes already received.
+    """
+    output = outputs.open(job_id)
+    if output is None:
+        return jsonify({'error': 'Job output not found'}), 404
+
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = max(int(request.args.get('limit', 65536)), 1)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+
+    if request.args.get('follow', '').lower() in ('1', 'true', 'yes'):
+        return Response(
+            stream_with_context(follow_output(output, offset, limit)),
+            mimetype='application/x-ndjson',
+            headers={
+                'X-Job-ID': job_id,
+                'Cache-Control': 'no-cache'
+            }
+        )
+
+    data, next_offset = output.read(offset, limit)
+    return jsonify({
+        'job_id': job_id,
+        'offset': offset,
+        'next_offset': next_offset,
+        'size': output.size,
+        'complete': output.closed and next_offset >= output.size,
+        'events': [json.loads(line) for line in data.splitlines() if line.strip()]
+    })
 
 @app.route('/jobs', methods=['GET'])
 def list_jobs():
@@ -238,20 +1052,88 @@ def list_jobs():
     return jsonify({
         'jobs': [
             {
-                'job_id': job_id,
+                'job_id': job_info['job_id'],
                 'status': job_info.get('status'),
+                'priority': job_info.get('priority'),
                 'created': job_info.get('created'),
                 'prompt': job_info.get('prompt')
             }
-            for job_id, job_info in jobs.items()
-        ]
+            for job_info in store.list()
+        ],
+        'pool': scheduler.stats(),
+        'runners': runners.stats(),
+        'agents': agents.stats() if agents else None,
+        'clients': clients.stats(),
+        'outputs': outputs.stats(),
+        'cache': cache.stats()
     })
 
+@app.route('/jobs/usage', methods=['GET'])
+def jobs_usage():
+    """CPU time and memory totals over stored jobs, and the most expensive ones"""
+    try:
+        top = min(max(int(request.args.get('top', 10)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'top must be an integer'}), 400
+    summary = store.usage_summary(top)
+    summary['monitor'] = resources.stats()
+    return jsonify(summary)
+
+def agent_token_ok():
+    # Without a configured token nobody may register: agents receive every client's prompts
+    return bool(AGENT_TOKEN) and request.headers.get('X-Agent-Token') == AGENT_TOKEN
+
+@app.route('/agents', methods=['POST'])
+def register_agent():
+    """Register a worker agent or refresh its heartbeat and load report"""
+    if DISPATCHER_URL:
+        return jsonify({'error': f'This server is an agent of {DISPATCHER_URL}'}), 409
+    if agents is None:
+        return jsonify({'error': 'Agent registration is disabled (set CLAUDE_DISPATCHER=1)'}), 403
+    if not AGENT_TOKEN:
+        return jsonify({'error': 'Agent registration requires CLAUDE_AGENT_TOKEN'}), 403
+    if not agent_token_ok():
+        return jsonify({'error': 'Invalid agent token'}), 403
+
+    data = request.get_json(silent=True) or {}
+    if not data.get('name') or not data.get('url'):
+        return jsonify({'error': 'Missing name or url in request body'}), 400
+    try:
+        capacity = int(data.get('capacity', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'capacity must be an integer'}), 400
+
+    report = {k: v for k, v in data.items() if k not in ('name', 'url', 'capacity')}
+    agents.register(data['name'], data['url'], capacity, report)
+    return jsonify({'registered': data['name'], 'capacity': agents.capacity()})
+
+@app.route('/agents', methods=['GET'])
+def list_agents():
+    """List registered worker agents and their load"""
+    if agents is None:
+        return jsonify({'dispatcher': DISPATCHER_URL, 'agents': []})
+    agents.expire()
+    return jsonify(agents.stats())
+
+@app.route('/agents/<name>', methods=['DELETE'])
+def remove_agent(name):
+    """Deregister a worker agent; jobs already running on it carry on"""
+    if agents is None or not agent_token_ok():
+        return jsonify({'error': 'Invalid agent token'}), 403
+    if not agents.remove(name):
+        return jsonify({'error': 'Agent not found'}), 404
+    return jsonify({'removed': name})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose queue, latency and output metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test', methods=['GET'])
 def test_endpoint():
     """Test endpoint with a simple prompt"""
     test_prompt = "Print only: Hello from Claude Execution Server"
-    result = executor.execute_command(test_prompt)
+    result = run_in_pool(test_prompt, str(uuid.uuid4()))
     return jsonify({
         'test': True,
         'prompt': test_prompt,
@@ -265,19 +1147,41 @@ if __name__ == '__main__':
 
     logger.info(f"Starting Claude Execution Server on {host}:{port}")
 
-    # Clean up old jobs periodically (older than 1 hour)
+    # Restore queued jobs from the store and start the worker pool
+    scheduler.start()
+    runners.start()
+
+    # Clean up processes left behind by finished or cancelled jobs
+    reaper = OrphanReaper(executor.tracked_pids, grace=KILL_GRACE)
+    reaper.start()
+
+    if agents is not None and not AGENT_TOKEN:
+        logger.error("CLAUDE_DISPATCHER=1 without CLAUDE_AGENT_TOKEN - agent registration is refused")
+
+    if DISPATCHER_URL:
+        # Report capacity and load so the dispatcher can send us jobs
+        AgentHeartbeat(
+            DISPATCHER_URL,
+            AGENT_NAME or f'{socket.gethostname()}:{port}',
+            AGENT_URL or f'http://127.0.0.1:{port}',
+            MAX_WORKERS,
+            lambda: dict(scheduler.stats(), runners_idle=runners.stats()['idle']),
+            token=AGENT_TOKEN,
+            interval=AGENT_HEARTBEAT
+        ).start()
+
+    # Evict old jobs a few at a time instead of in one big hourly sweep
     def cleanup_jobs():
         while True:
-            time.sleep(3600)  # Check every hour
-            current_time = time.time()
-            expired = [
-                job_id for job_id, job_info in jobs.items()
-                if current_time - job_info.get('created', current_time) > 3600
-            ]
-            for job_id in expired:
-                del jobs[job_id]
-            if expired:
-                logger.info(f"Cleaned up {len(expired)} expired jobs")
+            time.sleep(CLEANUP_INTERVAL)
+            try:
+                expired = store.prune(JOB_RETENTION, JOB_MAX_COUNT, JOB_MAX_BYTES)
+                expired_outputs = outputs.prune(JOB_RETENTION, JOB_MAX_COUNT, JOB_MAX_BYTES)
+            except Exception as e:
+                logger.error(f"Job cleanup failed: {str(e)}")
+                continue
+            if expired or expired_outputs:
+                logger.info(f"Cleaned up {expired} expired jobs and {expired_outputs} output logs")
 
     cleanup_thread = Thread(target=cleanup_jobs)
     cleanup_thread.daemon = True
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Claude Runner Worker
+Started by the Claude Execution Server as clauderunner (via su -), so the
+login shell and profile are only paid for once. It keeps a claude process
+started ahead of time and, for every request, hands that process's pipes
+to the server over the unix socket on stdin. The server writes the prompt
+and reads the output directly; the worker only reports the exit code.
+Usage: claude-runner-worker.py [claude binary]
+"""
+
+import json
+import socket
+import subprocess
+import sys
+
+CLAUDE_BIN = sys.argv[1] if len(sys.argv) > 1 else 'claude'
+CLAUDE_COMMAND = [CLAUDE_BIN, '--dangerously-skip-permissions', '--print']
+
+
+def spawn_claude():
+    """Start claude waiting for its prompt on stdin"""
+    return subprocess.Popen(
+        CLAUDE_COMMAND,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+
+
+def main():
+    sock = socket.socket(fileno=0)
+    process = spawn_claude()
+    try:
+        while True:
+            request = sock.recv(4096)
+            if not request:
+                break  # Server closed the socket
+
+            if process.poll() is not None:
+                # The waiting claude exited on its own - start a fresh one
+                process = spawn_claude()
+
+            pipes = (process.stdin, process.stdout, process.stderr)
+            socket.send_fds(
+                sock, [json.dumps({'pid': process.pid}).encode()], [p.fileno() for p in pipes]
+            )
+            for pipe in pipes:
+                pipe.close()
+
+            return_code = process.wait()
+            sock.send(json.dumps({'return_code': return_code}).encode())
+
+            # Warm up the next one while the server is busy with the output
+            process = spawn_claude()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    except Exception as e:
+        print(f"claude-runner-worker: {str(e)}", file=sys.stderr)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
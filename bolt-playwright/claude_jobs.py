@@ -0,0 +1,1662 @@
+"""
+Shared building blocks of the Claude Execution Servers
+Job store, scheduler, per-job output logs, result cache, client rate
+limits, process-tree cleanup, runner pool, worker agents, resource
+usage and metrics.
+"""
+
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict, deque
+from threading import Thread
+
+logger = logging.getLogger(__name__)
+
+# Columns that can be written through JobStore.update()
+JOB_FIELDS = (
+    'status', 'priority', 'prompt', 'created', 'started', 'finished',
+    'output', 'error', 'return_code', 'usage'
+)
+
+
+# Columns returned by JobStore.list() - outputs stay on disk
+JOB_SUMMARY_FIELDS = (
+    'job_id', 'status', 'priority', 'prompt', 'created', 'started', 'finished',
+    'return_code', 'output_bytes', 'usage'
+)
+
+
+class JobStore:
+    """
+    SQLite-backed store for async job records.
+    Outputs larger than inline_limit bytes are kept in files in blob_dir
+    and only loaded when a single job is read.
+    """
+
+    def __init__(self, db_path, blob_dir=None, inline_limit=65536):
+        self.db_path = db_path
+        self.blob_dir = blob_dir
+        self.inline_limit = inline_limit
+        if blob_dir:
+            os.makedirs(blob_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    prompt TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    output TEXT,
+                    error TEXT,
+                    return_code INTEGER,
+                    output_bytes INTEGER,
+                    usage TEXT,
+                    cpu_seconds REAL,
+                    peak_rss_bytes INTEGER
+                )
+            """)
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in (
+                ('output_bytes', 'INTEGER'), ('usage', 'TEXT'),
+                ('cpu_seconds', 'REAL'), ('peak_rss_bytes', 'INTEGER')
+            ):
+                if column not in columns:
+                    self.conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created)'
+            )
+            # Time-ordered index that retention walks from the oldest end
+            self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)')
+
+    def add(self, job_id, prompt, priority=0, status='queued'):
+        """Insert a new job record"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO jobs (job_id, status, priority, prompt, created) VALUES (?, ?, ?, ?, ?)',
+                (job_id, status, priority, prompt, time.time())
+            )
+
+    def update(self, job_id, **fields):
+        """Update selected columns of a job record"""
+        fields = {k: v for k, v in fields.items() if k in JOB_FIELDS}
+        if not fields:
+            return
+        if fields.get('usage'):
+            # Kept as JSON, with the columns usage_summary() ranks by alongside
+            fields['cpu_seconds'] = fields['usage'].get('cpu_seconds')
+            fields['peak_rss_bytes'] = fields['usage'].get('peak_rss_bytes')
+            fields['usage'] = json.dumps(fields['usage'])
+        if fields.get('output') is not None:
+            fields['output_bytes'] = len(fields['output'].encode('utf-8'))
+            if fields['output_bytes'] > self.inline_limit and self._blob_path(job_id):
+                self._write_blob(job_id, fields['output'])
+                fields['output'] = None
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self.lock, self.conn:
+            self.conn.execute(
+                f'UPDATE jobs SET {assignments} WHERE job_id = ?',
+                (*fields.values(), job_id)
+            )
+
+    def get(self, job_id):
+        """Return the job record as a dict, or None if unknown"""
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        if 'output' not in job and job.get('output_bytes'):
+            output = self._read_blob(job_id)
+            if output is not None:
+                job['output'] = output
+        return job
+
+    def list(self):
+        """Return the metadata of all job records, oldest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(JOB_SUMMARY_FIELDS)} FROM jobs ORDER BY created"
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def pending(self):
+        """Return (job_id, prompt, priority, created) for every queued job"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT job_id, prompt, priority, created FROM jobs WHERE status = 'queued' "
+                "ORDER BY priority DESC, created"
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def fail_interrupted(self):
+        """Mark jobs that were running when the server stopped as failed"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'error', error = ?, finished = ? WHERE status = 'running'",
+                ('Job interrupted by server restart', time.time())
+            )
+        return cursor.rowcount
+
+    def prune(self, max_age=None, max_count=None, max_bytes=None):
+        """
+        Delete the oldest finished jobs until they are all younger than
+        max_age seconds and there are at most max_count of them holding at
+        most max_bytes of output. Returns the number of deleted jobs.
+        """
+        finished = "status NOT IN ('queued', 'running')"
+        with self.lock:
+            doomed = []
+            if max_age is not None:
+                cutoff = time.time() - max_age
+                doomed = [row[0] for row in self.conn.execute(
+                    f"SELECT job_id FROM jobs WHERE {finished} "
+                    "AND (finished < ? OR (finished IS NULL AND created < ?))",
+                    (cutoff, cutoff)
+                )]
+
+            if max_count is not None or max_bytes is not None:
+                count, total = self.conn.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(output_bytes), 0) FROM jobs WHERE {finished}"
+                ).fetchone()
+                skip = set(doomed)
+                count -= len(skip)
+                # Oldest first, stopping as soon as both limits hold
+                rows = self.conn.execute(
+                    f"SELECT job_id, COALESCE(output_bytes, 0) FROM jobs WHERE {finished} ORDER BY finished"
+                )
+                for job_id, size in rows:
+                    if job_id in skip:
+                        total -= size
+                        continue
+                    over_count = max_count is not None and count > max_count
+                    over_bytes = max_bytes is not None and total > max_bytes
+                    if not over_count and not over_bytes:
+                        break
+                    doomed.append(job_id)
+                    count -= 1
+                    total -= size
+
+            with self.conn:
+                for start in range(0, len(doomed), 500):
+                    batch = doomed[start:start + 500]
+                    self.conn.execute(
+                        f"DELETE FROM jobs WHERE job_id IN ({', '.join('?' * len(batch))})", batch
+                    )
+
+        for job_id in doomed:
+            path = self._blob_path(job_id)
+            if path and os.path.exists(path):
+                os.remove(path)
+        return len(doomed)
+
+    def usage_summary(self, top=10):
+        """Totals over jobs with resource usage, and the most expensive ones"""
+        with self.lock:
+            count, cpu, avg_cpu, peak, avg_peak = self.conn.execute(
+                'SELECT COUNT(*), SUM(cpu_seconds), AVG(cpu_seconds), MAX(peak_rss_bytes), '
+                'AVG(peak_rss_bytes) FROM jobs WHERE usage IS NOT NULL'
+            ).fetchone()
+            ranked = {}
+            for column in ('cpu_seconds', 'peak_rss_bytes'):
+                rows = self.conn.execute(
+                    'SELECT job_id, status, prompt, usage FROM jobs WHERE usage IS NOT NULL '
+                    f'ORDER BY {column} DESC LIMIT ?', (top,)
+                ).fetchall()
+                ranked[column] = [self._to_dict(row) for row in rows]
+        return {
+            'jobs': count,
+            'cpu_seconds': round(cpu or 0, 3),
+            'avg_cpu_seconds': round(avg_cpu or 0, 3),
+            'max_peak_rss_bytes': peak or 0,
+            'avg_peak_rss_bytes': int(avg_peak or 0),
+            'top_cpu': ranked['cpu_seconds'],
+            'top_memory': ranked['peak_rss_bytes']
+        }
+
+    def _blob_path(self, job_id):
+        if not self.blob_dir:
+            return None
+        try:
+            job_id = str(uuid.UUID(job_id))
+        except ValueError:
+            return None
+        return os.path.join(self.blob_dir, f'{job_id}.out')
+
+    def _write_blob(self, job_id, output):
+        path = self._blob_path(job_id)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(output)
+        os.replace(path + '.tmp', path)
+
+    def _read_blob(self, job_id):
+        path = self._blob_path(job_id)
+        try:
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+        except (OSError, TypeError):
+            return None
+
+    def _to_dict(self, row):
+        job = dict(row)
+        job['prompt'] = job['prompt'][:100]  # Only expose truncated prompt for reference
+        if job.get('usage'):
+            job['usage'] = json.loads(job['usage'])
+        job.pop('cpu_seconds', None)
+        job.pop('peak_rss_bytes', None)
+        return {k: v for k, v in job.items() if v is not None}
+
+
+class JobScheduler:
+    """
+    Bounded worker pool fed by a priority queue. Within a priority, client
+    classes share the workers by weight (weights maps a class to its
+    weight), and each class is FIFO.
+    """
+
+    def __init__(self, store, runner, max_workers=2, metrics=None, weights=None):
+        self.store = store
+        self.runner = runner
+        self.max_workers = max_workers
+        self.metrics = metrics
+        self.weights = weights or (lambda share: 1)
+        self.fair = FairShare()
+        self.queue = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.running = {}
+        self.avg_duration = None
+        self.workers = []
+        self.started = False
+
+    def start(self):
+        """Restore persisted queued jobs and start the worker threads"""
+        interrupted = self.store.fail_interrupted()
+        if interrupted:
+            logger.warning(f"Marked {interrupted} interrupted jobs as failed")
+
+        restored = self.store.pending()
+        with self.cond:
+            for job_id, prompt, priority, _created in restored:
+                self._push(job_id, prompt, priority, None)
+        if restored:
+            logger.info(f"Restored {len(restored)} queued jobs from {self.store.db_path}")
+
+        with self.cond:
+            self.started = True
+        self._start_workers(self.max_workers)
+        logger.info(f"Started worker pool with {self.max_workers} workers")
+
+    def resize(self, max_workers):
+        """Change how many jobs may run at once (e.g. as worker agents come and go)"""
+        with self.cond:
+            if max_workers == self.max_workers:
+                return
+            logger.info(f"Worker pool resized from {self.max_workers} to {max_workers}")
+            self.max_workers = max_workers
+            self.cond.notify_all()
+            started = self.started
+        if started:
+            self._start_workers(max_workers)
+
+    def _start_workers(self, count):
+        # Threads are never stopped; those beyond max_workers just stay idle
+        while len(self.workers) < count:
+            worker = Thread(
+                target=self._worker_loop, name=f'claude-worker-{len(self.workers)}', daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, job_id, prompt, priority=0, task=None, share='default'):
+        """
+        Queue a job for execution on behalf of client class share.
+        Without a task the job is persisted and run with the default runner;
+        a task callable runs an ephemeral job that is not stored.
+        """
+        if task is None:
+            self.store.add(job_id, prompt, priority)
+        with self.cond:
+            self._push(job_id, prompt, priority, task, share)
+            self.cond.notify()
+
+    def cancel(self, job_id):
+        """
+        Take a queued job off the queue. Returns True if it was queued.
+        Ephemeral tasks stay queued so their waiters are released; the
+        executor skips them once a worker picks them up.
+        """
+        with self.cond:
+            entry = next((e for e in self.queue if e[2] == job_id), None)
+            if entry is None:
+                return False
+            if entry[4] is None:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+            return True
+
+    def is_running(self, job_id):
+        """True while a worker has the job, including before its process starts"""
+        with self.cond:
+            return job_id in self.running
+
+    def queue_info(self, job_id):
+        """Return queue position, depth and estimated wait for a queued job"""
+        with self.cond:
+            ordered = sorted(self.queue)
+            depth = len(ordered)
+            running = len(self.running)
+            position = next(
+                (i for i, entry in enumerate(ordered) if entry[2] == job_id), None
+            )
+            avg = self.avg_duration
+
+        info = {'queue_depth': depth, 'running_jobs': running}
+        if position is not None:
+            info['queue_position'] = position + 1
+            if avg is not None:
+                # Everything ahead plus the running jobs must drain through the pool
+                info['eta_seconds'] = round(
+                    (position + running) / max(self.max_workers, 1) * avg + avg, 1
+                )
+        return info
+
+    def stats(self):
+        """Return pool-wide counters"""
+        with self.cond:
+            by_class = {}
+            for entry in self.queue:
+                by_class[entry[6]] = by_class.get(entry[6], 0) + 1
+            return {
+                'max_workers': self.max_workers,
+                'queue_depth': len(self.queue),
+                'queued_by_class': by_class,
+                'running_jobs': len(self.running),
+                'avg_duration': round(self.avg_duration, 1) if self.avg_duration else None
+            }
+
+    def _push(self, job_id, prompt, priority, task, share='default'):
+        # Higher priority first, then fair-share order, then submission order
+        start, finish = self.fair.tag(share, self.weights(share))
+        heapq.heappush(self.queue, (
+            -priority, (finish, next(self.counter)), job_id, prompt, task, time.time(), share, start
+        ))
+
+    def _worker_loop(self):
+        while True:
+            with self.cond:
+                while not self.queue or len(self.running) >= self.max_workers:
+                    self.cond.wait()
+                _, _, job_id, prompt, task, queued, _, start = heapq.heappop(self.queue)
+                self.fair.started(start)
+                self.running[job_id] = time.time()
+
+            started = time.time()
+            if self.metrics:
+                self.metrics.observe('claude_job_queue_wait_seconds', started - queued)
+            try:
+                if task is not None:
+                    task()
+                else:
+                    self._run_persisted(job_id, prompt)
+            except Exception as e:
+                logger.error(f"Worker failed on job {job_id}: {str(e)}")
+            finally:
+                duration = time.time() - started
+                with self.cond:
+                    del self.running[job_id]
+                    self.cond.notify()  # A thread held back by max_workers may go on
+                    if self.avg_duration is None:
+                        self.avg_duration = duration
+                    else:
+                        self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+
+    def _run_persisted(self, job_id, prompt):
+        self.store.update(job_id, status='running', started=time.time())
+        try:
+            result = self.runner(prompt, job_id)
+        except Exception as e:
+            result = {'status': 'error', 'error': str(e)}
+        result.pop('job_id', None)
+        self.store.update(job_id, finished=time.time(), **result)
+
+
+
+class JobOutput:
+    """
+    Append-only NDJSON output log for one job.
+    Every line goes to disk; only a bounded tail is kept in memory.
+    Offsets are byte positions in the log and always fall on line boundaries.
+    With max_lag set, append() blocks while a tracked reader is more than
+    max_lag bytes behind, so a slow client holds back the job's producer
+    (for up to stall_timeout seconds, after which that reader is dropped).
+    """
+
+    def __init__(self, path, tail_bytes=262144, writable=True, max_lag=0, stall_timeout=60):
+        self.path = path
+        self.max_tail = tail_bytes
+        self.tail = deque()  # (offset, data) for the most recent lines
+        self.tail_size = 0
+        self.max_lag = max_lag
+        self.stall_timeout = stall_timeout
+        self.readers = {}  # reader token -> offset it has sent up to
+        self.cond = threading.Condition()
+        if writable:
+            self.file = open(path, 'ab')
+            self.size = self.file.tell()
+            self.closed = False
+        else:
+            self.file = None
+            self.size = os.path.getsize(path)
+            self.closed = True
+
+    def append(self, line):
+        """Append one NDJSON line (str or bytes, newline terminated)"""
+        data = line.encode('utf-8') if isinstance(line, str) else line
+        with self.cond:
+            if self.closed:
+                return
+            self.file.write(data)
+            self.file.flush()
+            self.tail.append((self.size, data))
+            self.tail_size += len(data)
+            self.size += len(data)
+            # Spill: older lines are only kept on disk
+            while self.tail_size > self.max_tail and len(self.tail) > 1:
+                _, dropped = self.tail.popleft()
+                self.tail_size -= len(dropped)
+            self.cond.notify_all()
+            if self.max_lag and self.readers:
+                self._wait_for_readers()
+
+    def _wait_for_readers(self):
+        deadline = time.monotonic() + self.stall_timeout
+        while True:
+            lagging = [t for t, pos in self.readers.items() if self.size - pos > self.max_lag]
+            if not lagging:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Stop waiting for this reader; it catches up from disk
+                logger.warning(f"Dropping backpressure from {len(lagging)} stalled readers of {self.path}")
+                for token in lagging:
+                    self.readers.pop(token, None)
+                return
+            self.cond.wait(remaining)
+
+    def track(self, token, offset):
+        """Record how far a live reader has got; append() may wait for it"""
+        with self.cond:
+            if token in self.readers or offset >= self.size - self.max_lag:
+                self.readers[token] = offset
+                self.cond.notify_all()
+
+    def untrack(self, token):
+        with self.cond:
+            if self.readers.pop(token, None) is not None:
+                self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            if self.file:
+                self.file.close()
+            self.closed = True
+            self.readers.clear()
+            self.cond.notify_all()
+
+    def read(self, offset=0, limit=65536):
+        """
+        Return (data, next_offset) with whole lines starting at offset.
+        An offset inside a line is moved forward to the next line start.
+        """
+        with self.cond:
+            size = self.size
+            if offset >= size:
+                return b'', size
+            if self.tail and offset >= self.tail[0][0]:
+                return self._read_tail(offset, limit)
+
+        with open(self.path, 'rb') as f:
+            if offset > 0:
+                f.seek(offset - 1)
+                if f.read(1) != b'\n':
+                    f.readline()
+                offset = f.tell()
+            data = f.read(max(min(limit, size - offset), 0))
+            if data and not data.endswith(b'\n'):
+                cut = data.rfind(b'\n')
+                # Always return at least one line, even if it exceeds the limit
+                data = data[:cut + 1] if cut >= 0 else data + f.readline()
+        return data, offset + len(data)
+
+    def _read_tail(self, offset, limit):
+        parts = []
+        length = 0
+        for start, data in self.tail:
+            if start < offset:
+                continue
+            if parts and length + len(data) > limit:
+                break
+            if not parts:
+                offset = start
+            parts.append(data)
+            length += len(data)
+        if not parts:
+            return b'', self.size
+        return b''.join(parts), offset + length
+
+    def iter_lines(self, offset=0):
+        """Yield every line from offset to the current end of the log"""
+        while True:
+            data, next_offset = self.read(offset)
+            if not data:
+                return
+            yield from data.splitlines(keepends=True)
+            offset = next_offset
+
+    def wait(self, offset, timeout=None):
+        """Block until the log grows beyond offset or is closed; return True if so"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.size > offset or self.closed, timeout)
+
+
+class OutputStore:
+    """
+    Directory of per-job output logs.
+    Finished logs are tracked in an index ordered by finish time, so
+    retention only ever looks at the oldest entries.
+    """
+
+    def __init__(self, directory, tail_bytes=262144, max_lag=0):
+        self.directory = directory
+        self.tail_bytes = tail_bytes
+        self.max_lag = max_lag
+        self.live = {}
+        self.finished = OrderedDict()  # job_id -> (finished, size), oldest first
+        self.finished_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def create(self, job_id):
+        """Start a writable log for a job, or return the one already started"""
+        with self.lock:
+            output = self.live.get(job_id)
+            if output is None:
+                output = JobOutput(self._path(job_id), self.tail_bytes, max_lag=self.max_lag)
+                self.live[job_id] = output
+        return output
+
+    def finish(self, job_id):
+        """Close a job's log; it stays readable from disk"""
+        with self.lock:
+            output = self.live.pop(job_id, None)
+        if output:
+            output.close()
+            with self.lock:
+                self._index(job_id, time.time(), output.size)
+
+    def open(self, job_id):
+        """Return the job's log (live or finished), or None if there is none"""
+        with self.lock:
+            output = self.live.get(job_id)
+        if output:
+            return output
+        path = self._path(job_id)
+        if path and os.path.exists(path):
+            return JobOutput(path, writable=False)
+        return None
+
+    def prune(self, max_age=None, max_count=None, max_bytes=None):
+        """
+        Delete the oldest finished logs until all are younger than max_age
+        seconds, at most max_count remain and they hold at most max_bytes.
+        Returns the number of deleted logs.
+        """
+        cutoff = time.time() - max_age if max_age is not None else None
+        doomed = []
+        with self.lock:
+            while self.finished:
+                job_id, (finished, size) = next(iter(self.finished.items()))
+                expired = cutoff is not None and finished < cutoff
+                over_count = max_count is not None and len(self.finished) > max_count
+                over_bytes = max_bytes is not None and self.finished_bytes > max_bytes
+                if not (expired or over_count or over_bytes):
+                    break
+                self.finished.popitem(last=False)
+                self.finished_bytes -= size
+                doomed.append(job_id)
+        for job_id in doomed:
+            try:
+                os.remove(self._path(job_id))
+            except OSError:
+                pass
+        return len(doomed)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'live': len(self.live),
+                'finished': len(self.finished),
+                'finished_bytes': self.finished_bytes
+            }
+
+    def _index(self, job_id, finished, size):
+        old = self.finished.pop(job_id, None)
+        if old:
+            self.finished_bytes -= old[1]
+        self.finished[job_id] = (finished, size)
+        self.finished_bytes += size
+
+    def _load_index(self):
+        """Index the logs left by a previous run, oldest first"""
+        logs = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.ndjson'):
+                stat = entry.stat()
+                logs.append((stat.st_mtime, entry.name[:-len('.ndjson')], stat.st_size))
+        for finished, job_id, size in sorted(logs):
+            self._index(job_id, finished, size)
+
+    def _path(self, job_id):
+        # Job ids are UUIDs; anything else must not become a path
+        try:
+            job_id = str(uuid.UUID(job_id))
+        except ValueError:
+            return None
+        return os.path.join(self.directory, f'{job_id}.ndjson')
+
+
+def prompt_key(prompt):
+    """Content hash of a prompt with whitespace differences normalized away"""
+    normalized = ' '.join(prompt.split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class Flight:
+    """A job currently computing the result for a prompt"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.result = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.result
+
+
+class ResultCache:
+    """
+    LRU cache of successful results keyed by prompt hash, with a TTL.
+    Also tracks in-flight jobs so identical prompts attach to one run.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (stored_at, result)
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.attached = 0
+
+    def get(self, key):
+        """Return a cached result, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1])
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def claim(self, key, job_id):
+        """
+        Register job_id as computing key. Returns (flight, owner): owner is
+        False if another job already runs this prompt and flight is its run.
+        """
+        with self.lock:
+            flight = self.inflight.get(key)
+            if flight:
+                self.attached += 1
+                return flight, False
+            flight = self.inflight[key] = Flight(job_id)
+            return flight, True
+
+    def release(self, key, job_id, result):
+        """Finish a claimed run: cache a successful result and wake attached waiters"""
+        with self.lock:
+            flight = self.inflight.get(key)
+            if flight and flight.job_id == job_id:
+                del self.inflight[key]
+            else:
+                flight = None
+            if result and result.get('status') == 'completed' and result.get('return_code') == 0:
+                self.entries[key] = (time.time(), dict(result))
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        if flight:
+            flight.result = result
+            flight.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'inflight': len(self.inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'attached': self.attached
+            }
+
+
+class TokenBucket:
+    """Holds up to burst tokens, refilled at rate tokens per second"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take a token; returns 0, or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ClientPolicy:
+    """
+    Client classes, each with a fair-share weight and a per-client rate
+    limit (requests per minute with a burst), and the API keys that belong
+    to them. Requests without a known key fall into the default class and
+    are limited per address, since any other header is theirs to rotate.
+    A known key may split its limit per end user with X-Client-ID.
+    """
+
+    def __init__(self, classes=None, keys=None, default_rate=0, default_burst=10, max_clients=10000):
+        self.classes = {'default': {'weight': 1, 'rate': default_rate, 'burst': default_burst}}
+        for name, settings in (classes or {}).items():
+            self.classes[name] = dict(self.classes['default'], **settings)
+        self.keys = keys or {}
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()  # client -> TokenBucket, least recently used first
+        self.lock = threading.Lock()
+        self.rejected = {}
+
+    @classmethod
+    def load(cls, path, default_rate=0, default_burst=10):
+        """Read {"classes": {...}, "keys": {...}} from a JSON file, if it exists"""
+        config = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                config = json.load(f)
+            logger.info(f"Loaded {len(config.get('keys', {}))} client keys from {path}")
+        return cls(config.get('classes'), config.get('keys'), default_rate, default_burst)
+
+    def identify(self, api_key=None, client_id=None, address=None):
+        """Return (client, class name) for a request"""
+        entry = self.keys.get(api_key) if api_key else None
+        if not entry:
+            # Unknown keys and client ids cost nothing to change, the address does
+            return f'ip:{address}', 'default'
+        share = entry.get('class', 'default')
+        client = entry.get('client', share)
+        if client_id:
+            # e.g. the Telegram bot's users, each with the class's own limit
+            client = f'{client}:{client_id[:100]}'
+        return client, share if share in self.classes else 'default'
+
+    def weight(self, share):
+        return self.classes.get(share, self.classes['default'])['weight']
+
+    def admit(self, client, share):
+        """Take a request token for client; returns 0, or the seconds to wait before retrying"""
+        settings = self.classes.get(share, self.classes['default'])
+        if not settings['rate']:
+            return 0
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(settings['rate'] / 60, settings['burst'])
+                while len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            self.buckets.move_to_end(client)
+            wait = bucket.take()
+            if wait:
+                self.rejected[share] = self.rejected.get(share, 0) + 1
+            return wait
+
+    def stats(self):
+        with self.lock:
+            return {
+                'classes': self.classes,
+                'keys': len(self.keys),
+                'tracked_clients': len(self.buckets),
+                'rejected': dict(self.rejected)
+            }
+
+
+class FairShare:
+    """
+    Start-time fair queuing tags. Each job of a class with weight w moves
+    that class's virtual clock on by 1/w and jobs run in order of their
+    virtual finish time, so classes with work queued share the workers in
+    proportion to their weights and an idle class can't bank credit.
+    Not locked - callers hold their queue's lock.
+    """
+
+    def __init__(self):
+        self.vtime = 0.0
+        self.finish = {}
+
+    def tag(self, share, weight=1):
+        """Return (start, finish) virtual times for a new job of class share"""
+        start = max(self.vtime, self.finish.get(share, 0.0))
+        finish = start + 1.0 / max(weight, 0.001)
+        self.finish[share] = finish
+        return start, finish
+
+    def started(self, start):
+        """Advance the virtual clock when a job leaves the queue"""
+        self.vtime = max(self.vtime, start)
+
+
+def _children_by_parent():
+    """Map parent pid -> child pids from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        stat = _read_stat(int(entry))
+        if stat:
+            children.setdefault(stat['ppid'], []).append(int(entry))
+    return children
+
+
+def _read_stat(pid):
+    """
+    Return state, ppid, start time, CPU time (own plus reaped children's)
+    and resident pages of a process. Times are in clock ticks.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces and parentheses - split after it
+    fields = data[data.rindex(')') + 2:].split()
+    return {
+        'state': fields[0],
+        'ppid': int(fields[1]),
+        'cpu': sum(int(ticks) for ticks in fields[11:15]),  # utime stime cutime cstime
+        'starttime': int(fields[19]),
+        'rss': int(fields[21])
+    }
+
+
+def _read_peak_rss(pid):
+    """Highest resident set size (VmHWM) of a process in bytes, 0 if unknown"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def process_tree(pid):
+    """Return pid followed by all of its descendants"""
+    children = _children_by_parent()
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def process_alive(pid):
+    """True if the process exists and is not a zombie"""
+    stat = _read_stat(pid)
+    return stat is not None and stat['state'] != 'Z'
+
+
+def process_age(pid):
+    """Seconds since the process started, or None if it is gone"""
+    stat = _read_stat(pid)
+    if stat is None:
+        return None
+    with open('/proc/uptime') as f:
+        uptime = float(f.read().split()[0])
+    return uptime - stat['starttime'] / os.sysconf('SC_CLK_TCK')
+
+
+def _signal(pid, sig, group=False):
+    try:
+        if group:
+            os.killpg(pid, sig)
+        else:
+            os.kill(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def terminate_process_tree(pid, grace=10):
+    """
+    SIGTERM a job's process group and every descendant, then SIGKILL whatever
+    is still alive after the grace period. Descendants are tracked by pid as
+    well, because su starts the command in a session of its own.
+    Returns the pids that were signalled.
+    """
+    pids = process_tree(pid)
+    _signal(pid, signal.SIGTERM, group=True)
+    for child in pids:
+        _signal(child, signal.SIGTERM)
+
+    deadline = time.monotonic() + grace
+    while time.monotonic() < deadline and any(process_alive(p) for p in pids):
+        time.sleep(0.1)
+
+    # Children may have forked during the grace period
+    survivors = {p for p in pids + process_tree(pid) if process_alive(p)}
+    if survivors:
+        logger.warning(f"Killing {len(survivors)} processes that ignored SIGTERM")
+        _signal(pid, signal.SIGKILL, group=True)
+        for child in survivors:
+            _signal(child, signal.SIGKILL)
+    return pids
+
+
+class ResourceMonitor:
+    """
+    Samples CPU time and resident memory of each running job's process
+    tree from /proc. CPU time counts every process in the tree plus the
+    children they have reaped, so a final sample taken while the job's own
+    process is exited but not yet reaped covers the whole run. Peak memory
+    is the larger of the tree's summed RSS at any sample and the highest
+    VmHWM of a single process.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.jobs = {}  # job_id -> usage of the running job
+        self.lock = threading.Lock()
+        self.thread = None
+        self.tick = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def watch(self, job_id, pid):
+        """Start sampling the process tree rooted at pid"""
+        with self.lock:
+            self.jobs[job_id] = {'pid': pid, 'cpu': 0, 'peak_rss': 0, 'processes': 0}
+            if self.thread is None and self.interval:
+                self.thread = Thread(target=self._loop, name='resource-monitor', daemon=True)
+                self.thread.start()
+        self.sample(job_id)
+
+    def sample(self, job_id=None):
+        """Sample one job, or all of them, now"""
+        with self.lock:
+            jobs = [job_id] if job_id else list(self.jobs)
+            roots = {job: self.jobs[job]['pid'] for job in jobs if job in self.jobs}
+        if not roots:
+            return
+        children = _children_by_parent()
+        for job, root in roots.items():
+            tree = [root]
+            for parent in tree:
+                tree.extend(children.get(parent, []))
+            cpu = rss = peak = alive = 0
+            for pid in tree:
+                stat = _read_stat(pid)
+                if stat is None:
+                    continue
+                cpu += stat['cpu']
+                rss += stat['rss'] * self.page_size
+                if stat['state'] != 'Z':
+                    alive += 1
+                    peak = max(peak, _read_peak_rss(pid))
+            with self.lock:
+                usage = self.jobs.get(job)
+                if usage is None:
+                    continue
+                # Exited descendants drop out of the tree - never go backwards
+                usage['cpu'] = max(usage['cpu'], cpu)
+                usage['peak_rss'] = max(usage['peak_rss'], rss, peak)
+                usage['processes'] = max(usage['processes'], alive)
+
+    def finish(self, job_id):
+        """
+        Take a last sample and stop watching a job. Returns its cpu_seconds,
+        peak_rss_bytes and processes (most alive at once), or None if the
+        job was not watched.
+        """
+        self.sample(job_id)
+        with self.lock:
+            usage = self.jobs.pop(job_id, None)
+        if usage is None:
+            return None
+        return {
+            'cpu_seconds': round(usage['cpu'] / self.tick, 3),
+            'peak_rss_bytes': usage['peak_rss'],
+            'processes': usage['processes']
+        }
+
+    def stats(self):
+        with self.lock:
+            return {'watched_jobs': len(self.jobs), 'interval': self.interval}
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Resource sampling failed: {str(e)}")
+
+
+def wait_exited(pid):
+    """
+    Wait until a child process has exited without reaping it, so its
+    totals can still be read from /proc
+    """
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:
+        pass  # Already reaped
+
+
+class OrphanReaper:
+    """
+    Reaps processes orphaned by finished or killed jobs.
+    The server registers as a child subreaper, so anything a job leaves
+    behind (background dev servers, builds) is re-parented to it instead of
+    init; every untracked child is then terminated and waited for.
+    """
+
+    def __init__(self, tracked_pids, interval=30, min_age=5, grace=10):
+        self.tracked_pids = tracked_pids  # Callable returning pids owned by running jobs
+        self.interval = interval
+        self.min_age = min_age  # Don't race a job that has just spawned its process
+        self.grace = grace
+        self.reaped = 0
+
+    def start(self):
+        if not self._enable_subreaper():
+            logger.warning("Child subreaper unavailable - orphaned processes go to init")
+        thread = Thread(target=self._loop, name='orphan-reaper', daemon=True)
+        thread.start()
+
+    def reap(self):
+        """Terminate and wait for orphaned children once; returns how many were reaped"""
+        tracked = set(self.tracked_pids())
+        own_pid = os.getpid()
+        reaped = 0
+        for pid in _children_by_parent().get(own_pid, []):
+            if pid in tracked:
+                continue
+            age = process_age(pid)
+            if age is None or age < self.min_age:
+                continue
+            if process_alive(pid):
+                logger.info(f"Terminating orphaned process {pid}")
+                terminate_process_tree(pid, self.grace)
+            try:
+                os.waitpid(pid, os.WNOHANG)
+                reaped += 1
+            except ChildProcessError:
+                pass
+        self.reaped += reaped
+        return reaped
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Orphan reaper failed: {str(e)}")
+
+    def _enable_subreaper(self):
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            return libc.prctl(36, 1, 0, 0, 0) == 0  # PR_SET_CHILD_SUBREAPER
+        except (OSError, AttributeError):
+            return False
+
+
+def run_as(user, command):
+    """
+    argv that runs a shell command as user through a login shell (su -),
+    or as the server's own user when user is empty
+    """
+    if user:
+        return ['su', '-', user, '-c', command]
+    return ['sh', '-c', command]
+
+
+class PooledProcess:
+    """
+    Popen-like handle for a claude process started by a pool worker.
+    The worker passes the process's pipes over its socket; the exit code
+    arrives on the same socket once the process exits.
+    """
+
+    def __init__(self, worker, pid, stdin, stdout, stderr):
+        self.worker = worker
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.lock = threading.Lock()  # Only one reader may wait on the worker socket
+
+    def poll(self):
+        if self.returncode is None and self.lock.acquire(blocking=False):
+            try:
+                if self.returncode is None:
+                    self._receive(blocking=False)
+            finally:
+                self.lock.release()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        with self.lock:
+            if self.returncode is None:
+                self._receive(blocking=True, timeout=timeout)
+        return self.returncode
+
+    def _receive(self, blocking, timeout=None):
+        sock = self.worker.sock
+        try:
+            sock.settimeout(timeout if blocking else 0)
+            data = sock.recv(4096)
+        except (BlockingIOError, socket.timeout):
+            return
+        except OSError:
+            data = b''
+        if data:
+            self.returncode = json.loads(data)['return_code']
+        else:
+            # Worker died with the job - it will not be reused
+            self.worker.dead = True
+            self.returncode = -1
+
+
+class RunnerWorker:
+    """A pre-spawned worker process and the server end of its socket"""
+
+    def __init__(self, command):
+        self.sock, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = subprocess.Popen(
+                command,
+                stdin=child.fileno(),
+                stdout=subprocess.DEVNULL,
+                start_new_session=True
+            )
+        finally:
+            child.close()
+        self.dead = False
+        self.runs = 0
+
+    def alive(self):
+        return not self.dead and self.process.poll() is None
+
+    def start_job(self, timeout=30):
+        """Ask the worker for its waiting claude process"""
+        self.sock.settimeout(timeout)
+        self.sock.send(b'run')
+        message, fds, _flags, _addr = socket.recv_fds(self.sock, 4096, 3)
+        if not message or len(fds) != 3:
+            for fd in fds:
+                os.close(fd)
+            self.dead = True
+            raise RuntimeError('Runner worker exited during handshake')
+        self.runs += 1
+        stdin, stdout, stderr = fds
+        return PooledProcess(
+            self, json.loads(message)['pid'],
+            os.fdopen(stdin, 'wb'), os.fdopen(stdout, 'rb'), os.fdopen(stderr, 'rb')
+        )
+
+    def stop(self):
+        self.sock.close()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            terminate_process_tree(self.process.pid, 1)
+            self.process.wait()
+
+
+class RunnerPool:
+    """
+    Pool of worker processes already running as the claude user, each with
+    a claude process started ahead of time. Jobs that can't get a worker
+    fall back to spawning su themselves.
+    """
+
+    def __init__(self, command, size):
+        self.command = command
+        self.size = size
+        self.idle = []
+        self.busy = set()
+        self.lock = threading.Lock()
+        self.spawned = 0
+        self.failures = 0
+
+    def start(self):
+        for _ in range(self.size):
+            self._add()
+        if self.size:
+            logger.info(f"Started {self.size} pre-spawned runner workers")
+
+    def acquire(self):
+        """Return a PooledProcess, or None if no healthy worker is free"""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                worker = self.idle.pop()
+                self.busy.add(worker)
+            if worker.alive():
+                try:
+                    return worker.start_job()
+                except (OSError, RuntimeError, ValueError) as e:
+                    logger.warning(f"Runner worker {worker.process.pid} failed: {str(e)}")
+            self._replace(worker)
+
+    def release(self, process):
+        """Return a finished job's worker to the pool"""
+        worker = process.worker
+        # An unread exit code would be mistaken for the next job's
+        if worker.alive() and process.returncode is not None:
+            with self.lock:
+                self.busy.discard(worker)
+                self.idle.append(worker)
+        else:
+            self._replace(worker)
+
+    def pids(self):
+        with self.lock:
+            return [worker.process.pid for worker in self.idle + list(self.busy)]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'busy': len(self.busy),
+                'spawned': self.spawned,
+                'failures': self.failures
+            }
+
+    def _add(self):
+        try:
+            worker = RunnerWorker(self.command)
+        except OSError as e:
+            logger.error(f"Could not start runner worker: {str(e)}")
+            return
+        with self.lock:
+            self.spawned += 1
+            self.idle.append(worker)
+
+    def _replace(self, worker):
+        with self.lock:
+            self.busy.discard(worker)
+            self.failures += 1
+        Thread(target=worker.stop, daemon=True).start()
+        if self.failures <= self.size * 10:
+            self._add()
+        else:
+            logger.error("Runner workers keep failing - not respawning")
+
+
+class Agent:
+    """A remote execution server that registered itself with this dispatcher"""
+
+    def __init__(self, name, url, capacity):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.capacity = capacity
+        self.active = 0  # Jobs this dispatcher is streaming from it
+        self.reported = {}  # Last load report: running_jobs, queue_depth, ...
+        self.last_seen = time.time()
+        self.dispatched = 0
+        self.failures = 0
+
+    def busy(self):
+        # Its own report also counts jobs that came from other clients
+        return max(self.active, self.reported.get('running_jobs', 0) + self.reported.get('queue_depth', 0))
+
+    def info(self):
+        return {
+            'name': self.name,
+            'url': self.url,
+            'capacity': self.capacity,
+            'active': self.active,
+            'dispatched': self.dispatched,
+            'failures': self.failures,
+            'last_seen': self.last_seen,
+            'reported': self.reported
+        }
+
+
+class AgentRegistry:
+    """
+    Worker agents known to a dispatcher, expired after ttl seconds without a
+    heartbeat. acquire() picks the least-loaded slot among the agents and
+    local_capacity jobs on this host; on_resize is called with the new
+    total capacity whenever it changes.
+    """
+
+    def __init__(self, local_capacity, ttl=30, on_resize=None):
+        self.local_capacity = local_capacity
+        self.local_active = 0
+        self.ttl = ttl
+        self.on_resize = on_resize
+        self.agents = {}
+        self.lock = threading.Lock()
+
+    def register(self, name, url, capacity, report=None):
+        """Add or refresh an agent from its heartbeat"""
+        with self.lock:
+            agent = self.agents.get(name)
+            if agent is None or agent.url != url.rstrip('/'):
+                agent = self.agents[name] = Agent(name, url, capacity)
+                logger.info(f"Agent {name} registered at {agent.url} with capacity {capacity}")
+            agent.capacity = capacity
+            agent.reported = report or {}
+            agent.last_seen = time.time()
+        self._resize()
+        return agent
+
+    def remove(self, name):
+        with self.lock:
+            agent = self.agents.pop(name, None)
+        if agent:
+            logger.info(f"Agent {name} removed")
+            self._resize()
+        return agent is not None
+
+    def acquire(self):
+        """
+        Reserve the least-loaded slot. Returns an Agent, None for this host,
+        or raises RuntimeError when neither has any capacity.
+        """
+        self.expire()
+        with self.lock:
+            candidates = [(self.local_active / self.local_capacity, -self.local_capacity, None)] \
+                if self.local_capacity else []
+            candidates += [
+                (agent.busy() / agent.capacity, -agent.capacity, agent)
+                for agent in self.agents.values() if agent.capacity > 0
+            ]
+            if not candidates:
+                raise RuntimeError('No worker agent available')
+            _, _, agent = min(candidates, key=lambda c: c[:2])
+            if agent is None:
+                self.local_active += 1
+            else:
+                agent.active += 1
+                agent.dispatched += 1
+            return agent
+
+    def release(self, agent, failed=False):
+        """Free a slot taken by acquire(); a failed agent is dropped until it checks in again"""
+        with self.lock:
+            if agent is None:
+                self.local_active -= 1
+                return
+            agent.active -= 1
+            if failed:
+                agent.failures += 1
+                if self.agents.get(agent.name) is agent:
+                    del self.agents[agent.name]
+                    logger.warning(f"Agent {agent.name} failed - removed until its next heartbeat")
+        if failed:
+            self._resize()
+
+    def expire(self):
+        """Drop agents whose heartbeat is overdue"""
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            expired = [name for name, agent in self.agents.items() if agent.last_seen < cutoff]
+            for name in expired:
+                del self.agents[name]
+        for name in expired:
+            logger.warning(f"Agent {name} missed its heartbeats - removed")
+        if expired:
+            self._resize()
+
+    def capacity(self):
+        with self.lock:
+            return self.local_capacity + sum(agent.capacity for agent in self.agents.values())
+
+    def stats(self):
+        with self.lock:
+            return {
+                'capacity': self.local_capacity + sum(a.capacity for a in self.agents.values()),
+                'local': {'capacity': self.local_capacity, 'active': self.local_active},
+                'agents': [agent.info() for agent in self.agents.values()]
+            }
+
+    def _resize(self):
+        if self.on_resize:
+            self.on_resize(self.capacity())
+
+
+class AgentHeartbeat(Thread):
+    """
+    Registers this server with a dispatcher and reports its load every
+    interval seconds, so the dispatcher can send it jobs
+    """
+
+    def __init__(self, dispatcher_url, name, url, capacity, report, token=None, interval=10):
+        super().__init__(name='agent-heartbeat', daemon=True)
+        self.endpoint = dispatcher_url.rstrip('/') + '/agents'
+        self.agent = {'name': name, 'url': url, 'capacity': capacity}
+        self.report = report
+        self.token = token
+        self.interval = interval
+        self.registered = False
+
+    def run(self):
+        while True:
+            try:
+                self.send()
+                if not self.registered:
+                    logger.info(f"Registered as agent {self.agent['name']} with {self.endpoint}")
+                    self.registered = True
+            except (OSError, ValueError) as e:
+                if self.registered:
+                    logger.warning(f"Dispatcher heartbeat failed: {str(e)}")
+                    self.registered = False
+            time.sleep(self.interval)
+
+    def send(self):
+        body = dict(self.agent, **self.report())
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['X-Agent-Token'] = self.token
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(body).encode(), headers=headers, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.interval) as response:
+            response.read()
+
+
+# Histogram buckets in seconds
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 900, 1800, 3600)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Histogram buckets in bytes (16 MiB to 8 GiB)
+MEMORY_BUCKETS = tuple(2 ** power for power in range(24, 34))
+
+
+class Histogram:
+    """Cumulative bucket counts plus sum and count of observed values"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Thread-safe counters, gauges and histograms rendered in the Prometheus
+    text exposition format
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = OrderedDict()  # name -> (type, help, buckets)
+        self.values = {}  # (name, labels) -> float or Histogram
+        self.gauges = {}  # name -> callable returning the current value
+
+    def counter(self, name, help_text):
+        self.meta[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.meta[name] = ('histogram', help_text, buckets)
+
+    def gauge(self, name, help_text, func):
+        self.meta[name] = ('gauge', help_text, None)
+        self.gauges[name] = func
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram(self.meta[name][2])
+            histogram.observe(value)
+
+    def render(self):
+        """Return all metrics as Prometheus text"""
+        lines = []
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: item[0])
+            snapshot = [
+                (key, (list(value.counts), value.sum, value.count) if isinstance(value, Histogram) else value)
+                for key, value in values
+            ]
+        for name, (kind, help_text, buckets) in self.meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'gauge':
+                try:
+                    lines.append(f'{name} {_format_value(self.gauges[name]())}')
+                except Exception as e:
+                    logger.error(f"Gauge {name} failed: {str(e)}")
+                continue
+            for (metric, labels), value in snapshot:
+                if metric != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                counts, total, count = value
+                for bound, bucket_count in zip(tuple(buckets) + (float('inf'),), counts):
+                    le = (('le', _format_value(bound)),)
+                    lines.append(f'{name}_bucket{_format_labels(labels + le)} {bucket_count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def job_metrics():
+    """Create a Metrics registry with the per-job series both servers record"""
+    metrics = Metrics()
+    metrics.histogram(
+        'claude_job_queue_wait_seconds', 'Time jobs spent queued before a worker picked them up',
+        DURATION_BUCKETS
+    )
+    metrics.histogram(
+        'claude_job_duration_seconds', 'Wall-clock time from spawn to exit of a job process',
+        DURATION_BUCKETS
+    )
+    metrics.histogram(
+        'claude_spawn_seconds', 'Time to start the su - clauderunner wrapper process'
+    )
+    metrics.histogram(
+        'claude_first_output_seconds', 'Time from spawn to the first byte of stdout or stderr'
+    )
+    metrics.counter('claude_output_bytes_total', 'Bytes read from job stdout and stderr')
+    metrics.counter('claude_job_exit_codes_total', 'Finished job processes by exit code')
+    metrics.counter('claude_jobs_dispatched_total', 'Jobs started per agent (local for this host)')
+    metrics.counter('claude_rate_limited_total', 'Requests rejected by a client rate limit, by client class')
+    metrics.histogram(
+        'claude_job_cpu_seconds', 'CPU time used by a job process tree', DURATION_BUCKETS
+    )
+    metrics.histogram(
+        'claude_job_peak_rss_bytes', 'Peak resident memory of a job process tree', MEMORY_BUCKETS
+    )
+    return metrics
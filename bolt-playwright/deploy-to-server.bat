@@ -35,6 +35,9 @@ plink -P %PORT% %USER%@%SERVER% "mkdir -p %REMOTE_DIR% /var/log/claude-server"
 echo.
 echo Step 2: Copying files to server...
 pscp -P %PORT% claude-execution-server.py %USER%@%SERVER%:%REMOTE_DIR%/
+pscp -P %PORT% claude_jobs.py %USER%@%SERVER%:%REMOTE_DIR%/
+pscp -P %PORT% claude-execution-server-async.py %USER%@%SERVER%:%REMOTE_DIR%/
+pscp -P %PORT% claude-runner-worker.py %USER%@%SERVER%:%REMOTE_DIR%/
 pscp -P %PORT% test-claude-server.py %USER%@%SERVER%:%REMOTE_DIR%/
 pscp -P %PORT% setup-server.sh %USER%@%SERVER%:%REMOTE_DIR%/
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Fake claude CLI for benchmarking the Claude Execution Server
+Reads the prompt from stdin like `claude --print` and prints lines at a
+configurable rate, so the server's concurrency can be measured without
+the real binary or network access.
+
+Settings come from FAKE_CLAUDE_<NAME> environment variables and can be
+overridden per request with name=value words in the prompt, e.g.
+"bench 17 lines=200 rate=100 bytes=120 startup=0.5"
+"""
+
+import os
+import sys
+import time
+
+DEFAULTS = {
+    'startup': 0.0,   # Seconds before the prompt is read (CLI start-up)
+    'lines': 10,      # stdout lines to print
+    'bytes': 80,      # Length of each line
+    'rate': 0.0,      # Lines per second (0 = as fast as possible)
+    'duration': 0.0,  # Spread the lines over this many seconds (overrides rate)
+    'stderr': 0,      # stderr lines printed at the end
+    'exit': 0         # Exit code
+}
+
+
+def load_settings(prompt):
+    """Defaults, then FAKE_CLAUDE_* variables, then name=value words in the prompt"""
+    settings = dict(DEFAULTS)
+    for name, default in DEFAULTS.items():
+        value = os.environ.get(f'FAKE_CLAUDE_{name.upper()}')
+        if value is not None:
+            settings[name] = type(default)(value)
+    for word in prompt.split():
+        name, _, value = word.partition('=')
+        if name in DEFAULTS and value:
+            try:
+                settings[name] = type(DEFAULTS[name])(value)
+            except ValueError:
+                pass
+    return settings
+
+
+def main():
+    startup = float(os.environ.get('FAKE_CLAUDE_STARTUP', 0))
+    if startup:
+        time.sleep(startup)
+
+    # --dangerously-skip-permissions --print [prompt]; without one it is on stdin
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    prompt = args[0] if args else sys.stdin.read()
+    settings = load_settings(prompt)
+    if settings['startup'] > startup:
+        time.sleep(settings['startup'] - startup)
+
+    lines = settings['lines']
+    if settings['duration'] and lines:
+        interval = settings['duration'] / lines
+    elif settings['rate']:
+        interval = 1 / settings['rate']
+    else:
+        interval = 0
+
+    started = time.monotonic()
+    for i in range(lines):
+        line = f'line {i} '
+        sys.stdout.write(line + 'x' * max(settings['bytes'] - len(line), 0) + '\n')
+        sys.stdout.flush()
+        if interval:
+            # Pace against the start time so slow writes don't add up
+            delay = started + (i + 1) * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    for i in range(settings['stderr']):
+        sys.stderr.write(f'warning {i}\n')
+    sys.exit(settings['exit'])
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,19 @@ Using the logged-in Chromium profile
 
 import os
 import sys
+import json
 import time
+import queue
+import logging
 import argparse
 import hashlib
+import threading
 from pathlib import Path
 from datetime import datetime
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from browser_pool import open_lease
+from bolt_preview import wait_for_preview
+from profile_manager import ProfileManager
 
 # Linux profile path - same as used in test-login-status.py
 PROFILE_DIR = Path('/git/buildyoursite/bolt-playwright/chromium-profile-linux')
@@ -44,12 +51,191 @@ def wait_for_page_stable(page, timeout=3000, check_interval=500):
     
     return False
 
-def generate_bolt_site(prompt, headless=True, output_dir="output"):
+def make_output_folder(output_dir, suffix=None):
+    """Create and return the timestamped download folder for one site"""
+    output_path = Path(output_dir)
+    output_path.mkdir(exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    subfolder_name = f"bolt_{timestamp}" if suffix is None else f"bolt_{timestamp}_{suffix}"
+    downloads_path = output_path / subfolder_name
+    downloads_path.mkdir(exist_ok=True)
+    return downloads_path.absolute()
+
+def open_browser(p, headless=True, profile_dir=PROFILE_DIR, downloads_path=None, no_pool=False):
+    """
+    Lease a warm page from the browser pool when it is running (the profile
+    can't be opened twice); otherwise launch Chromium on the profile
+
+    Returns:
+        tuple: (browser, page) - closing browser closes Chromium or releases the lease
+
+    Raises:
+        PoolUnavailable: The pool is running but had no page for us in time
+    """
+    lease = None if no_pool else open_lease(p, owner='generate-bolt-linux')
+    if lease:
+        print(f"Using a warm page from the browser pool (lease {lease.id})")
+        return lease, lease.page
+    
+    print("Launching Chromium with persistent profile...")
+    options = {}
+    if downloads_path:
+        options['downloads_path'] = str(downloads_path)
+    browser = p.chromium.launch_persistent_context(
+        user_data_dir=str(profile_dir),
+        headless=headless,
+        args=[
+            '--no-sandbox',
+            '--disable-setuid-sandbox',
+            '--disable-blink-features=AutomationControlled',
+            '--disable-background-timer-throttling',
+            '--disable-renderer-backgrounding',
+            '--disable-features=TranslateUI',
+        ],
+        ignore_https_errors=True,
+        timeout=60000,
+        accept_downloads=True,
+        viewport={'width': 1920, 'height': 1080},
+        **options
+    )
+    
+    # Get or create page
+    pages = browser.pages
+    if pages:
+        page = pages[0]
+    else:
+        page = browser.new_page()
+    return browser, page
+
+def export_site(page, prompt, downloads_path):
+    """
+    Generate a site in bolt.new on an open page and download its export
+
+    Returns:
+        Path: The downloaded zip file; raises on failure
+    """
     #prompt = f"Prompt: {'Important instruction: Make the website extremely modern, visually stunning, and professional. Use clean responsive layouts, harmonious color palettes, consistent typography, and high-quality open-license images. Every section should have a relevant photo that perfectly matches the theme. Ensure it looks like a premium, award-winning site designed by top web designers. Create a website for the following:' + prompt}"
     #prompt = f"Prompt: Important instruction: Make the website extremely modern, visually stunning, and professional. Use clean responsive layouts, harmonious color palettes, consistent typography, and high-quality open-license images. Every major section or service card (e.g., like 'Unsere Leistungen' with icons or short descriptions) must include a relevant image or icon that visually represents the topic. Ensure that visuals are consistent in style and color tone across all sections, enhancing the design rather than cluttering it. Create a website for the following: {prompt}"
     prompt = f"Prompt: Important instruction: Make the website extremely modern, visually stunning, and professional with clean responsive layouts, harmonious color palettes, consistent typography, and high-quality photorealistic images. Every major section or service card (e.g., 'Unsere Leistungen') must include a relevant, photorealistic image that looks like professional photography - use realistic lighting, natural textures, and lifelike details. All images should maintain consistent photorealistic quality and style throughout. Place the company logo only in the header (not repeated elsewhere), and in the footer include the company name as part of the contact information instead of the logo. Instruct nanobanana to generate photorealistic images with professional photography quality, natural lighting, and realistic textures. Create a website for the following: {prompt}"
 
+    # Navigate to bolt.new
+    print("Step 1: Navigating to bolt.new...")
+    page.goto("https://bolt.new", wait_until="domcontentloaded", timeout=60000)
+    
+    # Wait for page to stabilize
+    print("Step 2: Waiting for page to stabilize...")
+    wait_for_page_stable(page)
+    
+    # Check for "Not now" popup
+    try:
+        if page.locator('button:has-text("Not now")').is_visible():
+            print("  - Dismissing popup...")
+            page.locator('button:has-text("Not now")').click()
+            wait_for_page_stable(page)
+    except:
+        pass  # No popup, continue
+    
+    # Enter the prompt
+    print("Step 3: Entering prompt...")
+    textarea = page.locator('textarea')
+    textarea.click()
+    textarea.fill(prompt)
+    
+    # Submit the prompt
+    print("Step 4: Submitting prompt...")
+    textarea.press("Enter")
+    
+    # Use smart wait for page to stabilize after submission
+    print("Step 5: Waiting for page to stabilize and checking for dialogs...")
+    wait_for_page_stable(page)
+    
+    # Check for "Not now" popup that can appear after prompt submission
+    try:
+        if page.locator('button:has-text("Not now")').is_visible():
+            print("  - Dismissing 'Not now' popup...")
+            page.locator('button:has-text("Not now")').click()
+            wait_for_page_stable(page)
+    except:
+        pass
+    
+    # Wait for generation to complete
+    print("Step 6: Waiting for AI to generate the site and preview to load...")
+    
+    # Returns as soon as the preview replaces its placeholder
+    print("  - Waiting for preview to load...")
+    seconds_waited = wait_for_preview(
+        page,
+        on_progress=lambda elapsed: print(f"    Still waiting for preview... ({elapsed:.0f}s elapsed)")
+    )
+    print(f"  - Preview loaded after {seconds_waited:.0f} seconds total!")
+    
+    # Final stabilization wait
+    print("  - Waiting for page to stabilize...")
+    wait_for_page_stable(page, timeout=5000)
+    
+    # Open project dropdown menu
+    print("Step 7: Opening project menu...")
+    # Try to find the project name button in the header
+    project_buttons = page.locator('header button').all_text_contents()
+    project_name = None
+    for btn_text in project_buttons:
+        if btn_text and btn_text not in ['View history', '', 'Integrations', 'Publish']:
+            project_name = btn_text
+            break
+    
+    if project_name:
+        print(f"  - Found project: {project_name}")
+        # Use first visible button with the project name to avoid duplicates
+        page.locator(f'button:has-text("{project_name}"):visible').first.click()
+    else:
+        # Fallback: try clicking the second button in header
+        print("  - Using fallback method to open dropdown...")
+        page.locator('header button').nth(1).click()
+    
+    wait_for_page_stable(page)
+    
+    # Click Export option
+    print("Step 8: Clicking Export option...")
+    page.locator('[role="menuitem"]:has-text("Export")').click()
+    wait_for_page_stable(page)
+    
+    # Click Download button and wait for download
+    print("Step 9: Starting download...")
+    
+    # Get project name for filename
+    project_name = "bolt_project"
+    try:
+        project_buttons = page.locator('header button').all_text_contents()
+        for btn_text in project_buttons:
+            if btn_text and btn_text not in ['View history', '', 'Integrations', 'Publish']:
+                project_name = btn_text.replace(' ', '_').replace('/', '-')
+                break
+    except:
+        pass
+    
+    # Start waiting for download before clicking
+    with page.expect_download() as download_info:
+        # Updated selector to match the new div element structure
+        page.locator('div[role="menuitem"]:has-text("Download")').click()
+        print("  - Download button clicked, waiting for file...")
+    
+    # Get the download object
+    download = download_info.value
+    
+    # Generate filename with timestamp
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{project_name}_{timestamp}.zip"
+    save_path = downloads_path / filename
+    
+    # Save the download
+    print(f"Step 10: Saving download as {filename}...")
+    download.save_as(str(save_path))
+    
+    print(f"  - File saved to: {save_path}")
+
+    return save_path
 
+def generate_bolt_site(prompt, headless=True, output_dir="output", no_pool=False, profile_dir=PROFILE_DIR):
     """
     Generate and export a bolt.new site with the given prompt
 
@@ -57,206 +243,189 @@ def generate_bolt_site(prompt, headless=True, output_dir="output"):
         prompt: The prompt to use for site generation
         headless: Whether to run in headless mode (default: True)
         output_dir: Directory to save downloads (default: "output")
+        no_pool: Launch Chromium even if the browser pool is running
+        profile_dir: Chromium profile to launch with (default: PROFILE_DIR)
 
     Returns:
         tuple: (success: bool, folder_path: str) - True if successful and the output folder path
     """
-
-    # Create output directory if it doesn't exist
-    output_path = Path(output_dir)
-    output_path.mkdir(exist_ok=True)
-
-    # Create timestamped subfolder
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    subfolder_name = f"bolt_{timestamp}"
-    downloads_path = output_path / subfolder_name
-    downloads_path.mkdir(exist_ok=True)
-    downloads_path = downloads_path.absolute()
+    downloads_path = make_output_folder(output_dir)
     
     with sync_playwright() as p:
         print(f"\n{'='*60}")
         print(f"Starting bolt.new site generation")
         print(f"Prompt: {prompt}")
-        print(f"Using profile: {PROFILE_DIR}")
+        print(f"Using profile: {profile_dir}")
         print(f"{'='*60}\n")
         
+        browser = None
         try:
-            # Launch browser with persistent context
-            print("Launching Chromium with persistent profile...")
+            browser, page = open_browser(p, headless, profile_dir, downloads_path, no_pool)
             print(f"Downloads will be saved to: {downloads_path}")
-            browser = p.chromium.launch_persistent_context(
-                user_data_dir=str(PROFILE_DIR),
-                headless=headless,
-                args=[
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-background-timer-throttling',
-                    '--disable-renderer-backgrounding',
-                    '--disable-features=TranslateUI',
-                ],
-                ignore_https_errors=True,
-                timeout=60000,
-                accept_downloads=True,
-                downloads_path=str(downloads_path),
-                viewport={'width': 1920, 'height': 1080}
-            )
-            
-            # Get or create page
-            pages = browser.pages
-            if pages:
-                page = pages[0]
-            else:
-                page = browser.new_page()
-            
-            # Navigate to bolt.new
-            print("Step 1: Navigating to bolt.new...")
-            page.goto("https://bolt.new", wait_until="domcontentloaded", timeout=60000)
-            
-            # Wait for page to stabilize
-            print("Step 2: Waiting for page to stabilize...")
-            wait_for_page_stable(page)
-            
-            # Check for "Not now" popup
-            try:
-                if page.locator('button:has-text("Not now")').is_visible():
-                    print("  - Dismissing popup...")
-                    page.locator('button:has-text("Not now")').click()
-                    wait_for_page_stable(page)
-            except:
-                pass  # No popup, continue
-            
-            # Enter the prompt
-            print("Step 3: Entering prompt...")
-            textarea = page.locator('textarea')
-            textarea.click()
-            textarea.fill(prompt)
-            
-            # Submit the prompt
-            print("Step 4: Submitting prompt...")
-            textarea.press("Enter")
-            
-            # Use smart wait for page to stabilize after submission
-            print("Step 5: Waiting for page to stabilize and checking for dialogs...")
-            wait_for_page_stable(page)
-            
-            # Check for "Not now" popup that can appear after prompt submission
-            try:
-                if page.locator('button:has-text("Not now")').is_visible():
-                    print("  - Dismissing 'Not now' popup...")
-                    page.locator('button:has-text("Not now")').click()
-                    wait_for_page_stable(page)
-            except:
-                pass
-            
-            # Wait for generation to complete
-            print("Step 6: Waiting for AI to generate the site and preview to load...")
-            
-            # First wait for basic generation (at least 15 seconds)
-            print("  - Initial generation phase...")
-            page.wait_for_timeout(15000)
-            
-            # Now wait until "Your preview will appear here" disappears - no timeout, wait as long as needed
-            print("  - Waiting for preview to load...")
-            seconds_waited = 15
-            
-            while True:
-                # Check if the preview placeholder text element still EXISTS in the DOM
-                preview_placeholder = page.locator('div:has-text("Your preview will appear here")')
-                element_count = preview_placeholder.count()
-                
-                if element_count > 0:
-                    # Element still exists, preview not ready yet
-                    if seconds_waited % 10 == 0:
-                        print(f"    Still waiting for preview... ({seconds_waited}s elapsed)")
-                    page.wait_for_timeout(1000)
-                    seconds_waited += 1
-                else:
-                    # Element doesn't exist anymore, preview is loaded!
-                    print(f"  - Preview loaded after {seconds_waited} seconds total!")
-                    break
-            
-            # Final stabilization wait
-            print("  - Waiting for page to stabilize...")
-            wait_for_page_stable(page, timeout=5000)
-            
-            # Open project dropdown menu
-            print("Step 7: Opening project menu...")
-            # Try to find the project name button in the header
-            project_buttons = page.locator('header button').all_text_contents()
-            project_name = None
-            for btn_text in project_buttons:
-                if btn_text and btn_text not in ['View history', '', 'Integrations', 'Publish']:
-                    project_name = btn_text
-                    break
-            
-            if project_name:
-                print(f"  - Found project: {project_name}")
-                # Use first visible button with the project name to avoid duplicates
-                page.locator(f'button:has-text("{project_name}"):visible').first.click()
-            else:
-                # Fallback: try clicking the second button in header
-                print("  - Using fallback method to open dropdown...")
-                page.locator('header button').nth(1).click()
-            
-            wait_for_page_stable(page)
-            
-            # Click Export option
-            print("Step 8: Clicking Export option...")
-            page.locator('[role="menuitem"]:has-text("Export")').click()
-            wait_for_page_stable(page)
-            
-            # Click Download button and wait for download
-            print("Step 9: Starting download...")
-            
-            # Get project name for filename
-            project_name = "bolt_project"
-            try:
-                project_buttons = page.locator('header button').all_text_contents()
-                for btn_text in project_buttons:
-                    if btn_text and btn_text not in ['View history', '', 'Integrations', 'Publish']:
-                        project_name = btn_text.replace(' ', '_').replace('/', '-')
-                        break
-            except:
-                pass
-            
-            # Start waiting for download before clicking
-            with page.expect_download() as download_info:
-                # Updated selector to match the new div element structure
-                page.locator('div[role="menuitem"]:has-text("Download")').click()
-                print("  - Download button clicked, waiting for file...")
-            
-            # Get the download object
-            download = download_info.value
-            
-            # Generate filename with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{project_name}_{timestamp}.zip"
-            save_path = downloads_path / filename
-            
-            # Save the download
-            print(f"Step 10: Saving download as {filename}...")
-            download.save_as(str(save_path))
-            
-            print(f"  - File saved to: {save_path}")
+            export_site(page, prompt, downloads_path)
 
             print("\n[SUCCESS] Site generated and exported.")
             print(f"Output folder: {downloads_path}")
             print(f"{'='*60}\n")
-
-            # Close browser
-            browser.close()
             return True, str(downloads_path)
             
         except PlaywrightTimeoutError as e:
             print(f"\n[ERROR] Timeout error: {str(e)}")
-            browser.close()
             return False, None
 
         except Exception as e:
             print(f"\n[ERROR] Error: {str(e)}")
-            browser.close()
             return False, None
+        
+        finally:
+            # Close browser
+            if browser:
+                browser.close()
+
+def read_prompts(source):
+    """
+    Read batch prompts from a file, or stdin for '-'. Each non-empty line is
+    a prompt, or a JSON object with "prompt" and an optional "id" (JSONL).
+    A line that only looks like JSON is taken as a plain prompt. Lines
+    starting with # are skipped.
+
+    Returns:
+        list: {"id", "prompt"} per prompt, in input order
+    """
+    handle = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        items = []
+        for number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            record = None
+            if line.startswith('{'):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    pass
+            if isinstance(record, dict):
+                if not str(record.get('prompt') or '').strip():
+                    raise ValueError(f"{source} line {number}: missing \"prompt\"")
+                items.append({'id': str(record.get('id', len(items) + 1)), 'prompt': record['prompt']})
+            else:
+                items.append({'id': str(len(items) + 1), 'prompt': line})
+        return items
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+class Manifest:
+    """JSON Lines record of a batch, one line per prompt as it finishes"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        # Start empty; every line is flushed so a crashed batch keeps what it finished
+        open(self.path, 'w').close()
+
+    def add(self, result):
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result) + "\n")
+
+def run_batch(items, headless=True, output_dir="output", manifest=None, no_pool=False, profile_dir=PROFILE_DIR):
+    """
+    Generate a site for each (index, item) in items, reusing one browser.
+    A failed prompt is recorded and the batch moves on; the browser is
+    reopened if it died.
+
+    Returns:
+        list: Result dict per prompt (also written to the manifest)
+    """
+    results = []
+    with sync_playwright() as p:
+        browser = page = None
+        try:
+            for index, item in items:
+                print(f"\n{'='*60}")
+                print(f"Batch prompt {index + 1} ({item['id']}): {item['prompt']}")
+                print(f"{'='*60}\n")
+                started = time.time()
+                result = {
+                    'index': index,
+                    'id': item['id'],
+                    'prompt': item['prompt'],
+                    'started': datetime.now().isoformat(),
+                }
+                try:
+                    if page is None or page.is_closed():
+                        if browser:
+                            browser.close()
+                        browser, page = open_browser(p, headless, profile_dir, no_pool=no_pool)
+                    downloads_path = make_output_folder(output_dir, f"{index + 1:03d}")
+                    save_path = export_site(page, item['prompt'], downloads_path)
+                    result.update(status='success', folder=str(downloads_path), file=str(save_path))
+                    print(f"\n[SUCCESS] Site saved in: {downloads_path}")
+                except Exception as e:
+                    result.update(status='failed', error=f"{type(e).__name__}: {str(e)}")
+                    print(f"\n[ERROR] Prompt {index + 1} failed: {str(e)}")
+                    try:
+                        page.is_closed()
+                    except Exception:
+                        page = None
+                result['seconds'] = round(time.time() - started, 1)
+                results.append(result)
+                if manifest:
+                    manifest.add(result)
+        finally:
+            if browser:
+                try:
+                    browser.close()
+                except Exception:
+                    pass
+    return results
+
+def run_workers(items, workers, headless=True, output_dir="output", manifest=None):
+    """
+    Run a batch up to workers prompts at a time. Every worker keeps one
+    Chromium on its own clone of the logged-in profile, since Chromium
+    locks a profile to one browser.
+
+    Returns:
+        list: Result dict per prompt, in the order they finished
+    """
+    profiles = ProfileManager(PROFILE_DIR)
+    pending = queue.Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+    results = []
+
+    def take():
+        while True:
+            try:
+                yield pending.get_nowait()
+            except queue.Empty:
+                return
+
+    def work(number):
+        try:
+            clone = profiles.checkout(f"worker-{number}")
+        except Exception as e:
+            print(f"\n[ERROR] Worker {number} could not prepare its profile: {str(e)}")
+            return
+        try:
+            results.extend(run_batch(take(), headless, output_dir, manifest, no_pool=True, profile_dir=clone))
+        finally:
+            # Share a session bolt.new refreshed during the batch with the other workers
+            profiles.checkin(clone)
+
+    threads = [
+        threading.Thread(target=work, args=(number,), name=f"worker-{number}")
+        for number in range(1, min(workers, len(items)) + 1)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
 
 def main():
     """Main entry point"""
@@ -268,14 +437,17 @@ Examples:
   %(prog)s                                    # Use default prompt (Tic-Tac-Toe game)
   %(prog)s "Create a todo list app"          # Custom prompt
   %(prog)s --headless "Build a calculator"   # Run in headless mode
+  %(prog)s --workers 3 "Site A" "Site B" "Site C"  # Three sites in parallel
+  %(prog)s --batch prompts.jsonl --manifest out.jsonl  # Many prompts, one browser
+  cat prompts.txt | %(prog)s --batch -        # Prompts from stdin, one per line
         """
     )
     
     parser.add_argument(
         'prompt',
-        nargs='?',
-        default="Build a tic-tac-toe game with React",
-        help='The prompt for site generation (default: "Build a tic-tac-toe game with React")'
+        nargs='*',
+        default=["Build a tic-tac-toe game with React"],
+        help='The prompt(s) for site generation (default: "Build a tic-tac-toe game with React")'
     )
     
     parser.add_argument(
@@ -290,15 +462,68 @@ Examples:
         help='Output directory for downloads (default: "output")'
     )
     
+    parser.add_argument(
+        '--no-pool',
+        action='store_true',
+        help="Launch Chromium instead of leasing a page from browser_pool.py's daemon"
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Generate this many sites in parallel, each worker on its own profile clone (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--batch',
+        metavar='FILE',
+        help='Read prompts from FILE ("-" for stdin): one per line, or JSON lines with "prompt" and "id"'
+    )
+    
+    parser.add_argument(
+        '--manifest',
+        help='JSON Lines file with one result per prompt (default: <output>/manifest_<timestamp>.jsonl)'
+    )
+    
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
     
     # Print banner
     print("\n" + "="*60)
     print("Bolt.new Site Generator (Linux)")
     print("="*60)
     
+    if args.batch or args.workers > 1 or len(args.prompt) > 1:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        try:
+            if args.batch:
+                items = read_prompts(args.batch)
+            else:
+                items = [{'id': str(number), 'prompt': prompt} for number, prompt in enumerate(args.prompt, 1)]
+        except (OSError, ValueError) as e:
+            print(f"\n[ERROR] Could not read prompts: {str(e)}")
+            sys.exit(2)
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        manifest = Manifest(args.manifest or Path(args.output) / f"manifest_{timestamp}.jsonl")
+        print(f"{len(items)} prompt(s), results in {manifest.path}")
+        
+        if args.workers > 1:
+            results = run_workers(items, args.workers, args.headless, args.output, manifest)
+        else:
+            results = run_batch(enumerate(items), args.headless, args.output, manifest, args.no_pool)
+        
+        for result in sorted(results, key=lambda result: result['index']):
+            if result['status'] == 'success':
+                print(f"\nGenerated site saved in: {result['folder']}")
+        succeeded = sum(1 for result in results if result['status'] == 'success')
+        print(f"\n{succeeded}/{len(items)} sites generated, manifest: {manifest.path}")
+        sys.exit(0 if succeeded == len(items) else 1)
+    
     # Generate the site
-    success, folder_path = generate_bolt_site(args.prompt, args.headless, args.output)
+    success, folder_path = generate_bolt_site(args.prompt[0], args.headless, args.output, args.no_pool)
 
     if success:
         print(f"\nGenerated site saved in: {folder_path}")
@@ -13,6 +13,8 @@ import hashlib
 from pathlib import Path
 from datetime import datetime
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from browser_pool import open_lease
+from bolt_preview import wait_for_preview
 
 # Profile paths for persistent session
 CHROME_USER_DATA = r"C:\Users\info\AppData\Local\Google\Chrome\User Data"
@@ -77,7 +79,7 @@ def setup_persistent_profile():
     else:
         print("[OK] Using existing Chromium profile")
 
-def generate_bolt_site(prompt, headless=False, output_dir="output"):
+def generate_bolt_site(prompt, headless=False, output_dir="output", use_pool=False):
     """
     Generate and export a bolt.new site with the given prompt
 
@@ -85,12 +87,14 @@ def generate_bolt_site(prompt, headless=False, output_dir="output"):
         prompt: The prompt to use for site generation
         headless: Whether to run in headless mode (default: False)
         output_dir: Directory to save downloads (default: "output")
+        use_pool: Lease a page from browser_pool.py's daemon instead of launching Chromium
 
     Returns:
         tuple: (success: bool, folder_path: str) - True if successful and the output folder path
     """
-    # Setup persistent profile for authentication
-    setup_persistent_profile()
+    # Setup persistent profile for authentication (the pool brings its own)
+    if not use_pool:
+        setup_persistent_profile()
 
     # Create output directory if it doesn't exist
     output_path = Path(output_dir)
@@ -110,35 +114,42 @@ def generate_bolt_site(prompt, headless=False, output_dir="output"):
         print(f"{'='*60}\n")
         
         try:
-            # Launch browser with persistent context
-            print("Launching Chromium with persistent profile...")
-            print(f"Downloads will be saved to: {downloads_path}")
-            browser = p.chromium.launch_persistent_context(
-                user_data_dir=CHROMIUM_USER_DATA,
-                headless=headless,
-                args=[
-                    '--disable-blink-features=AutomationControlled',
-                    '--start-maximized',
-                    '--enable-features=SyncDisabled',
-                    '--disable-background-timer-throttling',
-                    '--disable-renderer-backgrounding',
-                    '--disable-features=TranslateUI',
-                    '--password-store=basic',
-                    '--ignore-certificate-errors'
-                ],
-                ignore_https_errors=True,
-                timeout=60000,
-                accept_downloads=True,
-                downloads_path=str(downloads_path),
-                viewport={'width': 1920, 'height': 1080}
-            )
-            
-            # Get or create page
-            pages = browser.pages
-            if pages:
-                page = pages[0]
+            lease = open_lease(p, owner='generate-bolt-site') if use_pool else None
+            if lease:
+                print(f"Using a warm page from the browser pool (lease {lease.id})")
+                print(f"Downloads will be saved to: {downloads_path}")
+                # Closing the lease releases the page; the pool's browser keeps running
+                browser, page = lease, lease.page
             else:
-                page = browser.new_page()
+                # Launch browser with persistent context
+                print("Launching Chromium with persistent profile...")
+                print(f"Downloads will be saved to: {downloads_path}")
+                browser = p.chromium.launch_persistent_context(
+                    user_data_dir=CHROMIUM_USER_DATA,
+                    headless=headless,
+                    args=[
+                        '--disable-blink-features=AutomationControlled',
+                        '--start-maximized',
+                        '--enable-features=SyncDisabled',
+                        '--disable-background-timer-throttling',
+                        '--disable-renderer-backgrounding',
+                        '--disable-features=TranslateUI',
+                        '--password-store=basic',
+                        '--ignore-certificate-errors'
+                    ],
+                    ignore_https_errors=True,
+                    timeout=60000,
+                    accept_downloads=True,
+                    downloads_path=str(downloads_path),
+                    viewport={'width': 1920, 'height': 1080}
+                )
+            
+                # Get or create page
+                pages = browser.pages
+                if pages:
+                    page = pages[0]
+                else:
+                    page = browser.new_page()
             
             # Navigate to bolt.new
             print("Step 1: Navigating to bolt.new...")
@@ -216,29 +227,13 @@ def generate_bolt_site(prompt, headless=False, output_dir="output"):
             # Wait for generation to complete
             print("Step 6: Waiting for AI to generate the site and preview to load...")
             
-            # First wait for basic generation (at least 15 seconds)
-            print("  - Initial generation phase...")
-            page.wait_for_timeout(15000)
-            
-            # Now wait until "Your preview will appear here" disappears - no timeout, wait as long as needed
+            # Returns as soon as the preview replaces its placeholder
             print("  - Waiting for preview to load...")
-            seconds_waited = 15
-            
-            while True:
-                # Check if the preview placeholder text element still EXISTS in the DOM
-                preview_placeholder = page.locator('div:has-text("Your preview will appear here")')
-                element_count = preview_placeholder.count()
-                
-                if element_count > 0:
-                    # Element still exists, preview not ready yet
-                    if seconds_waited % 10 == 0:
-                        print(f"    Still waiting for preview... ({seconds_waited}s elapsed)")
-                    page.wait_for_timeout(1000)
-                    seconds_waited += 1
-                else:
-                    # Element doesn't exist anymore, preview is loaded!
-                    print(f"  - Preview loaded after {seconds_waited} seconds total!")
-                    break
+            seconds_waited = wait_for_preview(
+                page,
+                on_progress=lambda elapsed: print(f"    Still waiting for preview... ({elapsed:.0f}s elapsed)")
+            )
+            print(f"  - Preview loaded after {seconds_waited:.0f} seconds total!")
             
             # Final stabilization wait
             print("  - Waiting for page to stabilize...")
@@ -371,6 +366,12 @@ Examples:
         help='Output directory for downloads (default: "output")'
     )
     
+    parser.add_argument(
+        '--pool',
+        action='store_true',
+        help="Lease a warm page from browser_pool.py's daemon instead of launching Chromium"
+    )
+    
     args = parser.parse_args()
     
     # Print banner
@@ -379,7 +380,7 @@ Examples:
     print("="*60)
     
     # Generate the site
-    success, folder_path = generate_bolt_site(args.prompt, args.headless, args.output)
+    success, folder_path = generate_bolt_site(args.prompt, args.headless, args.output, args.pool)
 
     if success:
         print(f"\nGenerated site saved in: {folder_path}")
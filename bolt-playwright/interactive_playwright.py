@@ -148,7 +148,7 @@ class InteractivePlaywright(PlaywrightTestBase):
                 self.log_output(f"Screenshot saved: {filename}")
                 
             elif command == "wait()" or command == "wait_for_stable()":
-                # Use hash-based waiting
+                # Wait until the page has gone quiet
                 self.wait_for_stable()
                 self.log_output("Page stabilized")
                 
@@ -242,6 +242,8 @@ class InteractivePlaywright(PlaywrightTestBase):
                     
                     self.page = self.context.new_page()
                 
+                self._install_settle_tracker()
+                
                 # Take initial screenshot
                 initial_screenshot = self.screenshot("initial", "Session started")
                 self.log_output(f"Initial screenshot: {initial_screenshot}")
@@ -3,24 +3,249 @@ Base class for Playwright tests with automatic logging, screenshots, and HTML re
 This can be imported and reused by all test cases for consistent logging and reporting
 """
 
+import hashlib
+import html
+import io
+import itertools
 import json
+import math
+import queue
+import threading
 import time
 import os
 import sys
-import hashlib
 from datetime import datetime
 from pathlib import Path
 from playwright.sync_api import sync_playwright, Page, Browser, BrowserContext
+from playwright.sync_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
 import traceback
 from typing import Any, Optional, Dict, List
 from dotenv import load_dotenv
 
+try:
+    from PIL import Image  # Optional: WebP screenshots and perceptual deduplication
+except ImportError:
+    Image = None
+
 # Enable Unicode output on Windows
 if sys.platform == 'win32':
-    import io
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
+# In-page tracker of DOM mutations and fetch/XHR/resource activity. It is
+# installed once per document (as an init script, or on first use) and
+# keeps the time since which the page has been quiet, so waiting for a
+# page to settle never has to serialize the DOM.
+SETTLE_TRACKER_JS = """
+() => {
+    if (window.__pwSettle) return;
+    const settle = window.__pwSettle = {lastActivity: performance.now(), pending: new Map(), nextId: 0, waits: {}};
+    const touch = () => { settle.lastActivity = performance.now(); };
+    new MutationObserver(touch).observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+    const begin = () => { const id = settle.nextId++; settle.pending.set(id, performance.now()); touch(); return id; };
+    const end = (id) => { settle.pending.delete(id); touch(); };
+    const fetch = window.fetch;
+    if (fetch) {
+        window.fetch = function (...args) {
+            const id = begin();
+            return fetch.apply(this, args).finally(() => end(id));
+        };
+    }
+    const send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+        const id = begin();
+        this.addEventListener('loadend', () => end(id));
+        return send.apply(this, args);
+    };
+    // Images, scripts and styles loaded by the parser
+    try { new PerformanceObserver(touch).observe({type: 'resource'}); } catch (e) {}
+    // Requests open longer than longRequestMs (streams, long polling) don't keep the page busy
+    settle.quietSince = (longRequestMs) => {
+        const now = performance.now();
+        for (const started of settle.pending.values()) {
+            if (now - started < longRequestMs) return null;
+        }
+        return settle.lastActivity;
+    };
+}
+"""
+
+# wait_for_function predicate: true once the page has been quiet for quietMs
+# since the later of its last activity and the start of this wait
+PAGE_SETTLED_JS = f"""
+({{token, quietMs, longRequestMs}}) => {{
+    ({SETTLE_TRACKER_JS})();
+    const settle = window.__pwSettle;
+    const now = performance.now();
+    if (!(token in settle.waits)) settle.waits = {{[token]: now}};
+    const since = settle.quietSince(longRequestMs);
+    return since !== null && now - Math.max(since, settle.waits[token]) >= quietMs;
+}}
+"""
+
+# Closes the HTML report after the last step
+REPORT_FOOTER_HTML = """
+    <div id="imageModal" class="modal" onclick="closeModal()">
+        <span class="close">&times;</span>
+        <img class="modal-content" id="modalImage">
+    </div>
+    
+    <script>
+        function openModal(src) {
+            var modal = document.getElementById('imageModal');
+            var modalImg = document.getElementById('modalImage');
+            modal.style.display = "block";
+            modalImg.src = src;
+        }
+        
+        function closeModal() {
+            document.getElementById('imageModal').style.display = "none";
+        }
+    </script>
+</body>
+</html>
+"""
+
+# Screenshot modes (SCREENSHOT_MODE): every-N takes one every N steps, e.g. every-5.
+# Every mode but none also captures the page when a step fails.
+SCREENSHOT_MODES = ('none', 'on-error', 'after-only', 'every-N', 'on-change')
+
+# Steps that never change the page, so only a failure is worth a screenshot
+PASSIVE_METHODS = ('count', 'screenshot')
+
+# Marker of the page's state for on-change mode: document, URL and last DOM/network activity
+PAGE_STATE_JS = """
+() => [location.href, performance.timeOrigin, window.__pwSettle ? window.__pwSettle.lastActivity : null]
+"""
+
+
+class ScreenshotWriter:
+    """
+    Background thread that deduplicates, encodes and writes screenshots, so
+    a step only waits for the capture itself. PNG and JPEG arrive encoded
+    by the browser; WebP is converted from PNG with Pillow.
+    A screenshot that duplicates an earlier one is not written; aliases maps
+    its filename to the earlier file. dedup is 'exact' (identical image
+    data), 'perceptual' (perceptual hashes at most dedup_distance bits
+    apart, needs Pillow) or 'off'.
+    With Pillow, a JPEG thumbnail thumbnail_width pixels wide is written to
+    thumbs/ next to every stored screenshot for the report's step list.
+    """
+    
+    def __init__(self, dedup: str = 'exact', dedup_distance: int = 0, hash_size: int = 16,
+                 recent: int = 50, thumbnail_width: int = 480):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.thumbnail_width = thumbnail_width if Image else 0
+        self.thumbnails = set()  # Stored screenshots that have a thumbnail
+        self.dedup = dedup
+        self.dedup_distance = dedup_distance
+        self.hash_size = hash_size
+        self.recent = recent  # Near matches are only searched among the latest screenshots
+        self.lock = threading.Lock()
+        self.aliases: Dict[str, str] = {}  # Duplicate filename -> stored filename
+        self.hashes: Dict[Any, str] = {}  # Hash -> stored filename
+        self.latest: List[Any] = []
+        self.stored = 0
+        
+    def submit(self, path: Path, data: bytes, image_format: str = 'png', quality: int = 80):
+        """Queue a captured screenshot for writing"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='screenshot-writer', daemon=True)
+            self.thread.start()
+        self.queue.put((path, data, image_format, quality))
+        
+    def flush(self):
+        """Wait until every queued screenshot is on disk"""
+        self.queue.join()
+        
+    def resolve(self, filename: str) -> str:
+        """Filename holding the image of a (possibly duplicate) screenshot"""
+        with self.lock:
+            return self.aliases.get(filename, filename)
+            
+    def thumbnail(self, filename: str) -> Optional[str]:
+        """Relative path of a stored screenshot's thumbnail, if it has one"""
+        with self.lock:
+            if filename in self.thumbnails:
+                return f"thumbs/{Path(filename).stem}.jpg"
+        return None
+        
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"stored": self.stored, "duplicates": len(self.aliases)}
+            
+    def _run(self):
+        while True:
+            path, data, image_format, quality = self.queue.get()
+            try:
+                image = None
+                if image_format == 'webp' or self.dedup == 'perceptual':
+                    image = Image.open(io.BytesIO(data))
+                if self.dedup != 'off':
+                    original = self._find_duplicate(path.name, image, data)
+                    if original:
+                        with self.lock:
+                            self.aliases[path.name] = original
+                        continue
+                if image_format == 'webp':
+                    image.save(path, 'WEBP', quality=quality)
+                else:
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                with self.lock:
+                    self.stored += 1
+                if self.thumbnail_width:
+                    self._write_thumbnail(path, image or Image.open(io.BytesIO(data)))
+            except Exception as e:
+                print(f"  Could not save screenshot {path.name}: {e}")
+            finally:
+                self.queue.task_done()
+                
+    def _write_thumbnail(self, path: Path, image):
+        thumbs_dir = path.parent / "thumbs"
+        thumbs_dir.mkdir(exist_ok=True)
+        thumbnail = image.convert('RGB')
+        thumbnail.thumbnail((self.thumbnail_width, self.thumbnail_width * 4))
+        thumbnail.save(thumbs_dir / f"{path.stem}.jpg", 'JPEG', quality=70)
+        with self.lock:
+            self.thumbnails.add(path.name)
+            
+    def _find_duplicate(self, filename: str, image, data: bytes) -> Optional[str]:
+        """Return the stored screenshot this one duplicates, or remember it as new"""
+        perceptual = self.dedup == 'perceptual'
+        key = self._perceptual_hash(image) if perceptual else hashlib.sha1(data).hexdigest()
+        original = self.hashes.get(key)
+        if original is None and perceptual and self.dedup_distance > 0:
+            original = next((
+                self.hashes[other] for other in reversed(self.latest)
+                if bin(key ^ other).count('1') <= self.dedup_distance
+            ), None)
+        if original is None:
+            self.hashes[key] = filename
+            self.latest = self.latest[-(self.recent - 1):] + [key]
+        return original
+        
+    def _perceptual_hash(self, image) -> int:
+        """
+        Difference hash of a grayscale thumbnail: two bits per neighbouring
+        pair of cells, to the right and below, for brighter and darker, so
+        edges of either polarity count and flat areas hash to zeros
+        """
+        size = self.hash_size
+        width = size + 1
+        pixels = list(image.convert('L').resize((width, width), Image.BILINEAR).getdata())
+        bits = 0
+        for row in range(size):
+            for col in range(size):
+                pixel = pixels[row * width + col]
+                for neighbour in (pixels[row * width + col + 1], pixels[(row + 1) * width + col]):
+                    # Small tolerance so JPEG noise doesn't count as an edge
+                    bits = (bits << 2) | ((pixel > neighbour + 2) << 1) | (pixel < neighbour - 2)
+        return bits
+
 
 class PlaywrightTestBase:
     """Base class for Playwright tests with automatic execution logging"""
@@ -35,11 +260,53 @@ class PlaywrightTestBase:
         self.browser: Optional[Browser] = None
         self.context: Optional[BrowserContext] = None
         self.report_dir: Optional[Path] = None
-        self.execution_log: List[Dict[str, Any]] = []
+        # PLAYWRIGHT_BROWSER_POOL=1 runs in a page leased from browser_pool.py's
+        # logged-in Chromium instead of a freshly launched browser
+        self.use_browser_pool = os.getenv('PLAYWRIGHT_BROWSER_POOL') == '1'
+        self.browser_lease = None
+        self.steps_logged = 0  # Entries in the JSONL step log
+        self.report_page_size = 50  # Steps per report page
+        self.summary_interval = 100  # Steps between compactions into execution_summary.json
         self.step_counter = 0
+        self.log_prefix = ""  # Printed before console step lines
         self.session_started = datetime.now()
         self.max_wait_time = 30000  # Maximum time to wait for page to stabilize 
-        self.hash_check_interval = 200  # Check hash interval
+        self.settle_quiet_time = 1000  # Time without DOM changes or requests that counts as stable
+        self.long_request_time = 5000  # Requests open longer than this are treated as background
+        self.settle_waits = 0
+        
+        # Screenshot policy and encoding (png, jpeg or webp; quality applies to the lossy ones)
+        self.screenshot_mode = os.getenv('SCREENSHOT_MODE', 'after-only')
+        self.screenshot_format = os.getenv('SCREENSHOT_FORMAT', 'png').lower()
+        self.screenshot_quality = int(os.getenv('SCREENSHOT_QUALITY', 80))
+        self.screenshot_every = self._parse_screenshot_mode(self.screenshot_mode)
+        if self.screenshot_format == 'jpg':
+            self.screenshot_format = 'jpeg'
+        if self.screenshot_format not in ('png', 'jpeg', 'webp'):
+            raise ValueError(f"SCREENSHOT_FORMAT must be png, jpeg or webp, not {self.screenshot_format!r}")
+        if self.screenshot_format == 'webp' and Image is None:
+            print("Pillow is not installed - saving PNG screenshots instead of WebP")
+            self.screenshot_format = 'png'
+        # Repeated screenshots are stored once: exact, perceptual (within
+        # SCREENSHOT_DEDUP_DISTANCE bits) or off. A perceptual hash can miss
+        # small text changes such as a typed value, so exact is the default.
+        self.screenshot_dedup = os.getenv('SCREENSHOT_DEDUP', 'exact').lower()
+        self.screenshot_dedup_distance = int(os.getenv('SCREENSHOT_DEDUP_DISTANCE', 0))
+        if self.screenshot_dedup not in ('exact', 'perceptual', 'off'):
+            raise ValueError(f"SCREENSHOT_DEDUP must be exact, perceptual or off, not {self.screenshot_dedup!r}")
+        if self.screenshot_dedup == 'perceptual' and Image is None:
+            print("Pillow is not installed - deduplicating identical screenshots only")
+            self.screenshot_dedup = 'exact'
+        self.screenshot_writer = ScreenshotWriter(self.screenshot_dedup, self.screenshot_dedup_distance)
+        self.last_page_state = None
+        
+    def _parse_screenshot_mode(self, mode: str) -> int:
+        """Validate a screenshot mode; returns N for every-N, else 0"""
+        if mode.startswith('every-') and mode[6:].isdigit() and int(mode[6:]) > 0:
+            return int(mode[6:])
+        if mode not in SCREENSHOT_MODES or mode == 'every-N':
+            raise ValueError(f"SCREENSHOT_MODE must be one of {', '.join(SCREENSHOT_MODES)}, not {mode!r}")
+        return 0
         
     def setup_report_directory(self):
         """Create report directory for this test run"""
@@ -49,17 +316,60 @@ class PlaywrightTestBase:
         return self.report_dir
         
     def _take_screenshot(self, name: str, description: str = "") -> str:
-        """Take a screenshot and save to report directory"""
+        """Capture a screenshot; it is written to the report directory in the background"""
         if self.page and self.report_dir:
-            filename = f"{self.step_counter:03d}_{name}.png"
-            filepath = self.report_dir / filename
-            self.page.screenshot(path=str(filepath))
+            extension = 'jpg' if self.screenshot_format == 'jpeg' else self.screenshot_format
+            filename = f"{self.step_counter:03d}_{name}.{extension}"
+            if self.screenshot_format == 'jpeg':
+                data = self.page.screenshot(type='jpeg', quality=self.screenshot_quality)
+            else:
+                data = self.page.screenshot(type='png')
+            self.screenshot_writer.submit(
+                self.report_dir / filename, data, self.screenshot_format, self.screenshot_quality
+            )
             return filename
         return ""
         
+    def _should_take_screenshot(self, method: str, error: Exception = None) -> bool:
+        """Apply the screenshot mode to a finished step"""
+        mode = self.screenshot_mode
+        if error:
+            return mode != 'none'
+        if mode in ('none', 'on-error') or method in PASSIVE_METHODS:
+            return False
+        if self.screenshot_every:
+            return self.step_counter % self.screenshot_every == 0
+        if mode == 'on-change':
+            return self._page_changed()
+        return True
+        
+    def _page_changed(self) -> bool:
+        """True if the page navigated or had DOM/network activity since the last check"""
+        try:
+            state = self.page.evaluate(PAGE_STATE_JS)
+        except Exception:
+            return True
+        changed = state[2] is None or state != self.last_page_state
+        self.last_page_state = state
+        return changed
+        
     def _log_command(self, command: str, method: str, args: tuple, kwargs: dict, 
                      result: Any = None, error: Exception = None):
         """Log command execution details"""
+        log_entry = self._new_log_entry(command, method, args, kwargs, result, error)
+                
+        # Take after screenshot, as the screenshot mode allows
+        if method == "screenshot" and result:
+            log_entry["after_screenshot"] = result
+        elif self._should_take_screenshot(method, error):
+            log_entry["after_screenshot"] = self._take_screenshot(f"after_{method}", f"After {log_entry['command']}")
+        
+        self._append_step(log_entry)
+        self._print_step(log_entry, result, error)
+        
+    def _new_log_entry(self, command: str, method: str, args: tuple, kwargs: dict,
+                       result: Any = None, error: Exception = None) -> Dict[str, Any]:
+        """Number the next step and describe its command and outcome"""
         self.step_counter += 1
         
         # Format command string
@@ -70,15 +380,11 @@ class PlaywrightTestBase:
         else:
             command_str = command
             
-        # Take before screenshot
-        before_screenshot = self._take_screenshot(f"before_{method}", f"Before {command_str}")
-        
         # Create log entry
         log_entry = {
             "step": self.step_counter,
             "command": command_str,
             "timestamp": datetime.now().isoformat(),
-            "before_screenshot": before_screenshot,
         }
         
         # Execute and capture result/error
@@ -90,40 +396,97 @@ class PlaywrightTestBase:
             log_entry["status"] = "SUCCESS"
             if result is not None:
                 log_entry["output"] = f"Result: {result}"
-                
-        # Take after screenshot
-        after_screenshot = self._take_screenshot(f"after_{method}", f"After {command_str}")
-        log_entry["after_screenshot"] = after_screenshot
+        return log_entry
         
-        self.execution_log.append(log_entry)
-        self._save_execution_summary()
-        
-        # Print to console
-        print(f"[Step {self.step_counter}] {command_str}")
+    def _print_step(self, log_entry: Dict[str, Any], result: Any = None, error: Exception = None):
+        """Print to console"""
+        print(f"{self.log_prefix}[Step {log_entry['step']}] {log_entry['command']}")
         if error:
-            print(f"  ERROR: {error}")
+            print(f"{self.log_prefix}  ERROR: {error}")
         elif result is not None:
-            print(f"  Result: {result}")
+            print(f"{self.log_prefix}  Result: {result}")
             
-    def _save_execution_summary(self):
-        """Save execution summary to JSON file"""
-        if self.report_dir:
-            summary = {
-                "test_name": self.test_name,
-                "session_started": self.session_started.isoformat(),
-                "last_updated": datetime.now().isoformat(),
-                "total_commands": len(self.execution_log),
-                "commands": self.execution_log
-            }
+    def _append_step(self, entry: Dict[str, Any]):
+        """Append a step to the JSON Lines step log, compacting it every summary_interval steps"""
+        if self._write_step(entry):
+            self._save_execution_summary()
+            
+    def _write_step(self, entry: Dict[str, Any]) -> bool:
+        """Append a step to the JSON Lines step log; True when a compaction is due"""
+        self.steps_logged += 1
+        if not self.report_dir:
+            return False
+        with open(self.report_dir / "execution_steps.jsonl", 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+        return self.steps_logged % self.summary_interval == 0
             
-            summary_path = self.report_dir / "execution_summary.json"
-            with open(summary_path, 'w', encoding='utf-8') as f:
-                json.dump(summary, f, indent=2)
+    def _iter_step_lines(self):
+        """Yield the raw JSON lines of the step log"""
+        steps_path = self.report_dir / "execution_steps.jsonl" if self.report_dir else None
+        if not steps_path or not steps_path.exists():
+            return
+        with open(steps_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+                    
+    def _iter_steps(self):
+        """Yield logged steps in order, skipping a line cut short by a crash"""
+        for line in self._iter_step_lines():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
                 
+    def _save_execution_summary(self):
+        """Compact the step log into execution_summary.json"""
+        if not self.report_dir:
+            return
+        # Duplicate screenshots are pointed at the stored file
+        self.screenshot_writer.flush()
+        header = json.dumps({
+            "test_name": self.test_name,
+            "session_started": self.session_started.isoformat(),
+            "last_updated": datetime.now().isoformat(),
+            "total_commands": self.steps_logged,
+            "screenshots": self.screenshot_writer.stats()
+        })
+        summary_path = self.report_dir / "execution_summary.json"
+        temp_path = summary_path.with_suffix(".json.tmp")
+        # Steps are copied line by line, never loaded as a whole
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(header[:-1] + ', "commands": [')
+            separator = "\n"
+            for line in self._iter_step_lines():
+                try:
+                    step = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if self._resolve_screenshots(step):
+                    line = json.dumps(step)
+                f.write(separator + line)
+                separator = ",\n"
+            f.write("\n]}\n")
+        os.replace(temp_path, summary_path)
+                
+    def _resolve_screenshots(self, step: Dict[str, Any]) -> bool:
+        """Point a step's duplicate screenshots at the stored files; True if any changed"""
+        changed = False
+        for field in ('before_screenshot', 'after_screenshot'):
+            if step.get(field):
+                stored = self.screenshot_writer.resolve(step[field])
+                if stored != step[field]:
+                    step[field] = stored
+                    changed = True
+        return changed
+        
     def _generate_html_report(self):
-        """Generate HTML report from execution log"""
+        """Generate HTML report from the step log, writing one step at a time"""
         if not self.report_dir:
             return
+        self._save_execution_summary()
+        screenshots = self.screenshot_writer.stats()
             
         html_content = f"""
 <!DOCTYPE html>
@@ -186,6 +549,23 @@ class PlaywrightTestBase:
             border-radius: 3px;
             cursor: pointer;
         }}
+        .pagination {{
+            margin: 20px 0;
+            text-align: center;
+        }}
+        .pagination a, .pagination span {{
+            display: inline-block;
+            padding: 5px 10px;
+            margin: 0 2px;
+            border-radius: 3px;
+            background-color: white;
+            color: #333;
+            text-decoration: none;
+        }}
+        .pagination .current {{
+            background-color: #333;
+            color: white;
+        }}
         .screenshot-label {{
             font-weight: bold;
             margin-bottom: 5px;
@@ -233,88 +613,110 @@ class PlaywrightTestBase:
     <div class="header">
         <h1>{self.test_name} - Test Execution Report</h1>
         <p>Started: {self.session_started.strftime('%Y-%m-%d %H:%M:%S')}</p>
-        <p>Total Steps: {len(self.execution_log)}</p>
+        <p>Total Steps: {self.steps_logged}</p>
+        <p>Screenshots: {screenshots['stored']} stored, {screenshots['duplicates']} duplicates shared</p>
     </div>
 """
 
-        for step in self.execution_log:
-            status_class = "success" if step["status"] == "SUCCESS" else "error"
-            html_content += f"""
+        # One page per report_page_size steps: report.html, report_page_2.html, ...
+        pages = max(1, math.ceil(self.steps_logged / self.report_page_size))
+        for stale in self.report_dir.glob("report_page_*.html"):
+            stale.unlink()
+        steps = self._iter_steps()
+        for page in range(1, pages + 1):
+            navigation = self._render_pagination_html(page, pages)
+            with open(self.report_dir / self._report_page_name(page), 'w', encoding='utf-8') as f:
+                f.write(html_content + navigation)
+                for step in itertools.islice(steps, self.report_page_size):
+                    self._resolve_screenshots(step)
+                    f.write(self._render_step_html(step))
+                f.write(navigation + REPORT_FOOTER_HTML)
+            
+        report_path = self.report_dir / "report.html"
+        print(f"\nHTML report generated: {report_path}" + (f" ({pages} pages)" if pages > 1 else ""))
+        
+    def _report_page_name(self, page: int) -> str:
+        return "report.html" if page == 1 else f"report_page_{page}.html"
+        
+    def _render_pagination_html(self, page: int, pages: int) -> str:
+        """Links to the first, last, neighbouring and nearby report pages"""
+        if pages == 1:
+            return ""
+        links = []
+        if page > 1:
+            links.append(f'<a href="{self._report_page_name(page - 1)}">&laquo; Previous</a>')
+        shown = sorted({1, pages, *range(max(1, page - 3), min(pages, page + 3) + 1)})
+        last_shown = 0
+        for number in shown:
+            if number > last_shown + 1:
+                links.append('<span>&hellip;</span>')
+            if number == page:
+                links.append(f'<span class="current">{number}</span>')
+            else:
+                links.append(f'<a href="{self._report_page_name(number)}">{number}</a>')
+            last_shown = number
+        if page < pages:
+            links.append(f'<a href="{self._report_page_name(page + 1)}">Next &raquo;</a>')
+        return f'\n    <div class="pagination">{" ".join(links)}</div>\n'
+        
+    def _render_step_html(self, step: Dict[str, Any]) -> str:
+        """Render one step of the HTML report"""
+        status_class = "success" if step["status"] == "SUCCESS" else "error"
+        html_content = f"""
     <div class="step">
         <div class="step-header">
             <h3>Step {step['step']}</h3>
             <span class="{status_class}">{step['status']}</span>
         </div>
-        <div class="command">{step['command']}</div>
+        <div class="command">{html.escape(step['command'])}</div>
         <small>Timestamp: {step['timestamp']}</small>
 """
-            
-            if step.get('output'):
-                html_content += f"""
+        
+        if step.get('output'):
+            html_content += f"""
         <div style="margin-top: 10px;">
-            <strong>Output:</strong> {step['output']}
+            <strong>Output:</strong> {html.escape(str(step['output']))}
         </div>
 """
-            
-            if step.get('error'):
-                html_content += f"""
+        
+        if step.get('error'):
+            html_content += f"""
         <div class="error-details">
-            <strong>Error:</strong> {step['error']}
-            {step.get('traceback', '')}
+            <strong>Error:</strong> {html.escape(step['error'])}
+            {html.escape(step.get('traceback', ''))}
         </div>
 """
+        
+        # Add screenshots
+        if step.get('before_screenshot') or step.get('after_screenshot'):
+            html_content += '<div class="screenshots">'
             
-            # Add screenshots
-            if step.get('before_screenshot') or step.get('after_screenshot'):
-                html_content += '<div class="screenshots">'
-                
-                if step.get('before_screenshot'):
-                    html_content += f"""
+            if step.get('before_screenshot'):
+                html_content += f"""
             <div class="screenshot-container">
                 <div class="screenshot-label">Before</div>
-                <img class="screenshot" src="{step['before_screenshot']}" onclick="openModal(this.src)">
+                {self._render_screenshot_html(step['before_screenshot'])}
             </div>
 """
-                
-                if step.get('after_screenshot'):
-                    html_content += f"""
+            
+            if step.get('after_screenshot'):
+                html_content += f"""
             <div class="screenshot-container">
                 <div class="screenshot-label">After</div>
-                <img class="screenshot" src="{step['after_screenshot']}" onclick="openModal(this.src)">
+                {self._render_screenshot_html(step['after_screenshot'])}
             </div>
 """
-                
-                html_content += '</div>'
             
             html_content += '</div>'
-            
-        html_content += """
-    <div id="imageModal" class="modal" onclick="closeModal()">
-        <span class="close">&times;</span>
-        <img class="modal-content" id="modalImage">
-    </div>
-    
-    <script>
-        function openModal(src) {
-            var modal = document.getElementById('imageModal');
-            var modalImg = document.getElementById('modalImage');
-            modal.style.display = "block";
-            modalImg.src = src;
-        }
         
-        function closeModal() {
-            document.getElementById('imageModal').style.display = "none";
-        }
-    </script>
-</body>
-</html>
-"""
-
-        report_path = self.report_dir / "report.html"
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-            
-        print(f"\nHTML report generated: {report_path}")
+        html_content += '</div>'
+        return html_content
+        
+    def _render_screenshot_html(self, filename: str) -> str:
+        """Lazily loaded thumbnail (or the screenshot itself) that opens the full image"""
+        source = self.screenshot_writer.thumbnail(filename) or filename
+        return (f'<img class="screenshot" src="{source}" data-full="{filename}" loading="lazy" '
+                f'decoding="async" onclick="openModal(this.dataset.full)">')
         
     # Wrapped Playwright methods that automatically log
     def goto(self, url: str, **kwargs):
@@ -374,80 +776,47 @@ class PlaywrightTestBase:
             # If scroll fails, continue anyway
             pass
             
-    def _get_page_hash(self) -> str:
-        """Calculate a hash of the current page state"""
-        try:
-            # Get page content including dynamic elements
-            content = self.page.evaluate("""
-                () => {
-                    // Get HTML content
-                    const html = document.documentElement.outerHTML;
-                    // Get all input values
-                    const inputs = Array.from(document.querySelectorAll('input, select, textarea')).map(el => ({
-                        id: el.id || el.name || '',
-                        value: el.value,
-                        checked: el.checked,
-                        selectedIndex: el.selectedIndex
-                    }));
-                    // Get visibility state of elements
-                    const visibility = Array.from(document.querySelectorAll('*')).filter(el => {
-                        const style = window.getComputedStyle(el);
-                        return style.display === 'none' || style.visibility === 'hidden';
-                    }).map(el => el.id || el.className || '');
-                    
-                    return JSON.stringify({
-                        html: html.length,  // Use length to avoid huge strings
-                        inputs: inputs,
-                        visibility: visibility,
-                        url: window.location.href,
-                        scrollY: window.scrollY,
-                        scrollX: window.scrollX
-                    });
-                }
-            """)
-            return hashlib.md5(content.encode()).hexdigest()
-        except:
-            # If hash calculation fails, return current timestamp
-            return str(time.time())
-            
-    def _wait_for_page_stable(self, initial_hash: Optional[str] = None):
-        """Wait for page to become stable by comparing hashes"""
-        if initial_hash is None:
-            initial_hash = self._get_page_hash()
-            
-        stable_count = 0
-        stable_threshold = 3  # Page must be stable for 3 consecutive checks
-        last_hash = initial_hash
-        start_time = time.time()
-        
-        while (time.time() - start_time) * 1000 < self.max_wait_time:
-            time.sleep(self.hash_check_interval / 1000)  # Convert to seconds
-            current_hash = self._get_page_hash()
-            
-            if current_hash == last_hash:
-                stable_count += 1
-                if stable_count >= stable_threshold:
-                    # Page has been stable, now wait 2 more seconds
-                    time.sleep(2)
-                    return
-            else:
-                stable_count = 0
-                last_hash = current_hash
-                
-        # If we timeout, just continue
-        time.sleep(2)  # Final 2 second wait
+    def _install_settle_tracker(self):
+        """Install the settle tracker in every document the context loads from now on"""
+        if self.context:
+            self.context.add_init_script(f"({SETTLE_TRACKER_JS})()")
+
+    def _wait_for_page_stable(self):
+        """
+        Wait until the page has had no DOM mutations and no fetch/XHR
+        activity for settle_quiet_time ms. The tracker runs in the page, so
+        this is a single wait on the Python side; on timeout we just continue.
+        """
+        self.settle_waits += 1
+        deadline = time.time() + self.max_wait_time / 1000
+        while time.time() < deadline:
+            try:
+                self.page.wait_for_function(
+                    PAGE_SETTLED_JS,
+                    arg={
+                        'token': self.settle_waits,
+                        'quietMs': self.settle_quiet_time,
+                        'longRequestMs': self.long_request_time
+                    },
+                    timeout=max((deadline - time.time()) * 1000, 1),
+                    polling=100
+                )
+                return
+            except PlaywrightTimeoutError:
+                return
+            except PlaywrightError:
+                # The page navigated mid-wait - wait on the new document
+                time.sleep(0.1)
     
     def click(self, selector: str, **kwargs):
         """Click element with logging"""
         try:
-            # Get initial page state
-            initial_hash = self._get_page_hash()
             # Scroll to element first
             self._scroll_to_element(selector)
             self.page.click(selector, **kwargs)
             self._log_command(f"click('{selector}')", "click", (selector,), kwargs)
             # Wait for page to stabilize
-            self._wait_for_page_stable(initial_hash)
+            self._wait_for_page_stable()
         except Exception as e:
             self._log_command(f"click('{selector}')", "click", (selector,), kwargs, error=e)
             raise
@@ -455,19 +824,17 @@ class PlaywrightTestBase:
     def fill(self, selector: str, value: str, **kwargs):
         """Fill input with logging"""
         try:
-            # Get initial page state
-            initial_hash = self._get_page_hash()
             # Scroll to element first
             self._scroll_to_element(selector)
             self.page.fill(selector, value, **kwargs)
             self._log_command(f"fill('{selector}', '{value}')", "fill", (selector, value), kwargs)
             # Wait for page to stabilize
-            self._wait_for_page_stable(initial_hash)
+            self._wait_for_page_stable()
         except Exception as e:
             self._log_command(f"fill('{selector}', '{value}')", "fill", (selector, value), kwargs, error=e)
             raise
             
-    # Removed wait_for_timeout - use automatic hash-based waiting instead
+    # Removed wait_for_timeout - use automatic settle-based waiting instead
             
     def wait_for_selector(self, selector: str, **kwargs):
         """Wait for selector with logging"""
@@ -506,10 +873,17 @@ class PlaywrightTestBase:
             raise
             
     def screenshot(self, name: str, description: str = ""):
-        """Take a screenshot with logging"""
+        """
+        Take a screenshot with logging. Returns the file in the report
+        directory that holds the image once it is written - an earlier
+        file if it duplicates one.
+        """
         filename = self._take_screenshot(name, description)
         self._log_command(f"screenshot('{name}')", "screenshot", (name,), {"description": description}, filename)
-        return filename
+        if not filename:
+            return filename
+        self.screenshot_writer.flush()
+        return self.screenshot_writer.resolve(filename)
         
     def set_viewport_size(self, viewport: dict):
         """Set viewport size with logging"""
@@ -541,14 +915,12 @@ class PlaywrightTestBase:
     def check(self, selector: str, **kwargs):
         """Check checkbox with logging"""
         try:
-            # Get initial page state
-            initial_hash = self._get_page_hash()
             # Scroll to element first
             self._scroll_to_element(selector)
             self.page.check(selector, **kwargs)
             self._log_command(f"check('{selector}')", "check", (selector,), kwargs)
             # Wait for page to stabilize
-            self._wait_for_page_stable(initial_hash)
+            self._wait_for_page_stable()
         except Exception as e:
             self._log_command(f"check('{selector}')", "check", (selector,), kwargs, error=e)
             raise
@@ -556,14 +928,12 @@ class PlaywrightTestBase:
     def uncheck(self, selector: str, **kwargs):
         """Uncheck checkbox with logging"""
         try:
-            # Get initial page state
-            initial_hash = self._get_page_hash()
             # Scroll to element first
             self._scroll_to_element(selector)
             self.page.uncheck(selector, **kwargs)
             self._log_command(f"uncheck('{selector}')", "uncheck", (selector,), kwargs)
             # Wait for page to stabilize
-            self._wait_for_page_stable(initial_hash)
+            self._wait_for_page_stable()
         except Exception as e:
             self._log_command(f"uncheck('{selector}')", "uncheck", (selector,), kwargs, error=e)
             raise
@@ -593,33 +963,30 @@ class PlaywrightTestBase:
                 
             def click(self, **kwargs):
                 try:
-                    initial_hash = self._base._get_page_hash()
                     self._base._scroll_to_locator(self._locator)
                     self._locator.click(**kwargs)
                     self._base._log_command(f"{self._desc}.click()", "click", (), kwargs)
-                    self._base._wait_for_page_stable(initial_hash)
+                    self._base._wait_for_page_stable()
                 except Exception as e:
                     self._base._log_command(f"{self._desc}.click()", "click", (), kwargs, error=e)
                     raise
                     
             def fill(self, value: str, **kwargs):
                 try:
-                    initial_hash = self._base._get_page_hash()
                     self._base._scroll_to_locator(self._locator)
                     self._locator.fill(value, **kwargs)
                     self._base._log_command(f"{self._desc}.fill('{value}')", "fill", (value,), kwargs)
-                    self._base._wait_for_page_stable(initial_hash)
+                    self._base._wait_for_page_stable()
                 except Exception as e:
                     self._base._log_command(f"{self._desc}.fill('{value}')", "fill", (value,), kwargs, error=e)
                     raise
                     
             def check(self, **kwargs):
                 try:
-                    initial_hash = self._base._get_page_hash()
                     self._base._scroll_to_locator(self._locator)
                     self._locator.check(**kwargs)
                     self._base._log_command(f"{self._desc}.check()", "check", (), kwargs)
-                    self._base._wait_for_page_stable(initial_hash)
+                    self._base._wait_for_page_stable()
                 except Exception as e:
                     self._base._log_command(f"{self._desc}.check()", "check", (), kwargs, error=e)
                     raise
@@ -657,11 +1024,10 @@ class PlaywrightTestBase:
                 
             def set_input_files(self, files, **kwargs):
                 try:
-                    initial_hash = self._base._get_page_hash()
                     self._locator.set_input_files(files, **kwargs)
                     files_str = files if isinstance(files, str) else ', '.join(files)
                     self._base._log_command(f"{self._desc}.set_input_files('{files_str}')", "set_input_files", (files,), kwargs)
-                    self._base._wait_for_page_stable(initial_hash)
+                    self._base._wait_for_page_stable()
                 except Exception as e:
                     files_str = files if isinstance(files, str) else ', '.join(files)
                     self._base._log_command(f"{self._desc}.set_input_files('{files_str}')", "set_input_files", (files,), kwargs, error=e)
@@ -676,14 +1042,12 @@ class PlaywrightTestBase:
     def select_option(self, selector: str, value, **kwargs):
         """Select dropdown option with logging"""
         try:
-            # Get initial page state
-            initial_hash = self._get_page_hash()
             # Scroll to element first
             self._scroll_to_element(selector)
             self.page.select_option(selector, value, **kwargs)
             self._log_command(f"select_option('{selector}', {repr(value)})", "select_option", (selector, value), kwargs)
             # Wait for page to stabilize
-            self._wait_for_page_stable(initial_hash)
+            self._wait_for_page_stable()
         except Exception as e:
             self._log_command(f"select_option('{selector}', {repr(value)})", "select_option", (selector, value), kwargs, error=e)
             raise
@@ -713,13 +1077,11 @@ class PlaywrightTestBase:
     def set_input_files(self, selector: str, files, **kwargs):
         """Set input files with logging"""
         try:
-            # Get initial page state
-            initial_hash = self._get_page_hash()
             self.page.set_input_files(selector, files, **kwargs)
             files_str = files if isinstance(files, str) else ', '.join(files)
             self._log_command(f"set_input_files('{selector}', '{files_str}')", "set_input_files", (selector, files), kwargs)
             # Wait for page to stabilize
-            self._wait_for_page_stable(initial_hash)
+            self._wait_for_page_stable()
         except Exception as e:
             files_str = files if isinstance(files, str) else ', '.join(files)
             self._log_command(f"set_input_files('{selector}', '{files_str}')", "set_input_files", (selector, files), kwargs, error=e)
@@ -728,8 +1090,6 @@ class PlaywrightTestBase:
     def locator_click(self, locator_expression: str, index: int = 0):
         """Click on a locator element with logging and scrolling"""
         try:
-            # Get initial page state
-            initial_hash = self._get_page_hash()
             locator = self.page.locator(locator_expression)
             if index > 0:
                 locator = locator.nth(index)
@@ -738,7 +1098,7 @@ class PlaywrightTestBase:
             locator.click()
             self._log_command(f"locator('{locator_expression}').nth({index}).click()", "locator_click", (locator_expression, index), {})
             # Wait for page to stabilize
-            self._wait_for_page_stable(initial_hash)
+            self._wait_for_page_stable()
         except Exception as e:
             self._log_command(f"locator('{locator_expression}').nth({index}).click()", "locator_click", (locator_expression, index), {}, error=e)
             raise
@@ -746,8 +1106,6 @@ class PlaywrightTestBase:
     def locator_fill(self, locator_expression: str, value: str, index: int = 0):
         """Fill a locator element with logging and scrolling"""
         try:
-            # Get initial page state
-            initial_hash = self._get_page_hash()
             locator = self.page.locator(locator_expression)
             if index > 0:
                 locator = locator.nth(index)
@@ -756,7 +1114,7 @@ class PlaywrightTestBase:
             locator.fill(value)
             self._log_command(f"locator('{locator_expression}').nth({index}).fill('{value}')", "locator_fill", (locator_expression, value, index), {})
             # Wait for page to stabilize
-            self._wait_for_page_stable(initial_hash)
+            self._wait_for_page_stable()
         except Exception as e:
             self._log_command(f"locator('{locator_expression}').nth({index}).fill('{value}')", "locator_fill", (locator_expression, value, index), {}, error=e)
             raise
@@ -773,7 +1131,7 @@ class PlaywrightTestBase:
                 self.setup_report_directory()
                 
                 # Initial log entry
-                self.execution_log.append({
+                self._append_step({
                     "step": 0,
                     "command": "Session initialized",
                     "timestamp": datetime.now().isoformat(),
@@ -781,20 +1139,33 @@ class PlaywrightTestBase:
                     "output": "Browser started with Chromium"
                 })
                 
-                # Launch browser
-                self.browser = p.chromium.launch(
-                    headless=False,
-                    args=['--ignore-certificate-errors']
-                )
-                
-                # Create context
-                self.context = self.browser.new_context(
-                    viewport={'width': 1920, 'height': 1080},
-                    ignore_https_errors=True
-                )
-                
-                # Create page
-                self.page = self.context.new_page()
+                # Lease a warm page from the browser pool if asked to
+                if self.use_browser_pool:
+                    from browser_pool import open_lease
+                    self.browser_lease = open_lease(p, owner=self.test_name)
+                    
+                if self.browser_lease:
+                    # The pool's context is shared, so the tracker goes on our page only
+                    self.page = self.browser_lease.page
+                    self.page.set_viewport_size({'width': 1920, 'height': 1080})
+                    self.page.add_init_script(f"({SETTLE_TRACKER_JS})()")
+                else:
+                    # Launch browser
+                    self.browser = p.chromium.launch(
+                        headless=False,
+                        args=['--ignore-certificate-errors']
+                    )
+                    
+                    # Create context
+                    self.context = self.browser.new_context(
+                        viewport={'width': 1920, 'height': 1080},
+                        ignore_https_errors=True
+                    )
+                    
+                    self._install_settle_tracker()
+                    
+                    # Create page
+                    self.page = self.context.new_page()
                 
                 # Run the actual test
                 self.run_test()
@@ -814,4 +1185,6 @@ class PlaywrightTestBase:
                 if self.context:
                     self.context.close()
                 if self.browser:
-                    self.browser.close()
\ No newline at end of file
+                    self.browser.close()
+                if self.browser_lease:
+                    self.browser_lease.close()
\ No newline at end of file
@@ -0,0 +1,436 @@
+"""
+Asyncio variant of the Playwright test base class
+Several sessions share one browser, each with its own context, page, step log,
+screenshots and HTML report, so sites can be generated and verified in parallel
+from a single process
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from playwright.async_api import async_playwright, Browser
+from playwright.async_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+from typing import Any, Optional, List
+
+from playwright_base import (
+    PlaywrightTestBase, SETTLE_TRACKER_JS, PAGE_SETTLED_JS, PAGE_STATE_JS, PASSIVE_METHODS
+)
+
+# Scrolls an element (or the first match of a selector) into view before it is used
+SCROLL_INTO_VIEW_JS = """
+(element) => {
+    element.scrollIntoView({
+        behavior: 'smooth',
+        block: 'center',
+        inline: 'center'
+    });
+}
+"""
+
+
+class AsyncPlaywrightTestBase(PlaywrightTestBase):
+    """
+    One page session driven through async Playwright, with the same logging
+    wrappers as PlaywrightTestBase. Run a single test with execute(), or
+    many in one browser with run_sessions().
+    Step logging, screenshots and reports are inherited; report generation
+    and log compaction run in a worker thread so other sessions keep going.
+    """
+
+    def __init__(self, test_name: str, session: str = ""):
+        super().__init__(test_name)
+        self.session = session  # Tells apart report directories of concurrent runs of one test
+        self.log_prefix = f"[{test_name}{':' + session if session else ''}] "
+        self.owns_browser = False
+
+    def setup_report_directory(self):
+        """Create report directory for this session"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suffix = f"_{self.session}" if self.session else ""
+        self.report_dir = Path("reports") / f"{self.test_name}_{timestamp}{suffix}"
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        return self.report_dir
+
+    async def _take_screenshot(self, name: str, description: str = "") -> str:
+        """Capture a screenshot; it is written to the report directory in the background"""
+        if self.page and self.report_dir:
+            extension = 'jpg' if self.screenshot_format == 'jpeg' else self.screenshot_format
+            filename = f"{self.step_counter:03d}_{name}.{extension}"
+            if self.screenshot_format == 'jpeg':
+                data = await self.page.screenshot(type='jpeg', quality=self.screenshot_quality)
+            else:
+                data = await self.page.screenshot(type='png')
+            self.screenshot_writer.submit(
+                self.report_dir / filename, data, self.screenshot_format, self.screenshot_quality
+            )
+            return filename
+        return ""
+
+    async def _should_take_screenshot(self, method: str, error: Exception = None) -> bool:
+        """Apply the screenshot mode to a finished step"""
+        if self.screenshot_mode == 'on-change' and not error and method not in PASSIVE_METHODS:
+            return await self._page_changed()
+        return PlaywrightTestBase._should_take_screenshot(self, method, error)
+
+    async def _page_changed(self) -> bool:
+        """True if the page navigated or had DOM/network activity since the last check"""
+        try:
+            state = await self.page.evaluate(PAGE_STATE_JS)
+        except Exception:
+            return True
+        changed = state[2] is None or state != self.last_page_state
+        self.last_page_state = state
+        return changed
+
+    async def _log_command(self, command: str, method: str, args: tuple, kwargs: dict,
+                           result: Any = None, error: Exception = None):
+        """Log command execution details"""
+        log_entry = self._new_log_entry(command, method, args, kwargs, result, error)
+
+        # Take after screenshot, as the screenshot mode allows
+        if method == "screenshot" and result:
+            log_entry["after_screenshot"] = result
+        elif await self._should_take_screenshot(method, error):
+            log_entry["after_screenshot"] = await self._take_screenshot(f"after_{method}", f"After {log_entry['command']}")
+
+        if self._write_step(log_entry):
+            await asyncio.to_thread(self._save_execution_summary)
+        self._print_step(log_entry, result, error)
+
+    async def _step(self, command: str, method: str, args: tuple, kwargs: dict, action,
+                    scroll=None, settle: bool = False, log_result: bool = False):
+        """
+        Run one logged page action: scroll its target (a selector or
+        locator) into view, await the action, log it and optionally wait
+        for the page to settle. Failures are logged and re-raised.
+        """
+        try:
+            if isinstance(scroll, str):
+                await self._scroll_to_element(scroll)
+            elif scroll is not None:
+                await self._scroll_to_locator(scroll)
+            result = await action
+            await self._log_command(command, method, args, kwargs, result if log_result else None)
+            if settle:
+                await self._wait_for_page_stable()
+            return result
+        except Exception as e:
+            await self._log_command(command, method, args, kwargs, error=e)
+            raise
+
+    async def _scroll_to_element(self, selector: str):
+        """Scroll element into view before interacting with it"""
+        try:
+            element = await self.page.query_selector(selector)
+            if element:
+                await element.evaluate(SCROLL_INTO_VIEW_JS)
+                # Give a moment for smooth scroll to complete
+                await asyncio.sleep(0.3)
+        except Exception:
+            # If scroll fails, continue anyway
+            pass
+
+    async def _scroll_to_locator(self, locator):
+        """Scroll locator element into view"""
+        try:
+            if await locator.count() > 0:
+                await locator.first.evaluate(SCROLL_INTO_VIEW_JS)
+                await asyncio.sleep(0.3)
+        except Exception:
+            pass
+
+    async def _install_settle_tracker(self):
+        """Install the settle tracker in every document the context loads from now on"""
+        if self.context:
+            await self.context.add_init_script(f"({SETTLE_TRACKER_JS})()")
+
+    async def _wait_for_page_stable(self):
+        """
+        Wait until the page has had no DOM mutations and no fetch/XHR
+        activity for settle_quiet_time ms; on timeout we just continue.
+        """
+        self.settle_waits += 1
+        deadline = time.time() + self.max_wait_time / 1000
+        while time.time() < deadline:
+            try:
+                await self.page.wait_for_function(
+                    PAGE_SETTLED_JS,
+                    arg={
+                        'token': self.settle_waits,
+                        'quietMs': self.settle_quiet_time,
+                        'longRequestMs': self.long_request_time
+                    },
+                    timeout=max((deadline - time.time()) * 1000, 1),
+                    polling=100
+                )
+                return
+            except PlaywrightTimeoutError:
+                return
+            except PlaywrightError:
+                # The page navigated mid-wait - wait on the new document
+                await asyncio.sleep(0.1)
+
+    # Wrapped Playwright methods that automatically log
+    async def goto(self, url: str, **kwargs):
+        """Navigate to URL with logging"""
+        return await self._step(f"goto('{url}')", "goto", (url,), kwargs,
+                                self.page.goto(url, **kwargs), settle=True, log_result=True)
+
+    async def click(self, selector: str, **kwargs):
+        """Click element with logging"""
+        await self._step(f"click('{selector}')", "click", (selector,), kwargs,
+                         self.page.click(selector, **kwargs), scroll=selector, settle=True)
+
+    async def fill(self, selector: str, value: str, **kwargs):
+        """Fill input with logging"""
+        await self._step(f"fill('{selector}', '{value}')", "fill", (selector, value), kwargs,
+                         self.page.fill(selector, value, **kwargs), scroll=selector, settle=True)
+
+    async def wait_for_selector(self, selector: str, **kwargs):
+        """Wait for selector with logging"""
+        result = await self._step(f"wait_for_selector('{selector}')", "wait_for_selector", (selector,), kwargs,
+                                  self.page.wait_for_selector(selector, **kwargs), log_result=True)
+        # Scroll to element after it appears
+        await self._scroll_to_element(selector)
+        return result
+
+    def locator(self, selector: str):
+        """Get locator (not logged until action is performed)"""
+        return self.page.locator(selector)
+
+    async def count(self, selector: str) -> int:
+        """Count elements matching selector with logging"""
+        return await self._step(f"count('{selector}')", "count", (selector,), {},
+                                self.page.locator(selector).count(), log_result=True)
+
+    async def evaluate(self, expression: str, *args):
+        """Evaluate JavaScript with logging"""
+        return await self._step(f"evaluate('{expression[:50]}...')", "evaluate", (expression,), {},
+                                self.page.evaluate(expression, *args), log_result=True)
+
+    async def screenshot(self, name: str, description: str = ""):
+        """Take a screenshot with logging; returns the file holding the image, see the sync base"""
+        filename = await self._take_screenshot(name, description)
+        await self._log_command(f"screenshot('{name}')", "screenshot", (name,), {"description": description}, filename)
+        if not filename:
+            return filename
+        await asyncio.to_thread(self.screenshot_writer.flush)
+        return self.screenshot_writer.resolve(filename)
+
+    async def set_viewport_size(self, viewport: dict):
+        """Set viewport size with logging"""
+        await self._step(f"set_viewport_size({viewport})", "set_viewport_size", (viewport,), {},
+                         self.page.set_viewport_size(viewport))
+
+    async def keyboard_press(self, key: str):
+        """Press keyboard key with logging"""
+        await self._step(f"keyboard.press('{key}')", "keyboard_press", (key,), {},
+                         self.page.keyboard.press(key))
+
+    async def wait_for_stable(self):
+        """Wait for page to become stable"""
+        await self._step("wait_for_stable()", "wait_for_stable", (), {}, self._wait_for_page_stable())
+
+    async def check(self, selector: str, **kwargs):
+        """Check checkbox with logging"""
+        await self._step(f"check('{selector}')", "check", (selector,), kwargs,
+                         self.page.check(selector, **kwargs), scroll=selector, settle=True)
+
+    async def uncheck(self, selector: str, **kwargs):
+        """Uncheck checkbox with logging"""
+        await self._step(f"uncheck('{selector}')", "uncheck", (selector,), kwargs,
+                         self.page.uncheck(selector, **kwargs), scroll=selector, settle=True)
+
+    async def select_option(self, selector: str, value, **kwargs):
+        """Select dropdown option with logging"""
+        await self._step(f"select_option('{selector}', {repr(value)})", "select_option", (selector, value), kwargs,
+                         self.page.select_option(selector, value, **kwargs), scroll=selector, settle=True)
+
+    async def type(self, selector: str, text: str, **kwargs):
+        """Type text with logging"""
+        await self._step(f"type('{selector}', '{text}')", "type", (selector, text), kwargs,
+                         self.page.type(selector, text, **kwargs), scroll=selector)
+
+    async def hover(self, selector: str, **kwargs):
+        """Hover over element with logging"""
+        await self._step(f"hover('{selector}')", "hover", (selector,), kwargs,
+                         self.page.hover(selector, **kwargs), scroll=selector)
+
+    async def set_input_files(self, selector: str, files, **kwargs):
+        """Set input files with logging"""
+        files_str = files if isinstance(files, str) else ', '.join(files)
+        await self._step(f"set_input_files('{selector}', '{files_str}')", "set_input_files", (selector, files), kwargs,
+                         self.page.set_input_files(selector, files, **kwargs), settle=True)
+
+    async def locator_click(self, locator_expression: str, index: int = 0):
+        """Click on a locator element with logging and scrolling"""
+        locator = self.page.locator(locator_expression)
+        if index > 0:
+            locator = locator.nth(index)
+        await self._step(f"locator('{locator_expression}').nth({index}).click()", "locator_click",
+                         (locator_expression, index), {}, locator.click(), scroll=locator, settle=True)
+
+    async def locator_fill(self, locator_expression: str, value: str, index: int = 0):
+        """Fill a locator element with logging and scrolling"""
+        locator = self.page.locator(locator_expression)
+        if index > 0:
+            locator = locator.nth(index)
+        await self._step(f"locator('{locator_expression}').nth({index}).fill('{value}')", "locator_fill",
+                         (locator_expression, value, index), {}, locator.fill(value), scroll=locator, settle=True)
+
+    def get_by_role(self, role: str, **kwargs):
+        """Get element by role with automatic interaction logging"""
+        return self._wrap_locator(self.page.get_by_role(role, **kwargs), f"get_by_role('{role}', {kwargs})")
+
+    def get_by_text(self, text: str, **kwargs):
+        """Get element by text with automatic interaction logging"""
+        return self._wrap_locator(self.page.get_by_text(text, **kwargs), f"get_by_text('{text}', {kwargs})")
+
+    def get_by_label(self, text: str, **kwargs):
+        """Get element by label with automatic interaction logging"""
+        return self._wrap_locator(self.page.get_by_label(text, **kwargs), f"get_by_label('{text}', {kwargs})")
+
+    def _wrap_locator(self, locator, description: str):
+        """Wrap a locator to add automatic logging on interaction"""
+        class LoggingLocator:
+            def __init__(self, base_locator, base_instance, desc):
+                self._locator = base_locator
+                self._base = base_instance
+                self._desc = desc
+
+            async def click(self, **kwargs):
+                await self._base._step(f"{self._desc}.click()", "click", (), kwargs,
+                                       self._locator.click(**kwargs), scroll=self._locator, settle=True)
+
+            async def fill(self, value: str, **kwargs):
+                await self._base._step(f"{self._desc}.fill('{value}')", "fill", (value,), kwargs,
+                                       self._locator.fill(value, **kwargs), scroll=self._locator, settle=True)
+
+            async def check(self, **kwargs):
+                await self._base._step(f"{self._desc}.check()", "check", (), kwargs,
+                                       self._locator.check(**kwargs), scroll=self._locator, settle=True)
+
+            async def press(self, key: str, **kwargs):
+                await self._base._step(f"{self._desc}.press('{key}')", "press", (key,), kwargs,
+                                       self._locator.press(key, **kwargs))
+
+            async def count(self):
+                return await self._base._step(f"{self._desc}.count()", "count", (), {},
+                                              self._locator.count(), log_result=True)
+
+            def first(self):
+                return self._wrap_nth(0)
+
+            def nth(self, index: int):
+                return self._wrap_nth(index)
+
+            def _wrap_nth(self, index: int):
+                nth_locator = self._locator.nth(index)
+                return self._base._wrap_locator(nth_locator, f"{self._desc}.nth({index})")
+
+            def locator(self, selector: str):
+                new_locator = self._locator.locator(selector)
+                return self._base._wrap_locator(new_locator, f"{self._desc}.locator('{selector}')")
+
+            async def set_input_files(self, files, **kwargs):
+                files_str = files if isinstance(files, str) else ', '.join(files)
+                await self._base._step(f"{self._desc}.set_input_files('{files_str}')", "set_input_files", (files,), kwargs,
+                                       self._locator.set_input_files(files, **kwargs), settle=True)
+
+            # Delegate other methods to the original locator
+            def __getattr__(self, name):
+                return getattr(self._locator, name)
+
+        return LoggingLocator(locator, self, description)
+
+    async def run_test(self):
+        """Run the test (to be implemented by subclasses)"""
+        raise NotImplementedError("Subclasses must implement run_test()")
+
+    async def start(self, browser: Browser):
+        """Open this session's context and page in a shared browser"""
+        self.setup_report_directory()
+        self._append_step({
+            "step": 0,
+            "command": "Session initialized",
+            "timestamp": datetime.now().isoformat(),
+            "status": "INITIAL",
+            "output": "Page opened in a shared Chromium browser"
+        })
+        self.browser = browser
+        self.context = await browser.new_context(
+            viewport={'width': 1920, 'height': 1080},
+            ignore_https_errors=True
+        )
+        await self._install_settle_tracker()
+        self.page = await self.context.new_page()
+
+    async def finish(self):
+        """Write the report and close this session's context"""
+        await asyncio.to_thread(self._generate_html_report)
+        if self.context:
+            await self.context.close()
+
+    async def execute_in(self, browser: Browser):
+        """Run the test in its own context of a shared browser"""
+        try:
+            await self.start(browser)
+            await self.run_test()
+            print(f"\n{self.log_prefix}{self.test_name} completed successfully!")
+        except Exception as e:
+            print(f"\n{self.log_prefix}{self.test_name} failed with error: {e}")
+            if self.page:
+                await self.screenshot("error", "Test failed")
+            raise
+        finally:
+            await self.finish()
+
+    async def execute(self, headless: bool = False):
+        """Execute the test in a browser of its own"""
+        async with async_playwright() as p:
+            browser = await launch_browser(p, headless)
+            try:
+                await self.execute_in(browser)
+            finally:
+                await browser.close()
+
+
+async def launch_browser(playwright, headless: bool = False) -> Browser:
+    """Launch Chromium with the options the sync base class uses"""
+    return await playwright.chromium.launch(
+        headless=headless,
+        args=['--ignore-certificate-errors']
+    )
+
+
+async def run_sessions(tests: List[AsyncPlaywrightTestBase], max_concurrent: Optional[int] = None,
+                       headless: bool = False) -> List[Optional[Exception]]:
+    """
+    Run tests concurrently, one context and page each, in a single browser.
+    max_concurrent caps the pages open at once (default PLAYWRIGHT_SESSIONS,
+    else all). Returns each test's exception, or None if it passed.
+    """
+    if max_concurrent is None:
+        max_concurrent = int(os.getenv('PLAYWRIGHT_SESSIONS', 0)) or len(tests)
+    slots = asyncio.Semaphore(max(max_concurrent, 1))
+
+    async def run(test):
+        async with slots:
+            try:
+                await test.execute_in(browser)
+            except Exception as e:
+                return e
+            return None
+
+    async with async_playwright() as p:
+        browser = await launch_browser(p, headless)
+        try:
+            results = await asyncio.gather(*(run(test) for test in tests))
+        finally:
+            await browser.close()
+
+    failed = sum(1 for result in results if result)
+    print(f"\n{len(tests) - failed}/{len(tests)} sessions passed")
+    return results
@@ -0,0 +1,159 @@
+"""
+Per-worker clones of the logged-in Chromium profile
+Chromium locks a profile directory, so parallel generators each need their
+own copy. Clones are made once (copy-on-write where the filesystem supports
+reflinks) and kept in sync with the master profile by copying only the
+login state - cookies, local storage and IndexedDB - between them.
+"""
+
+import os
+import time
+import fcntl
+import shutil
+import logging
+import subprocess
+from pathlib import Path
+
+logger = logging.getLogger('profile_manager')
+
+# Files and folders that hold the bolt.new login, relative to the profile
+AUTH_PATHS = (
+    'Local State',  # Holds the key cookies are encrypted with
+    'Default/Cookies',
+    'Default/Cookies-journal',
+    'Default/Local Storage',
+    'Default/IndexedDB',
+)
+
+# Not worth copying into a clone; Chromium rebuilds them
+SKIP_NAMES = (
+    'SingletonLock', 'SingletonCookie', 'SingletonSocket',
+    'Cache', 'Code Cache', 'GPUCache', 'ShaderCache', 'GrShaderCache',
+    'CacheStorage', 'Crashpad', 'BrowserMetrics'
+)
+
+
+class ProfileManager:
+    """
+    Hands out clones of master/ under clones_dir/<name>. Call checkout()
+    before launching a browser on a clone and checkin() after it closed.
+    """
+
+    def __init__(self, master, clones_dir=None):
+        self.master = Path(master)
+        self.clones_dir = Path(clones_dir) if clones_dir else self.master.with_name(self.master.name + '-clones')
+        self.clones_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.clones_dir / '.sync.lock'
+
+    def checkout(self, name):
+        """Return the clone for a worker, created or refreshed from the master's login"""
+        clone = self.clones_dir / str(name)
+        with self._locked():
+            if not (clone / 'Default').exists():
+                self._clone(clone)
+            elif self._auth_mtime(self.master) > self._auth_mtime(clone):
+                self._copy_auth(self.master, clone)
+                logger.info(f"Refreshed login state of {clone.name} from the master profile")
+            self._remove_locks(clone)
+        return clone
+
+    def checkin(self, clone):
+        """
+        Copy a clone's login state back to the master if the clone's is
+        newer (bolt.new rotated the session during the job), so the other
+        clones pick it up at their next checkout
+        """
+        clone = Path(clone)
+        with self._locked():
+            if self._auth_mtime(clone) <= self._auth_mtime(self.master):
+                return False
+            if os.path.lexists(self.master / 'SingletonLock'):
+                logger.warning("Master profile is open in a browser, not updating its login state")
+                return False
+            self._copy_auth(clone, self.master)
+            logger.info(f"Updated the master profile's login state from {clone.name}")
+            return True
+
+    def _clone(self, clone):
+        # A running browser's profile is mid-write; a copy of it may not open
+        if os.path.lexists(self.master / 'SingletonLock'):
+            raise RuntimeError(f"{self.master} is open in a browser, close it before cloning the profile")
+        started = time.time()
+        if clone.exists():
+            shutil.rmtree(clone)
+        # GNU cp shares the data blocks on btrfs/XFS; elsewhere it is a plain copy
+        result = subprocess.run(
+            ['cp', '-a', '--reflink=auto', str(self.master), str(clone)],
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            logger.warning(f"cp failed ({result.stderr.strip()}), copying the profile with Python")
+            if clone.exists():
+                shutil.rmtree(clone)
+            shutil.copytree(self.master, clone, symlinks=True, ignore=shutil.ignore_patterns(*SKIP_NAMES))
+        for path in list(clone.rglob('*')):
+            if path.name in SKIP_NAMES and os.path.lexists(path):
+                if path.is_dir() and not path.is_symlink():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink()
+        logger.info(f"Cloned {self.master} to {clone} in {time.time() - started:.1f}s")
+
+    def _copy_auth(self, source, target):
+        for relative in AUTH_PATHS:
+            src = source / relative
+            dst = target / relative
+            if not src.exists():
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            # Copy next to the target and swap it in, so a crash never leaves half a cookie DB
+            temp = dst.with_name(dst.name + '.sync-tmp')
+            if temp.is_dir():
+                shutil.rmtree(temp)
+            elif temp.exists():
+                temp.unlink()
+            if src.is_dir():
+                shutil.copytree(src, temp)
+                if dst.exists():
+                    shutil.rmtree(dst)
+            else:
+                shutil.copy2(src, temp)
+            os.replace(temp, dst)
+
+    def _auth_mtime(self, profile):
+        """Latest change to any login file of a profile"""
+        latest = 0
+        for relative in AUTH_PATHS:
+            path = profile / relative
+            if path.is_dir():
+                for entry in path.rglob('*'):
+                    latest = max(latest, entry.stat().st_mtime)
+            elif path.exists():
+                latest = max(latest, path.stat().st_mtime)
+        return latest
+
+    def _remove_locks(self, clone):
+        # Left behind when a browser on the clone was killed
+        for name in ('SingletonLock', 'SingletonCookie', 'SingletonSocket'):
+            if os.path.lexists(clone / name):
+                os.unlink(clone / name)
+
+    def _locked(self):
+        return _FileLock(self.lock_path)
+
+
+class _FileLock:
+    """Exclusive flock, shared by the threads and processes using one clones_dir"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
@@ -36,6 +36,8 @@ def load_env():
 env_vars = load_env()
 BOT_TOKEN = env_vars.get('BOT_TOKEN')
 CLAUDE_SERVER_URL = env_vars.get('CLAUDE_SERVER_URL', 'http://localhost:5555')
+# API key of the bot's client class on the execution server (optional)
+CLAUDE_API_KEY = env_vars.get('CLAUDE_API_KEY')
 
 if not BOT_TOKEN:
     print("Error: BOT_TOKEN not found in .env file")
@@ -123,14 +125,22 @@ def get_updates(offset=0):
         return []
 
 
-def execute_claude_command(prompt):
+def execute_claude_command(prompt, user_id=None):
     """Execute a Claude command via the execution server"""
+    # Each Telegram user gets their own rate limit on the server
+    headers = {'X-Client-ID': f'telegram:{user_id}'} if user_id else {}
+    if CLAUDE_API_KEY:
+        headers['X-API-Key'] = CLAUDE_API_KEY
     try:
         response = requests.post(
             f"{CLAUDE_SERVER_URL}/execute",
             json={'prompt': prompt, 'stream': False},
+            headers=headers,
             timeout=300  # 5 minute timeout for Claude execution
         )
+        if response.status_code == 429:
+            retry_after = response.headers.get('Retry-After', 'a few')
+            raise Exception(f"Too many Claude requests - try again in {retry_after} seconds")
         response.raise_for_status()
 
         result = response.json()
@@ -205,7 +215,7 @@ def handle_update(update):
         send_message(chat_id, '⏳ Processing Claude command via execution server...')
 
         try:
-            result = execute_claude_command(prompt)
+            result = execute_claude_command(prompt, user_id)
             response = f"<b>Claude Response:</b>\n\n<code>{escape_html(result)}</code>"
 
             # Split into chunks if too long (Telegram max is 4096 chars)